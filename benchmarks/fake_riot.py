@@ -0,0 +1,415 @@
+"""
+A local aiohttp stand-in for the Riot API and Data Dragon.
+
+It simulates summoners going in and out of games, so the spectator endpoint
+    answers like the real one (200 with the game, 404 when they aren't in one),
+    and keeps the ground truth of every game so a benchmark can tell how quickly
+    the cog noticed it. Latency, random 429s and 5xx, and the rate limit headers
+    are all configurable.
+
+Like Riot, summoner ids and puuids are encrypted per application (every token is
+    its own here), and an id handed to another token gets a 400.
+"""
+import asyncio
+import hashlib
+import heapq
+import itertools
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+
+DDRAGON_VERSION = "99.1.1"
+CHAMPION_IDS = list(range(1, 41))
+
+
+class FakeGame:
+    __slots__ = ("id", "platform", "start", "end", "summoner_ids")
+
+    def __init__(self, game_id: int, platform: str, start: float, end: float, summoner_ids):
+        self.id = game_id
+        self.platform = platform
+        self.start = start
+        self.end = end
+        self.summoner_ids = summoner_ids
+
+
+class FixedWindow:
+    """Counts requests the way Riot does, a window starts on its first request."""
+
+    def __init__(self, limit: int, seconds: int):
+        self.limit = limit
+        self.seconds = seconds
+        self.count = 0
+        self.resets_at = 0.0
+
+    def hit(self, now: float) -> Optional[float]:
+        """Counts a request, or returns how long to wait if the window is full."""
+        if now >= self.resets_at:
+            self.count = 0
+            self.resets_at = now + self.seconds
+        if self.count >= self.limit:
+            return self.resets_at - now
+        self.count += 1
+        return None
+
+
+def parse_limits(header: str):
+    return [tuple(int(n) for n in chunk.split(":")) for chunk in header.split(",")]
+
+
+class FakeRiot:
+    """
+    summoners maps summoner id -> platform (na1, euw1, ...).
+    Every summoner alternates between idle and in-game, with exponentially
+        distributed idle and game lengths, and some games pull in another idle
+        summoner from the same platform so the cog sees shared games too.
+    """
+
+    def __init__(
+        self,
+        summoners: Dict[str, str],
+        *,
+        latency: float = 0.05,
+        jitter: float = 0.02,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        app_limit: str = "500:1,30000:600",
+        spectator_limit: str = "20000:10",
+        game_length: float = 60.0,
+        idle_length: float = 120.0,
+        premade_rate: float = 0.2,
+        match_delay: float = 5.0,
+        rejected_keys=(),
+        seed: int = 0,
+    ):
+        self.summoners = summoners
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.app_limit = app_limit
+        self.spectator_limit = spectator_limit
+        self.game_length = game_length
+        self.idle_length = idle_length
+        self.premade_rate = premade_rate
+        # how long after a game ends match-v5 has it
+        self.match_delay = match_delay
+        # keys that get a 403, to check the cog carries on with the rest
+        self.rejected_keys = set(rejected_keys)
+        self.random = random.Random(seed)
+
+        self._app_windows = defaultdict(
+            lambda: [FixedWindow(*limit) for limit in parse_limits(app_limit)]
+        )
+        self._spectator_windows = defaultdict(
+            lambda: [FixedWindow(*limit) for limit in parse_limits(spectator_limit)]
+        )
+        self._by_platform: Dict[str, List[str]] = defaultdict(list)
+        for summoner_id, platform in summoners.items():
+            self._by_platform[platform].append(summoner_id)
+
+        self._game_ids = itertools.count(4_000_000_000)
+        self._events = []
+        self._next_start: Dict[str, float] = {}
+        self.in_game: Dict[str, FakeGame] = {}
+        self.games: Dict[int, FakeGame] = {}
+        # summoner id -> every game they finished, oldest first
+        self.finished: Dict[str, List[FakeGame]] = defaultdict(list)
+        # (endpoint, status) -> responses
+        self.responses = Counter()
+        # X-Riot-Token -> requests, to see how evenly the cog spreads them
+        self.keys = Counter()
+        self.started_at = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/ddragon/api/versions.json", self._versions)
+        self.app.router.add_get("/ddragon/cdn/{version}/data/en_US/champion.json", self._champions)
+        self.app.router.add_get(
+            "/{platform}/lol/spectator/v4/active-games/by-summoner/{summoner_id}", self._spectator
+        )
+        self.app.router.add_get(
+            "/{platform}/lol/summoner/v4/summoners/by-name/{name}", self._summoner
+        )
+        self.app.router.add_get(
+            "/{platform}/lol/league/v4/entries/by-summoner/{summoner_id}", self._league
+        )
+        # {platform} is a regional cluster (americas, europe, ...) for match-v5
+        self.app.router.add_get(
+            "/{platform}/lol/match/v5/matches/by-puuid/{puuid}/ids", self._match_ids
+        )
+        self.app.router.add_get("/{platform}/lol/match/v5/matches/{match_id}", self._match)
+
+    # world simulation
+
+    def start_world(self, now: float = None):
+        """Starts the game clock, every summoner begins idle."""
+        now = now or time.time()
+        self.started_at = now
+        for summoner_id in self.summoners:
+            self._schedule_start(summoner_id, now)
+
+    def _schedule_start(self, summoner_id: str, now: float):
+        at = now + self.random.expovariate(1 / self.idle_length)
+        self._next_start[summoner_id] = at
+        heapq.heappush(self._events, (at, "start", summoner_id))
+
+    def advance(self, now: float = None):
+        """Plays every start and end up to now."""
+        now = now or time.time()
+        while self._events and self._events[0][0] <= now:
+            at, kind, target = heapq.heappop(self._events)
+            if kind == "start":
+                # stale, they were pulled into someone else's game in the meantime
+                if self._next_start.get(target) != at or target in self.in_game:
+                    continue
+                self._start_game(target, at)
+            else:
+                game = self.games[target]
+                for summoner_id in game.summoner_ids:
+                    self.in_game.pop(summoner_id, None)
+                    self.finished[summoner_id].append(game)
+                    self._schedule_start(summoner_id, at)
+
+    def _start_game(self, summoner_id: str, now: float):
+        platform = self.summoners[summoner_id]
+        players = [summoner_id]
+        if self.random.random() < self.premade_rate:
+            idle = [s for s in self._by_platform[platform] if s not in self.in_game]
+            if len(idle) > 1:
+                buddy = self.random.choice(idle)
+                if buddy != summoner_id:
+                    players.append(buddy)
+        length = max(self.random.expovariate(1 / self.game_length), 1.0)
+        game = FakeGame(next(self._game_ids), platform, now, now + length, players)
+        self.games[game.id] = game
+        for player in players:
+            self.in_game[player] = game
+            self._next_start.pop(player, None)
+        heapq.heappush(self._events, (game.end, "end", game.id))
+
+    @staticmethod
+    def encrypt(value: str, token: str) -> str:
+        return f"{value}~{hashlib.md5(token.encode()).hexdigest()[:8]}"
+
+    @classmethod
+    def decrypt(cls, value: str, token: str) -> Optional[str]:
+        """The plain id, or None if it was encrypted for another token."""
+        plain = value.rpartition("~")[0]
+        return plain if plain and cls.encrypt(plain, token) == value else None
+
+    def _bad_id(self, endpoint: str, headers):
+        body = {"status": {"status_code": 400, "message": "Bad Request - Exception decrypting"}}
+        return self._respond(endpoint, 400, body, headers)
+
+    def game_data(self, game: FakeGame, token: str) -> dict:
+        participants = []
+        champions = self.random.sample(CHAMPION_IDS, 10)
+        tracked = list(game.summoner_ids)
+        for i in range(10):
+            summoner_id = tracked[i] if i < len(tracked) else f"filler-{game.id}-{i}"
+            participants.append(
+                {
+                    "summonerId": self.encrypt(summoner_id, token),
+                    "summonerName": summoner_id,
+                    "championId": champions[i],
+                    "teamId": 100 if i % 2 == 0 else 200,
+                    "bot": False,
+                }
+            )
+        return {
+            "gameId": game.id,
+            "platformId": game.platform.upper(),
+            "gameMode": "CLASSIC",
+            "gameType": "MATCHED_GAME",
+            "gameQueueConfigId": 420,
+            "gameStartTime": int(game.start * 1000),
+            "participants": participants,
+        }
+
+    # http
+
+    async def _delay(self):
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _rate_limit(self, request, endpoint: str):
+        """
+        Returns (headers, response) where response is an error to send instead,
+            ie. a 429 if one of the key's windows is full.
+        """
+        token = request.headers.get("X-Riot-Token")
+        if token in self.rejected_keys:
+            return {}, self._respond(endpoint, 403, {"status": {"status_code": 403}})
+        self.keys[token] += 1
+        now = time.monotonic()
+        # like Riot, every key gets its own limits in every region
+        bucket = (token, request.match_info["platform"])
+        app = self._app_windows[bucket]
+        method = self._spectator_windows[bucket] if endpoint == "spectator" else []
+        retry_after = None
+        limit_type = None
+        for kind, windows in (("application", app), ("method", method)):
+            for window in windows:
+                wait = window.hit(now)
+                if wait is not None and retry_after is None:
+                    retry_after, limit_type = wait, kind
+        headers = {
+            "X-App-Rate-Limit": self.app_limit,
+            "X-App-Rate-Limit-Count": ",".join(f"{w.count}:{w.seconds}" for w in app),
+        }
+        if method:
+            headers["X-Method-Rate-Limit"] = self.spectator_limit
+            headers["X-Method-Rate-Limit-Count"] = ",".join(
+                f"{w.count}:{w.seconds}" for w in method
+            )
+        if retry_after is None and self.random.random() < self.throttle_rate:
+            retry_after, limit_type = 1, "service"
+        if retry_after is not None:
+            headers["Retry-After"] = str(max(int(retry_after + 0.999), 1))
+            headers["X-Rate-Limit-Type"] = limit_type
+            return headers, self._respond(endpoint, 429, {"status": {"status_code": 429}}, headers)
+        if self.random.random() < self.error_rate:
+            status = self.random.choice((500, 502, 503, 504))
+            return headers, self._respond(endpoint, status, {"status": {"status_code": status}})
+        return headers, None
+
+    def _respond(self, endpoint: str, status: int, body: dict, headers=None):
+        self.responses[(endpoint, status)] += 1
+        return web.json_response(body, status=status, headers=headers)
+
+    async def _spectator(self, request):
+        await self._delay()
+        platform = request.match_info["platform"]
+        headers, error = self._rate_limit(request, "spectator")
+        if error is not None:
+            return error
+        self.advance()
+        token = request.headers.get("X-Riot-Token")
+        summoner_id = self.decrypt(request.match_info["summoner_id"], token)
+        if summoner_id is None:
+            return self._bad_id("spectator", headers)
+        game = self.in_game.get(summoner_id)
+        if game is None or game.platform != platform:
+            return self._respond("spectator", 404, {"status": {"status_code": 404}}, headers)
+        return self._respond("spectator", 200, self.game_data(game, token), headers)
+
+    async def _summoner(self, request):
+        await self._delay()
+        platform = request.match_info["platform"]
+        headers, error = self._rate_limit(request, "summoner")
+        if error is not None:
+            return error
+        name = request.match_info["name"]
+        if self.summoners.get(name) != platform:
+            return self._respond("summoner", 404, {"status": {"status_code": 404}}, headers)
+        token = request.headers.get("X-Riot-Token")
+        body = {
+            "id": self.encrypt(name, token),
+            "accountId": self.encrypt(f"acct-{name}", token),
+            "puuid": self.encrypt(f"puuid-{name}", token),
+            "name": name,
+        }
+        return self._respond("summoner", 200, body, headers)
+
+    def match_data(self, game: FakeGame, token: str) -> dict:
+        """A match-v5 payload, seeded by the game id so every fetch of it agrees."""
+        rng = random.Random(game.id)
+        participants = []
+        for i, participant in enumerate(self.game_data(game, token)["participants"]):
+            name = participant["summonerName"]
+            participants.append(
+                {
+                    "puuid": self.encrypt(f"puuid-{name}", token),
+                    "summonerId": participant["summonerId"],
+                    "summonerName": name,
+                    "championName": f"Champion {participant['championId']}",
+                    "teamId": participant["teamId"],
+                    "win": participant["teamId"] == (100 if game.id % 2 else 200),
+                    "kills": rng.randint(0, 15),
+                    "deaths": rng.randint(0, 12),
+                    "assists": rng.randint(0, 20),
+                }
+            )
+        return {
+            "metadata": {"matchId": f"{game.platform.upper()}_{game.id}"},
+            "info": {
+                "gameId": game.id,
+                "platformId": game.platform.upper(),
+                "gameDuration": int(game.end - game.start),
+                "gameEndTimestamp": int(game.end * 1000),
+                "participants": participants,
+            },
+        }
+
+    def _available(self, game: FakeGame) -> bool:
+        return game.end + self.match_delay <= time.time()
+
+    async def _match_ids(self, request):
+        await self._delay()
+        headers, error = self._rate_limit(request, "match")
+        if error is not None:
+            return error
+        self.advance()
+        puuid = self.decrypt(request.match_info["puuid"], request.headers.get("X-Riot-Token"))
+        if puuid is None:
+            return self._bad_id("match", headers)
+        summoner_id = puuid[len("puuid-") :]
+        start = int(request.query.get("startTime", 0))
+        count = int(request.query.get("count", 20))
+        games = [g for g in reversed(self.finished.get(summoner_id, [])) if g.start >= start]
+        ids = [f"{g.platform.upper()}_{g.id}" for g in games if self._available(g)][:count]
+        return self._respond("match", 200, ids, headers)
+
+    async def _match(self, request):
+        await self._delay()
+        headers, error = self._rate_limit(request, "match")
+        if error is not None:
+            return error
+        game = self.games.get(int(request.match_info["match_id"].split("_")[-1]))
+        if game is None or not self._available(game):
+            return self._respond("match", 404, {"status": {"status_code": 404}}, headers)
+        token = request.headers.get("X-Riot-Token")
+        return self._respond("match", 200, self.match_data(game, token), headers)
+
+    async def _league(self, request):
+        await self._delay()
+        headers, error = self._rate_limit(request, "league")
+        if error is not None:
+            return error
+        summoner_id = self.decrypt(
+            request.match_info["summoner_id"], request.headers.get("X-Riot-Token")
+        )
+        if summoner_id is None:
+            return self._bad_id("league", headers)
+        # the same summoner always has the same rank, and some are unranked
+        rng = random.Random(summoner_id)
+        if rng.random() < 0.3:
+            return self._respond("league", 200, [], headers)
+        entry = {
+            "queueType": "RANKED_SOLO_5x5",
+            "tier": rng.choice(["IRON", "BRONZE", "SILVER", "GOLD", "PLATINUM", "DIAMOND"]),
+            "rank": rng.choice(["I", "II", "III", "IV"]),
+            "leaguePoints": rng.randint(0, 99),
+        }
+        return self._respond("league", 200, [entry], headers)
+
+    async def _versions(self, request):
+        etag = f'"{DDRAGON_VERSION}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.responses[("ddragon", 304)] += 1
+            return web.Response(status=304)
+        self.responses[("ddragon", 200)] += 1
+        return web.json_response([DDRAGON_VERSION], headers={"ETag": etag})
+
+    async def _champions(self, request):
+        self.responses[("ddragon", 200)] += 1
+        data = {
+            f"Champ{key}": {"id": f"Champ{key}", "key": str(key), "name": f"Champion {key}"}
+            for key in CHAMPION_IDS
+        }
+        return web.json_response({"version": request.match_info["version"], "data": data})
@@ -0,0 +1,269 @@
+"""
+In-memory stand-ins for the parts of Red and Discord the League cog touches,
+    so a benchmark can run LeagueCog without a bot, a token or a data directory.
+"""
+import asyncio
+import copy
+import itertools
+import time
+from collections import Counter
+
+
+class _ValueContext:
+    """Like Red's value context manager: await it for a copy, or `async with` it to mutate."""
+
+    def __init__(self, getter, setter):
+        self._getter = getter
+        self._setter = setter
+        self._value = None
+
+    def __await__(self):
+        async def get():
+            return copy.deepcopy(self._getter())
+
+        return get().__await__()
+
+    async def __aenter__(self):
+        self._value = copy.deepcopy(self._getter())
+        return self._value
+
+    async def __aexit__(self, *exc):
+        self._setter(self._value)
+
+
+class FakeValue:
+    """A single value of a FakeGroup. Reading never creates the group, only writes do."""
+
+    def __init__(self, store: dict, key, name: str, default):
+        self._store = store
+        self._key = key
+        self._name = name
+        self._default = default
+
+    def _get(self):
+        return self._store.get(self._key, {}).get(self._name, copy.deepcopy(self._default))
+
+    def _set(self, value):
+        self._store.setdefault(self._key, {})[self._name] = copy.deepcopy(value)
+
+    def __call__(self, default=None):
+        return _ValueContext(self._get, self._set)
+
+    async def set(self, value):
+        self._set(value)
+
+    async def clear(self):
+        self._store.get(self._key, {}).pop(self._name, None)
+
+    async def set_raw(self, *keys, value):
+        data = self._store.setdefault(self._key, {})
+        current = data.setdefault(self._name, copy.deepcopy(self._default))
+        for key in keys[:-1]:
+            current = current.setdefault(key, {})
+        current[keys[-1]] = copy.deepcopy(value)
+
+    async def clear_raw(self, *keys):
+        if not keys:
+            return await self.clear()
+        current = self._store.get(self._key, {}).get(self._name, {})
+        for key in keys[:-1]:
+            current = current.get(key, {})
+        current.pop(keys[-1], None)
+
+
+class FakeGroup:
+    """One guild, member, user or the global scope, backed by a plain dict."""
+
+    def __init__(self, store: dict, key, defaults: dict):
+        self._store = store
+        self._key = key
+        self._defaults = defaults
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return FakeValue(self._store, self._key, name, self._defaults.get(name))
+
+    def _merged(self) -> dict:
+        return {**copy.deepcopy(self._defaults), **self._store.get(self._key, {})}
+
+    def _replace(self, value: dict):
+        self._store[self._key] = copy.deepcopy(value)
+
+    def all(self):
+        return _ValueContext(self._merged, self._replace)
+
+    async def set(self, value: dict):
+        self._replace(value)
+
+    async def clear(self):
+        self._store.pop(self._key, None)
+
+
+class FakeConfig:
+    """
+    Just enough of redbot.core.Config for the League cog, kept in memory.
+    Counts reads and writes so a benchmark can report how hard it leans on Config.
+    """
+
+    def __init__(self):
+        self.defaults = {"global": {}, "guild": {}, "member": {}, "user": {}, "role": {}}
+        self.data = {"global": {}, "guild": {}, "member": {}, "user": {}, "role": {}}
+        self.calls = Counter()
+
+    @classmethod
+    def get_conf(cls, cog_instance, identifier, force_registration=False, cog_name=None):
+        return cls()
+
+    def register_global(self, **defaults):
+        self.defaults["global"].update(defaults)
+
+    def register_guild(self, **defaults):
+        self.defaults["guild"].update(defaults)
+
+    def register_member(self, **defaults):
+        self.defaults["member"].update(defaults)
+
+    def register_user(self, **defaults):
+        self.defaults["user"].update(defaults)
+
+    def register_role(self, **defaults):
+        self.defaults["role"].update(defaults)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name in ("defaults", "data", "calls"):
+            raise AttributeError(name)
+        self.calls["global"] += 1
+        return FakeGroup(self.data, "global", self.defaults["global"]).__getattr__(name)
+
+    def guild_from_id(self, guild_id: int) -> FakeGroup:
+        self.calls["guild"] += 1
+        return FakeGroup(self.data["guild"], guild_id, self.defaults["guild"])
+
+    def member_from_ids(self, guild_id: int, member_id: int) -> FakeGroup:
+        self.calls["member"] += 1
+        guild = self.data["member"].setdefault(guild_id, {})
+        return FakeGroup(guild, member_id, self.defaults["member"])
+
+    def user_from_id(self, user_id: int) -> FakeGroup:
+        self.calls["user"] += 1
+        return FakeGroup(self.data["user"], user_id, self.defaults["user"])
+
+    def guild(self, guild) -> FakeGroup:
+        return self.guild_from_id(guild.id)
+
+    def member(self, member) -> FakeGroup:
+        return self.member_from_ids(member.guild.id, member.id)
+
+    def user(self, user) -> FakeGroup:
+        return self.user_from_id(user.id)
+
+    def _all(self, scope: str) -> dict:
+        self.calls[f"all_{scope}s"] += 1
+        defaults = self.defaults[scope]
+        return {
+            key: {**copy.deepcopy(defaults), **copy.deepcopy(value)}
+            for key, value in self.data[scope].items()
+        }
+
+    async def all_guilds(self) -> dict:
+        return self._all("guild")
+
+    async def all_users(self) -> dict:
+        return self._all("user")
+
+    async def all_members(self, guild=None) -> dict:
+        self.calls["all_members"] += 1
+        defaults = self.defaults["member"]
+        members = {
+            guild_id: {
+                member_id: {**copy.deepcopy(defaults), **copy.deepcopy(value)}
+                for member_id, value in guild_members.items()
+            }
+            for guild_id, guild_members in self.data["member"].items()
+            if guild_members
+        }
+        if guild is not None:
+            return members.get(guild.id, {})
+        return members
+
+    async def clear_all(self):
+        for scope in self.data.values():
+            scope.clear()
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"Guild {guild_id}"
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, channel, embed):
+        self.id = next(self._ids)
+        self.channel = channel
+        self.embed = embed
+
+
+class FakePartialMessage:
+    def __init__(self, channel, message_id: int):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, embed=None):
+        await asyncio.sleep(self.channel.latency)
+        self.channel.edits.append((time.time(), self.id, embed))
+
+
+class FakeChannel:
+    """Records every announcement instead of sending it, after `latency` seconds."""
+
+    def __init__(self, channel_id: int, guild: FakeGuild, latency: float = 0.0):
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"channel-{channel_id}"
+        self.latency = latency
+        self.sent = []
+        self.edits = []
+
+    async def send(self, content=None, embed=None):
+        await asyncio.sleep(self.latency)
+        message = FakeMessage(self, embed)
+        self.sent.append((time.time(), message.id, embed))
+        return message
+
+    def get_partial_message(self, message_id: int) -> FakePartialMessage:
+        return FakePartialMessage(self, message_id)
+
+
+class FakeBot:
+    """The handful of Red bot methods the cog calls outside of commands."""
+
+    def __init__(self, api_keys=("bench-key",)):
+        self.loop = asyncio.get_event_loop()
+        self.channels = {}
+        self.ready = asyncio.Event()
+        self.owner_messages = []
+        # api_key, api_key2, ... like an owner with several Riot keys would set them
+        self._tokens = {
+            "league": {
+                "api_key" + (str(i) if i > 1 else ""): key for i, key in enumerate(api_keys, 1)
+            }
+        }
+
+    def add_channel(self, channel: FakeChannel):
+        self.channels[channel.id] = channel
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def wait_until_ready(self):
+        await self.ready.wait()
+
+    async def get_shared_api_tokens(self, service_name: str) -> dict:
+        return dict(self._tokens.get(service_name, {}))
+
+    async def send_to_owners(self, content=None, **kwargs):
+        self.owner_messages.append(content)
@@ -0,0 +1,428 @@
+"""
+Load test for the League cog's poll loop.
+
+Runs a real LeagueCog against benchmarks.fake_riot and the in-memory fakes,
+    with N guilds x M members spread over K regions, and reports loop
+    duration, Riot requests per second, missed and late game detections
+    and memory use.
+
+With --nodes N the guilds are split between N cogs, each with its own keys,
+    that share the polling through a SQLite file like separate bot processes would.
+
+Usage, from the repository root:
+    python -m benchmarks.loadtest --guilds 20 --members 50 --regions 3 --duration 120
+"""
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Dict
+from unittest import mock
+
+from aiohttp import web
+
+from leaguecog.leaguecog import LeagueCog
+
+from .fake_riot import FakeRiot
+from .fakes import FakeBot, FakeChannel, FakeConfig, FakeGuild
+
+
+PLATFORMS = ["na1", "euw1", "eun1", "kr", "br1", "la1", "la2", "oc1", "tr1", "ru", "jp1"]
+
+
+class BenchCog(LeagueCog):
+    """LeagueCog with its data directory moved to a temp dir, recording when games are noticed."""
+
+    def __init__(self, bot, data_path: Path, node: int = 0):
+        self._bench_data_path = data_path
+        self._bench_node = node
+        # gameId -> time.time() the cog first saw the game start / end
+        self.detected_start: Dict[int, float] = {}
+        self.detected_end: Dict[int, float] = {}
+        super().__init__(bot)
+
+    def _ddragon_path(self):
+        path = self._bench_data_path / "ddragon"
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def _capture_path(self):
+        return self._bench_data_path / "captures"
+
+    def _history_path(self):
+        self._bench_data_path.mkdir(parents=True, exist_ok=True)
+        return self._bench_data_path / "history.sqlite3"
+
+    def shard_node_id(self) -> str:
+        # every node runs in this one process, so the pid can't tell them apart
+        return f"bench-node-{self._bench_node}"
+
+    async def start_game(self, game_data, trackers):
+        self.detected_start.setdefault(game_data["gameId"], time.time())
+        await super().start_game(game_data, trackers)
+
+    async def end_game(self, trackers):
+        game_id = trackers[0][0].active_game.get("gameId")
+        self.detected_end.setdefault(game_id, time.time())
+        await super().end_game(trackers)
+
+
+def make_cog(bot, data_path: Path, base_url: str, node: int = 0) -> BenchCog:
+    """A BenchCog on FakeConfig, talking to the stand-in at base_url instead of Riot."""
+    with mock.patch("leaguecog.leaguecog.Config", FakeConfig):
+        cog = BenchCog(bot, data_path, node)
+    cog.riot_base_url = base_url + "/{platform}/lol/"
+    cog.ddragon_versions_url = base_url + "/ddragon/api/versions.json"
+    cog.ddragon_champions_url = base_url + "/ddragon/cdn/{version}/data/en_US/champion.json"
+    return cog
+
+
+async def serve(app) -> tuple:
+    """Starts app on a free local port, returns (runner, base url)."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def build_population(args):
+    """
+    Returns ({summoner_id: platform}, {(guild_id, member_id): summoner_id}).
+    Members are drawn from a shared pool, so --overlap of them are registered in several guilds.
+    """
+    regions = PLATFORMS[: args.regions]
+    total = args.guilds * args.members
+    pool = max(int(total * (1 - args.overlap)), 1)
+    summoners = {f"s{i}": regions[i % len(regions)] for i in range(pool)}
+    members = {}
+    for guild in range(args.guilds):
+        for member in range(args.members):
+            index = guild * args.members + member
+            members[(1000 + guild, 10_000 + index)] = f"s{index % pool}"
+    return summoners, members
+
+
+async def register(cog, members, summoners):
+    """Looks every summoner up once through the fake summoner endpoint, like set-summoner does."""
+    looked_up = {}
+
+    async def lookup(summoner_id):
+        status, data, key_name = await cog.lookup_summoner(summoners[summoner_id], summoner_id)
+        if status == 200:
+            looked_up[summoner_id] = data, key_name
+
+    start = time.perf_counter()
+    await asyncio.gather(*(lookup(s) for s in set(members.values())))
+    elapsed = time.perf_counter() - start
+    for (guild_id, member_id), summoner_id in members.items():
+        if summoner_id not in looked_up:
+            continue
+        data, key_name = looked_up[summoner_id]
+        async with cog.config.member_from_ids(guild_id, member_id).all() as member:
+            member.update(
+                summoner_name=summoner_id,
+                puuid=data["puuid"],
+                account_id=data["accountId"],
+                summoner_id=data["id"],
+                region=summoners[summoner_id],
+                api_key=key_name,
+            )
+    return elapsed, len(looked_up)
+
+
+async def run(args) -> dict:
+    summoners, members = build_population(args)
+    # every node is its own bot with its own keys, the last --rejected-keys of each are bad
+    keys = [[f"bench-key-{n}-{i}" for i in range(1, args.keys + 1)] for n in range(args.nodes)]
+    riot = FakeRiot(
+        summoners,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        app_limit=args.app_limit,
+        spectator_limit=args.spectator_limit,
+        game_length=args.game_length,
+        idle_length=args.idle_length,
+        premade_rate=args.premade_rate,
+        match_delay=args.match_delay,
+        rejected_keys=[k for node in keys for k in node[args.keys - args.rejected_keys :]],
+        seed=args.seed,
+    )
+    runner, base = await serve(riot.app)
+
+    tracemalloc.start()
+    bots = [FakeBot(node_keys) for node_keys in keys]
+    guild_ids = sorted({guild_id for guild_id, _ in members})
+    # guilds are dealt out to the nodes in turn
+    node_of = {guild_id: i % args.nodes for i, guild_id in enumerate(guild_ids)}
+    channels = []
+    for guild_id in guild_ids:
+        channel = FakeChannel(guild_id * 10, FakeGuild(guild_id), latency=args.discord_latency)
+        bots[node_of[guild_id]].add_channel(channel)
+        channels.append(channel)
+
+    with tempfile.TemporaryDirectory() as data_path:
+        cogs = [make_cog(bot, Path(data_path) / str(n), base, n) for n, bot in enumerate(bots)]
+        for cog in cogs:
+            cog.RESULT_FIRST_DELAY = args.result_delay
+            cog.RESULTS_POLL_SECONDS = 1
+
+        register_seconds = 0.0
+        registered = 0
+        for n, cog in enumerate(cogs):
+            for guild_id in guild_ids:
+                if node_of[guild_id] != n:
+                    continue
+                guild = cog.config.guild_from_id(guild_id)
+                await guild.poll_guild_games.set(True)
+                await guild.alert_channel.set(guild_id * 10)
+            node_members = {k: v for k, v in members.items() if node_of[k[0]] == n}
+            seconds, count = await register(cog, node_members, summoners)
+            register_seconds += seconds
+            registered += count
+
+        for bot, cog in zip(bots, cogs):
+            bot.ready.set()
+            await cog._init_task
+        if args.nodes > 1:
+            shard_path = str(Path(data_path) / "shard.sqlite3")
+            for cog in cogs:
+                await cog.start_sharding(shard_path)
+            # one more round so every node knows about the ones that joined after it
+            for cog in cogs:
+                await cog._shard_beat()
+                await cog.calculate_cooldown()
+        if args.capture:
+            # kept outside the temp dir, so it can be replayed afterwards
+            cogs[0]._capture_path = lambda: Path(args.capture)
+            cogs[0].set_capture(True)
+        memory_after_setup = tracemalloc.get_traced_memory()[0]
+
+        riot.start_world()
+        await asyncio.sleep(args.duration)
+        riot.advance()
+        ended_at = time.time()
+
+        for cog in cogs:
+            cog.cog_unload()
+        # let the final flush and session close run
+        await asyncio.sleep(0.1)
+    memory_now, memory_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await runner.cleanup()
+
+    return report(
+        args,
+        cogs,
+        riot,
+        channels,
+        started_at=riot.started_at,
+        ended_at=ended_at,
+        registered=registered,
+        register_seconds=register_seconds,
+        memory={
+            "after_setup_mb": memory_after_setup / 2**20,
+            "end_mb": memory_now / 2**20,
+            "peak_mb": memory_peak / 2**20,
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+    )
+
+
+def report(args, cogs, riot, channels, started_at, ended_at, registered, register_seconds, memory):
+    """Loop timings are the first node's, detections count whichever node saw a game first."""
+    elapsed = ended_at - started_at
+    metrics = cogs[0].metrics
+    detected_start = {}
+    detected_end = {}
+    for cog in cogs:
+        for detected, seen in (
+            (detected_start, cog.detected_start),
+            (detected_end, cog.detected_end),
+        ):
+            for game_id, at in seen.items():
+                detected[game_id] = min(at, detected.get(game_id, at))
+    spectator = {
+        status: n for (endpoint, status), n in riot.responses.items() if endpoint == "spectator"
+    }
+    spectator_total = sum(spectator.values())
+
+    # Only games that started after the loop got going count,
+    #   and a game that ended before anyone could have seen it is still a miss.
+    start_latency = []
+    end_latency = []
+    missed = 0
+    late = 0
+    finished = 0
+    for game in riot.games.values():
+        detected = detected_start.get(game.id)
+        if detected is not None:
+            delay = max(detected - game.start, 0.0)
+            start_latency.append(delay)
+            if delay > args.late_after:
+                late += 1
+        elif game.end <= ended_at - args.late_after:
+            missed += 1
+        if game.end <= ended_at:
+            finished += 1
+            if game.id in detected_end:
+                end_latency.append(max(detected_end[game.id] - game.end, 0.0))
+
+    loops = metrics.loops
+    return {
+        "population": {
+            "guilds": args.guilds,
+            "members": args.guilds * args.members,
+            "unique_summoners": len(riot.summoners),
+            "regions": args.regions,
+            "nodes": args.nodes,
+            "registered": registered,
+            "registration_seconds": round(register_seconds, 3),
+        },
+        "loop": {
+            "count": loops.count,
+            "avg_seconds": round(loops.average, 4),
+            "p95_seconds_bucket": loops.quantile(0.95),
+            "refresh_timer": metrics.refresh_timer,
+            "overruns": metrics.overruns,
+            "phases_avg_ms": {
+                phase: round(hist.average * 1000, 3) for phase, hist in metrics.phases.items()
+            },
+        },
+        "riot": {
+            "spectator_requests": spectator_total,
+            "requests_per_second": round(spectator_total / elapsed, 2) if elapsed else 0.0,
+            "spectator_statuses": {str(k): v for k, v in sorted(spectator.items())},
+            "league_statuses": {
+                str(status): n
+                for (endpoint, status), n in sorted(riot.responses.items())
+                if endpoint == "league"
+            },
+            "match_statuses": {
+                str(status): n
+                for (endpoint, status), n in sorted(riot.responses.items())
+                if endpoint == "match"
+            },
+            "requests_per_key": dict(sorted(riot.keys.items())),
+            "retries_and_errors": {
+                f"{r} {m} {s}": n
+                for (r, m, s), n in metrics.responses.items()
+                if s not in ("200", "404")
+            },
+        },
+        "games": {
+            "started": len(riot.games),
+            "finished": finished,
+            "detected": len(start_latency),
+            "missed": missed,
+            f"late_over_{args.late_after:g}s": late,
+            "start_latency_p50": round(percentile(start_latency, 0.5), 3),
+            "start_latency_p95": round(percentile(start_latency, 0.95), 3),
+            "start_latency_max": round(max(start_latency, default=0.0), 3),
+            "start_latency_mean": round(statistics.mean(start_latency), 3)
+            if start_latency
+            else 0.0,
+            "end_latency_p50": round(percentile(end_latency, 0.5), 3),
+            "end_latency_p95": round(percentile(end_latency, 0.95), 3),
+        },
+        "discord": {
+            "sent": sum(len(c.sent) for c in channels),
+            "edited": sum(len(c.edits) for c in channels),
+        },
+        "config_calls": dict(sum((cog.config.calls for cog in cogs), Counter())),
+        "memory": {k: round(v, 2) for k, v in memory.items()},
+    }
+
+
+def print_report(result: dict):
+    for section, values in result.items():
+        print(f"{section}:")
+        for key, value in values.items():
+            if isinstance(value, dict):
+                value = ", ".join(f"{k}={v}" for k, v in value.items()) or "-"
+            print(f"  {key}: {value}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    population = parser.add_argument_group("population")
+    population.add_argument("--guilds", type=int, default=10)
+    population.add_argument("--members", type=int, default=20, help="members per guild")
+    population.add_argument("--regions", type=int, default=2, choices=range(1, len(PLATFORMS) + 1))
+    population.add_argument(
+        "--overlap", type=float, default=0.1, help="share of members registered in several guilds"
+    )
+
+    riot = parser.add_argument_group("fake riot")
+    riot.add_argument("--latency", type=float, default=0.05, help="seconds per Riot request")
+    riot.add_argument("--jitter", type=float, default=0.02)
+    riot.add_argument("--error-rate", type=float, default=0.01, help="share of 5xx responses")
+    riot.add_argument("--throttle-rate", type=float, default=0.005, help="share of random 429s")
+    riot.add_argument("--app-limit", default="500:1,30000:600")
+    riot.add_argument("--spectator-limit", default="20000:10")
+    riot.add_argument("--game-length", type=float, default=60.0, help="mean seconds per game")
+    riot.add_argument(
+        "--idle-length", type=float, default=120.0, help="mean seconds between games"
+    )
+    riot.add_argument("--premade-rate", type=float, default=0.2)
+    riot.add_argument(
+        "--match-delay", type=float, default=5.0, help="seconds until match-v5 has a game"
+    )
+    riot.add_argument("--keys", type=int, default=1, help="Riot API keys to give the cog")
+    riot.add_argument(
+        "--rejected-keys", type=int, default=0, help="how many of those keys Riot rejects"
+    )
+    riot.add_argument("--discord-latency", type=float, default=0.01)
+
+    run_group = parser.add_argument_group("run")
+    run_group.add_argument("--duration", type=float, default=60.0, help="seconds to run for")
+    run_group.add_argument(
+        "--late-after", type=float, default=15.0, help="seconds after which a detection is late"
+    )
+    run_group.add_argument(
+        "--nodes", type=int, default=1, help="cogs splitting the guilds and the polling"
+    )
+    run_group.add_argument(
+        "--result-delay",
+        type=float,
+        default=5.0,
+        help="seconds after a game ends the cog first looks for its result",
+    )
+    run_group.add_argument("--seed", type=int, default=0)
+    run_group.add_argument(
+        "--capture", metavar="DIR", help="record the run's Riot traffic for benchmarks.replay"
+    )
+    run_group.add_argument("--json", action="store_true", help="print the report as JSON")
+    run_group.add_argument("--verbose", action="store_true", help="show the cog's debug logs")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.ERROR)
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
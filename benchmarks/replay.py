@@ -0,0 +1,228 @@
+"""
+Replays Riot traffic recorded with [p]leagueset capture through check_games.
+
+Every summoner the capture asked the spectator endpoint about is registered in
+    one guild, and each request is answered with whatever Riot answered for that
+    path at the same point of the capture, at real or accelerated speed. The cog's
+    own limiter and scheduler decide what gets asked when, so changes to them can
+    be checked against a real night's traffic: the report compares when the replay
+    noticed each game with when production first saw it.
+
+Recorded rate limits and 429s are replayed, the -Count headers are not since they
+    describe production's request pattern rather than the replay's. Recorded network
+    errors come back as 504s.
+
+Usage, from the repository root:
+    python -m benchmarks.replay ~/.local/share/Red-DiscordBot/data/<bot>/cogs/LeagueCog/captures --speed 10
+"""
+import argparse
+import asyncio
+import bisect
+import gzip
+import json
+import logging
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from aiohttp import web
+
+from leaguecog.blitzcrank import SPECTATOR_METHOD
+
+from .fake_riot import DDRAGON_VERSION
+from .fakes import FakeBot, FakeChannel, FakeGuild
+from .loadtest import make_cog, percentile, print_report, serve
+
+
+GUILD_ID = 1000
+CHANNEL_ID = 10_000
+
+
+def load_capture(paths) -> List[dict]:
+    """Reads capture files, or every capture in a directory, oldest request first."""
+    files = []
+    for path in map(Path, paths):
+        files += sorted(path.glob("riot-*.jsonl.gz")) if path.is_dir() else [path]
+    lines = []
+    for file in files:
+        with gzip.open(file, "rt", encoding="utf-8") as f:
+            lines += [json.loads(line) for line in f if line.strip()]
+    lines.sort(key=lambda line: line["t"])
+    return lines
+
+
+class ReplayRiot:
+    """Answers Riot API requests from a capture, on a clock running `speed` times faster."""
+
+    def __init__(self, lines: List[dict], speed: float = 1.0):
+        self.speed = speed
+        self.start = lines[0]["t"]
+        self.end = lines[-1]["t"]
+        self._clock_started = None
+        # (platform, path) -> capture times and the lines recorded at them
+        self._times: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+        self._lines: Dict[Tuple[str, str], List[dict]] = defaultdict(list)
+        # gameId -> (first, last) time production saw it
+        self.games: Dict[int, List[float]] = {}
+        self.champion_ids = set()
+        self.summoners: Dict[str, str] = {}
+        self.served = defaultdict(int)
+
+        for line in lines:
+            key = (line["region"], line["path"])
+            self._times[key].append(line["t"])
+            self._lines[key].append(line)
+            if line["method"] == SPECTATOR_METHOD:
+                self.summoners[line["path"].rsplit("/", 1)[-1]] = line["region"]
+                if line["status"] == 200:
+                    seen = self.games.setdefault(line["data"]["gameId"], [line["t"], line["t"]])
+                    seen[1] = line["t"]
+                    self.champion_ids.update(
+                        p["championId"] for p in line["data"].get("participants", [])
+                    )
+
+        self.app = web.Application()
+        self.app.router.add_get("/ddragon/api/versions.json", self._versions)
+        self.app.router.add_get("/ddragon/cdn/{version}/data/en_US/champion.json", self._champions)
+        self.app.router.add_get("/{platform}/lol/{path:.*}", self._riot)
+
+    def start_clock(self):
+        self._clock_started = time.time()
+
+    def now(self) -> float:
+        """The capture time the replay has reached."""
+        return self.capture_time(time.time())
+
+    def capture_time(self, wall: float) -> float:
+        return self.start + (wall - self._clock_started) * self.speed
+
+    def _answer(self, platform: str, path: str):
+        """The last line recorded for this path by now, or the first one if it wasn't asked yet."""
+        key = (platform, path)
+        times = self._times.get(key)
+        if not times:
+            return None
+        index = bisect.bisect_right(times, self.now()) - 1
+        return self._lines[key][max(index, 0)]
+
+    async def _riot(self, request):
+        platform, path = request.match_info["platform"], request.match_info["path"]
+        line = self._answer(platform, path)
+        if line is None:
+            self.served[404] += 1
+            return web.json_response({"status": {"status_code": 404}}, status=404)
+        await asyncio.sleep(line["elapsed"] / self.speed)
+        status = line["status"] or 504
+        self.served[status] += 1
+        headers = {k: v for k, v in line["headers"].items() if not k.lower().endswith("-count")}
+        return web.json_response(line["data"], status=status, headers=headers)
+
+    async def _versions(self, request):
+        return web.json_response([DDRAGON_VERSION])
+
+    async def _champions(self, request):
+        data = {
+            f"Champ{key}": {"id": f"Champ{key}", "key": str(key), "name": f"Champion {key}"}
+            for key in self.champion_ids
+        }
+        return web.json_response({"version": request.match_info["version"], "data": data})
+
+
+async def run(args) -> dict:
+    lines = load_capture(args.paths)
+    if not lines:
+        raise SystemExit("No captured requests found.")
+    riot = ReplayRiot(lines, args.speed)
+    runner, base = await serve(riot.app)
+
+    bot = FakeBot()
+    channel = FakeChannel(CHANNEL_ID, FakeGuild(GUILD_ID))
+    bot.add_channel(channel)
+    with tempfile.TemporaryDirectory() as data_path:
+        cog = make_cog(bot, Path(data_path), base)
+        guild = cog.config.guild_from_id(GUILD_ID)
+        await guild.poll_guild_games.set(True)
+        await guild.alert_channel.set(CHANNEL_ID)
+        for member_id, (summoner_id, platform) in enumerate(riot.summoners.items(), 1):
+            async with cog.config.member_from_ids(GUILD_ID, member_id).all() as member:
+                member.update(summoner_name=summoner_id, summoner_id=summoner_id, region=platform)
+
+        bot.ready.set()
+        await cog._init_task
+        # the replay drives check_games itself, so the sleeps can follow the capture's clock
+        cog.task.cancel()
+
+        riot.start_clock()
+        while riot.now() < riot.end:
+            start = time.perf_counter()
+            await cog.check_games()
+            if cog.api_keys.limits_changed or cog.cooldown_drifted():
+                await cog.calculate_cooldown()
+            refresh_timer = await cog.config.refresh_timer()
+            cog.record_loop(time.perf_counter() - start, refresh_timer)
+            await asyncio.sleep(refresh_timer / args.speed)
+
+        cog.cog_unload()
+        await asyncio.sleep(0.1)
+    await runner.cleanup()
+
+    # positive lag means the replay noticed the game later than production did
+    lag = []
+    missed = 0
+    for game_id, (first_seen, _) in riot.games.items():
+        detected = cog.detected_start.get(game_id)
+        if detected is None:
+            missed += 1
+        else:
+            lag.append(riot.capture_time(detected) - first_seen)
+    metrics = cog.metrics
+    return {
+        "capture": {
+            "requests": len(lines),
+            "seconds": round(riot.end - riot.start, 1),
+            "summoners": len(riot.summoners),
+            "games": len(riot.games),
+            "speed": args.speed,
+        },
+        "replay": {
+            "loops": metrics.loops.count,
+            "loop_avg_seconds": round(metrics.loops.average, 4),
+            "refresh_timer": metrics.refresh_timer,
+            "requests": sum(riot.served.values()),
+            "statuses": dict(sorted(riot.served.items())),
+        },
+        "games": {
+            "detected": len(lag),
+            "missed": missed,
+            "lag_p50_seconds": round(percentile(lag, 0.5), 2),
+            "lag_p95_seconds": round(percentile(lag, 0.95), 2),
+            "lag_max_seconds": round(max(lag, default=0.0), 2),
+        },
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("paths", nargs="+", help="capture files or directories")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="how many capture seconds pass per real second"
+    )
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the cog's debug logs")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.ERROR)
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
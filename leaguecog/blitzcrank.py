@@ -1,10 +1,19 @@
 import asyncio
+import gzip
+import json
 import logging
+import random
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 import aiohttp
 import discord
 from lib2to3.pytree import Base
 from redbot.core import Config
+from redbot.core.data_manager import cog_data_path
 from xml.dom import NotFoundErr
 
 from .mixinmeta import MixInMeta
@@ -12,34 +21,281 @@ from .mixinmeta import MixInMeta
 
 log = logging.getLogger("red.creamy-cogs.league")
 
+# Riot rate limits each endpoint ("method") separately, these name the buckets.
+SUMMONER_BY_NAME_METHOD = "summoner/v4/summoners/by-name"
+SPECTATOR_METHOD = "spectator/v4/active-games/by-summoner"
+# match-v5 is served per regional cluster (americas, europe, ...) rather than per platform
+MATCH_IDS_METHOD = "match/v5/matches/by-puuid"
+MATCH_METHOD = "match/v5/matches"
+LEAGUE_METHOD = "league/v4/entries/by-summoner"
+
+DDRAGON_VERSIONS_URL = "https://ddragon.leagueoflegends.com/api/versions.json"
+DDRAGON_CHAMPIONS_URL = (
+    "https://ddragon.leagueoflegends.com/cdn/{version}/data/en_US/champion.json"
+)
+# how often the background task checks for a new patch
+DDRAGON_REFRESH_SECONDS = 6 * 60 * 60
+
+# A hung connection shouldn't be able to hold up a whole check_games loop.
+RIOT_TIMEOUT = aiohttp.ClientTimeout(total=10, sock_connect=5)
+# champion.json is a few hundred KB, give it longer than an API call
+DDRAGON_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=10)
+# 429s, 5xx and network errors are retried with capped exponential backoff and full jitter.
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8
+
+
+class CircuitBreaker:
+    """
+    Stops us spending rate limit budget on a region that keeps failing.
+
+    After `threshold` failures in a row the circuit opens and requests to the region
+        fail fast. Once `cooldown` seconds pass a single trial request is let through:
+        if it works the circuit closes, if not it stays open twice as long (up to max_cooldown).
+    """
+
+    def __init__(self, region, threshold=5, cooldown=30, max_cooldown=300):
+        self.region = region
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0
+        self.open_for = cooldown
+        self.opened_until = None
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_until is not None
+
+    def allow(self) -> bool:
+        if self.opened_until is None:
+            return True
+        if time.monotonic() >= self.opened_until and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def abandon(self):
+        """The trial request never got an answer, so let the next one try."""
+        self._trial = False
+
+    def success(self):
+        if self.opened_until is not None:
+            log.info(f"Riot API for {self.region} is responding again.")
+        self.failures = 0
+        self.open_for = self.cooldown
+        self.opened_until = None
+        self._trial = False
+
+    def failure(self):
+        self.failures += 1
+        if self._trial:
+            self._trial = False
+            self.open_for = min(self.open_for * 2, self.max_cooldown)
+            self.opened_until = time.monotonic() + self.open_for
+        elif self.opened_until is None and self.failures >= self.threshold:
+            log.warning(
+                f"Riot API for {self.region} failed {self.failures} times in a row,"
+                f" pausing requests for {self.open_for}s."
+            )
+            self.opened_until = time.monotonic() + self.open_for
+
+
+class TTLCache:
+    """
+    A dict whose entries expire `ttl` seconds after they're set, holding at most
+        `maxsize` of them: the least recently used entry goes first when it's full.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[object, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] > time.monotonic()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None or item[0] <= time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+
+class TrafficRecorder:
+    """
+    Captures every Riot API attempt riot_request makes, for replaying offline.
+
+    Each attempt is a JSON line with when it started, how long it took, the region,
+        method, path, status, rate limit headers and body. Lines are buffered and
+        appended to gzipped files in `path`, a new file is started once the current
+        one has max_bytes of JSON in it and only the newest `keep` files are kept.
+    Request headers are never recorded, so the X-Riot-Token can't end up on disk.
+    """
+
+    def __init__(self, path: Path, max_bytes=16 * 2**20, keep=5, buffer=50):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.buffer = buffer
+        self._lines = []
+        self._file = None
+        self._written = 0
+        path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _keep_header(name: str) -> bool:
+        name = name.lower()
+        return (name.startswith("x-") and "token" not in name) or name == "retry-after"
+
+    def record(self, region, method, path, status, headers, data, started, elapsed):
+        line = {
+            "t": round(started, 3),
+            "elapsed": round(elapsed, 4),
+            "region": region,
+            "method": method,
+            "path": path,
+            "status": status,
+            "headers": {k: v for k, v in (headers or {}).items() if self._keep_header(k)},
+            "data": data,
+        }
+        self._lines.append(json.dumps(line, separators=(",", ":")))
+        if len(self._lines) >= self.buffer:
+            self.flush()
+
+    def flush(self):
+        if not self._lines:
+            return
+        if self._file is None or self._written >= self.max_bytes:
+            self._rotate()
+        chunk = "\n".join(self._lines) + "\n"
+        self._lines = []
+        # appending starts a new gzip member, which every gzip reader handles
+        with gzip.open(self._file, "at", encoding="utf-8") as f:
+            f.write(chunk)
+        self._written += len(chunk)
+
+    def _rotate(self):
+        stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S-%f")
+        self._file = self.path / f"riot-{stamp}.jsonl.gz"
+        self._written = 0
+        # the new file doesn't exist yet, leave room for it
+        previous = sorted(self.path.glob("riot-*.jsonl.gz"))
+        for old in previous[: max(len(previous) - self.keep + 1, 0)]:
+            old.unlink()
+
+    def close(self):
+        self.flush()
+
+
+class Champion(NamedTuple):
+    """The only parts of a Data Dragon champion entry we need."""
+
+    id: str  # Data Dragon id, used for image urls (ie. 'MonkeyKing')
+    name: str  # display name (ie. 'Wukong')
+    key: str  # championId as a string (ie. '62')
+
+
+def build_champion_index(champlist: dict) -> Dict[int, Champion]:
+    """Indexes a Data Dragon champion.json by championId, the id the Riot API hands us."""
+    return {
+        int(champ["key"]): Champion(champ["id"], champ["name"], champ["key"])
+        for champ in champlist["data"].values()
+    }
+
+
+def normalize_name(name: str) -> str:
+    """Riot ignores case and spaces in summoner names."""
+    return "".join((name or "").split()).lower()
+
+
+def find_participants(participants: List[dict], entries) -> Dict[str, dict]:
+    """
+    entry.summoner_id -> participant, for the roster entries in a game's participant list.
+    Ids are encrypted per API key and the game may have been fetched with another key
+        than an entry's, so anyone whose id isn't there is matched by summoner name.
+    """
+    by_id = {p.get("summonerId"): p for p in participants}
+    by_name = {normalize_name(p.get("summonerName")): p for p in participants}
+    by_name.pop("", None)
+    found = {}
+    for entry in entries:
+        participant = by_id.get(entry.summoner_id) or by_name.get(
+            normalize_name(entry.summoner_name)
+        )
+        if participant:
+            found[entry.summoner_id] = participant
+    return found
+
 
 class Blitzcrank(MixInMeta):
     """
     'The time of man has come to an end.'
 
     This class is responsible for:
-        1) handling the token for Riot API.
+        1) handling the tokens for Riot API.
         2) grabbing and pulling data from Riot API.
+
+    The Riot and Data Dragon urls are class attributes, so the benchmarks can
+        point the cog at a local stand-in.
     """
 
+    riot_base_url = "https://{platform}.api.riotgames.com/lol/"
+
+    # ranks barely move during a game, an hour old is close enough for an announcement
+    RANK_TTL = 60 * 60
+    RANK_CACHE_SIZE = 5000
+    # how long an announcement's ranks are waited on before it's left as it is
+    RANK_DEADLINE = 1.5
+    RANK_MIN_BUDGET = 0.3
+    RANKED_QUEUES = ("RANKED_SOLO_5x5", "RANKED_FLEX_SR")
+    # summoner lookups by name, a name that doesn't exist is only remembered briefly
+    #   since someone may be about to rename into it
+    SUMMONER_TTL = 60 * 60
+    SUMMONER_MISS_TTL = 5 * 60
+    SUMMONER_CACHE_SIZE = 2000
+    # [p]leagueset import
+    MAX_IMPORT_ROWS = 1000
+    MAX_IMPORT_BYTES = 256 * 1024
+    ddragon_versions_url = DDRAGON_VERSIONS_URL
+    ddragon_champions_url = DDRAGON_CHAMPIONS_URL
+
     async def check_token(self):
         """logic to check token or message if not."""
         blocked = await self.config.notified_owner_missing_league_key()
         if not blocked:
-            # If we've already gotten the API token, don't re-get it from the bot.
-            if not self.api_key:
-                try:
-                    db = await self.bot.get_shared_api_tokens("league")
-                    self.api_key = db["api_key"]
-                except KeyError:
+            # If we've already gotten the API tokens, don't re-get them from the bot.
+            if not self.api_keys:
+                self.api_keys.load(await self.bot.get_shared_api_tokens("league"))
+                if not self.api_keys:
                     await self.token_expired_or_missing()
 
     async def get_riot_url(self, region):
-        """Given a region returns a Riot API url."""
+        """Given a region returns a Riot API url, the key is picked per request by riot_request."""
         await self.check_token()
-        headers = {"X-Riot-Token": str(self.api_key)}
-        basePath = f"https://{region}.api.riotgames.com/lol/"
-        return (basePath, headers)
+        return self.riot_base_url.format(platform=region)
 
     async def token_expired_or_missing(self):
         """
@@ -68,6 +324,10 @@ class Blitzcrank(MixInMeta):
             "to the portal and then clicking your name -> Apps in the top right.\n"
             "{command}"
             "\n\n"
+            "To spread polling over more keys, add them as api_key2, api_key3 and so on.\n"
+            "Summoners stay on the key they registered with, as Riot encrypts their ids per key,"
+            " so renew a key under the same name. Removing one means its summoners have to"
+            " register again.\n\n"
             "Note: These tokens are sensitive and should only be used in a private channel\n"
             "or in DM with the bot.\n"
         ).format(command="`{}set api league api_key {}`".format("!", ("<your_riot_api_key_here>")))
@@ -80,24 +340,312 @@ class Blitzcrank(MixInMeta):
         except BaseException as e:
             log.debug(e)
 
+    async def riot_request(self, region, method, path, key_name=None):
+        """
+        Makes a rate limited GET request to the Riot API.
+        Uses whichever API key has the most budget left, or key_name for requests about
+            ids only that key can read, waits on that key's limiter for both the app
+            and method buckets of the region, then feeds the response's rate limit
+            headers back into it. A key Riot rejects is dropped, and an unpinned
+            request goes out again on the next one.
+        429s, 5xx and network errors are retried, and a region that keeps failing
+            is skipped until its circuit breaker lets a trial request through.
+        Returns a tuple of (status, data), status is None if no response came back.
+        """
+        breaker = self.breakers.get(region)
+        if breaker is None:
+            breaker = self.breakers[region] = CircuitBreaker(region)
+        basePath = await self.get_riot_url(region)
+        url = f"{basePath}{path}"
+        log.debug(f"url == {url}")
+        status, data = None, {}
+        for attempt in range(MAX_RETRIES + 1):
+            key = self.api_keys.choose(region, method, key_name)
+            if key is None:
+                # every key we had (or the one we needed) was rejected, let the caller report it
+                return 401, {}
+            if not breaker.allow():
+                log.debug(f"Circuit open for {region}, skipping {method}.")
+                return None, {}
+            # let through while the circuit is open, this is the trial request
+            trial = breaker.is_open
+            response_headers = {}
+            try:
+                with self.timed("limiter_wait"):
+                    await key.limiter.acquire(region, method)
+                started, start = time.time(), time.perf_counter()
+                headers = {"X-Riot-Token": key.token}
+                async with self._session.get(url, headers=headers, timeout=RIOT_TIMEOUT) as req:
+                    key.limiter.update(region, method, req.headers, req.status)
+                    status = req.status
+                    response_headers = req.headers
+                    try:
+                        data = await req.json()
+                    except aiohttp.ContentTypeError:
+                        data = {}
+            except (asyncio.TimeoutError, aiohttp.ClientError) as error:
+                log.warning(f"Riot API request to {region} failed: {error!r}")
+                status, data = None, {}
+            except BaseException:
+                # cancelled or something unexpected: no verdict on the region,
+                #   the next request gets to be the trial
+                if trial:
+                    breaker.abandon()
+                raise
+            elapsed = time.perf_counter() - start
+            self.record_request(region, method, status, elapsed)
+            if self.recorder:
+                self.recorder.record(
+                    region, method, path, status, response_headers, data, started, elapsed
+                )
+
+            if status in (401, 403):
+                # Only this key is bad, the rest of the pool can still answer.
+                if trial:
+                    breaker.abandon()
+                self.api_keys.drop(key.name)
+                log.warning(f"Riot rejected API key '{key.name}', {len(self.api_keys)} left.")
+                if self.api_keys and key_name is None:
+                    return await self.riot_request(region, method, path)
+                return status, data
+            if status is not None and status < 500:
+                breaker.success()
+                if status != 429:
+                    return status, data
+            else:
+                breaker.failure()
+            if attempt < MAX_RETRIES:
+                # the limiter already waits out a 429's Retry-After, this just spreads us out
+                await asyncio.sleep(
+                    random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+                )
+        return status, data
+
+    def cached_ranks(self, region, summoner_ids) -> Dict[str, str]:
+        """summoner id -> ranked tier ('Gold II 54 LP', '' if unranked) of everyone cached."""
+        ranks = {}
+        for summoner_id in summoner_ids:
+            rank = self.rank_cache.get((region, summoner_id))
+            if rank is not None:
+                ranks[summoner_id] = rank
+        return ranks
+
+    async def get_ranks(self, region, summoner_ids, key_name) -> Dict[str, str]:
+        """
+        Like cached_ranks, looking whoever isn't cached up concurrently with the key
+            the ids came from. Lookups stop once the region's league-v4 budget runs low,
+            and whatever isn't back within RANK_DEADLINE is left out (it still lands
+            in the cache for next time).
+        """
+        ranks = self.cached_ranks(region, summoner_ids)
+        tasks = {
+            summoner_id: self._rank_task(region, summoner_id, key_name)
+            for summoner_id in summoner_ids
+            if summoner_id not in ranks
+        }
+        if tasks:
+            done, _ = await asyncio.wait(set(tasks.values()), timeout=self.RANK_DEADLINE)
+            for summoner_id, task in tasks.items():
+                if task in done and not task.cancelled() and task.exception() is None:
+                    if task.result() is not None:
+                        ranks[summoner_id] = task.result()
+        return ranks
+
+    def follow_ranks(self, coro):
+        """Runs an announcement's rank lookups in the background, cancelled on unload."""
+        task = asyncio.create_task(coro)
+        self._rank_followups.add(task)
+        task.add_done_callback(self._rank_followups.discard)
+
+    def _rank_task(self, region, summoner_id, key_name) -> asyncio.Task:
+        """Shares one lookup between every announcement waiting on the same summoner."""
+        key = (region, summoner_id)
+        task = self._rank_fetches.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_rank(region, summoner_id, key_name))
+            self._rank_fetches[key] = task
+            task.add_done_callback(lambda _: self._rank_fetches.pop(key, None))
+        return task
+
+    async def _fetch_rank(self, region, summoner_id, key_name) -> Optional[str]:
+        # spectator polling shares the region's app limit, leave it the bulk of the budget
+        key = self.api_keys.choose(region, LEAGUE_METHOD, key_name)
+        if key is None or key.limiter.budget(region, LEAGUE_METHOD) < self.RANK_MIN_BUDGET:
+            return None
+        status, data = await self.riot_request(
+            region, LEAGUE_METHOD, f"{LEAGUE_METHOD}/{summoner_id}", key_name
+        )
+        if status != 200:
+            return None
+        rank = self.format_rank(data)
+        self.rank_cache.set((region, summoner_id), rank)
+        return rank
+
+    @classmethod
+    def format_rank(cls, entries) -> str:
+        """'Gold II 54 LP' from a league-v4 entries list, solo queue first, '' if unranked."""
+        by_queue = {entry.get("queueType"): entry for entry in entries}
+        for queue in cls.RANKED_QUEUES:
+            entry = by_queue.get(queue)
+            if entry:
+                tier = entry["tier"].title()
+                # apex tiers only have the one division
+                if tier not in ("Master", "Grandmaster", "Challenger"):
+                    tier += f" {entry['rank']}"
+                return f"{tier} {entry['leaguePoints']} LP"
+        return ""
+
     async def simple_get(self, url):
         """
         Abstracts away simple GET HTTP calls using the cog-wide session.
         Should only be used if you don't want to handle failure/non-200 response codes.
         """
-        async with self._session.get(url) as response:
+        async with self._session.get(url, timeout=DDRAGON_TIMEOUT) as response:
             return await response.json()
 
-    async def update_version(self):
-        """This gets the most recent League API version, then updates our local list of champions"""
-        version = await self.simple_get("https://ddragon.leagueoflegends.com/api/versions.json")
-        if not self.champ_api_version:
-            self.champ_api_version = version[0]
-            self.champlist = await self.simple_get(
-                f"http://ddragon.leagueoflegends.com/cdn/{version[0]}/data/en_US/champion.json"
-            )
+    def _capture_path(self):
+        return cog_data_path(self) / "captures"
+
+    def set_capture(self, enabled: bool):
+        """Starts or stops recording Riot traffic, see TrafficRecorder."""
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+        if enabled:
+            self.recorder = TrafficRecorder(self._capture_path())
+
+    def _ddragon_path(self):
+        path = cog_data_path(self) / "ddragon"
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def load_ddragon_cache(self) -> bool:
+        """
+        Loads the champion index for the newest Data Dragon version we have on disk,
+            so the cog can start polling without waiting on Data Dragon.
+        Returns False if there is nothing cached yet.
+        """
+        path = self._ddragon_path()
+        try:
+            meta = json.loads((path / "versions.json").read_text())
+            version = meta["version"]
+            champions = json.loads((path / f"champions-{version}.json").read_text())
+        except (OSError, ValueError, KeyError):
+            return False
+        self._ddragon_meta = meta
+        self.champ_api_version, self.champions = version, {
+            int(key): Champion(*champ) for key, champ in champions.items()
+        }
+        log.debug(f"Loaded Data Dragon {version} from cache.")
+        return True
+
+    def _save_ddragon_cache(self, version, champions, meta):
+        path = self._ddragon_path()
+        (path / f"champions-{version}.json").write_text(
+            json.dumps({key: list(champ) for key, champ in champions.items()})
+        )
+        # written last, so it never points at a version whose champions aren't on disk
+        (path / "versions.json").write_text(json.dumps(meta))
+        for old in path.glob("champions-*.json"):
+            if old.name != f"champions-{version}.json":
+                old.unlink()
+
+    async def update_version(self, force=False):
+        """
+        This gets the most recent League API version, then updates our local list of champions.
+        versions.json is fetched conditionally (ETag / If-Modified-Since), so most checks are a 304.
+        """
+        meta = self._ddragon_meta
+        headers = {}
+        if not force and self.champions:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        async with self._session.get(
+            self.ddragon_versions_url, headers=headers, timeout=DDRAGON_TIMEOUT
+        ) as response:
+            if response.status == 304:
+                log.debug("Data Dragon versions unchanged.")
+                return
+            response.raise_for_status()
+            versions = await response.json(content_type=None)
+            meta = {
+                "version": versions[0],
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+        version = versions[0]
+        if version != self.champ_api_version or not self.champions:
+            log.debug(f"Loading Data Dragon {version}...")
+            champlist = await self.simple_get(self.ddragon_champions_url.format(version=version))
+            champions = build_champion_index(champlist)
+            # swap both at once, nothing can see a version without its champions
+            self.champ_api_version, self.champions = version, champions
+            self._save_ddragon_cache(version, champions, meta)
         else:
-            return
+            (self._ddragon_path() / "versions.json").write_text(json.dumps(meta))
+        self._ddragon_meta = meta
+
+    async def _ddragon_refresh(self):
+        """Checks for a new patch every few hours for as long as the cog is loaded."""
+        while True:
+            try:
+                with self.timed("ddragon_refresh"):
+                    await self.update_version()
+            except Exception as error:
+                log.exception("Failed to refresh Data Dragon:", exc_info=error)
+            await asyncio.sleep(DDRAGON_REFRESH_SECONDS)
+
+    def get_champion(self, champion_id) -> Optional[Champion]:
+        """Looks up a champion by championId, None if it isn't in our Data Dragon version."""
+        return self.champions.get(int(champion_id))
+
+    def region_server(self, region) -> Optional[str]:
+        """The platform (na1, euw1, ...) of a region as it's typed ('NA'), or of a platform itself."""
+        if not region:
+            return None
+        region = region.lower()
+        if region in self.regions:
+            return self.regions[region]["ser"]
+        if any(r["ser"] == region for r in self.regions.values()):
+            return region
+        return None
+
+    @staticmethod
+    def summoner_key(region, name) -> Tuple[str, str]:
+        return region, normalize_name(name)
+
+    async def lookup_summoner(self, region, name) -> Tuple[Optional[int], dict, Optional[str]]:
+        """
+        Looks a summoner up by name on a platform (na1, euw1, ...), same returns as riot_request
+            plus the name of the API key that answered. Riot encrypts ids per application,
+            so the ids that come back only work in requests made with that key.
+        Found summoners and 404s are cached, so retries and typos don't cost polling budget.
+        """
+        key = self.summoner_key(region, name)
+        cached = self.summoner_cache.get(key)
+        if cached:
+            return cached
+        await self.check_token()
+        while True:
+            api_key = self.api_keys.choose(region, SUMMONER_BY_NAME_METHOD)
+            if api_key is None:
+                return 401, {}, None
+            status, data = await self.riot_request(
+                region,
+                SUMMONER_BY_NAME_METHOD,
+                f"{SUMMONER_BY_NAME_METHOD}/{name}",
+                api_key.name,
+            )
+            # riot_request dropped a rejected key, any other key can look a name up
+            if status not in (401, 403):
+                break
+        if status == 200:
+            self.summoner_cache.set(key, (status, data, api_key.name))
+        elif status == 404:
+            self.summoner_cache.set(key, (status, data, api_key.name), self.SUMMONER_MISS_TTL)
+        return status, data, api_key.name
 
     async def get_summoner_info(self, ctx, name, member, region, isSelf):
         if isSelf:
@@ -108,7 +656,10 @@ class Blitzcrank(MixInMeta):
             message = await ctx.send(
                 f"Attempting to register {member} as '{name}' in {region.upper()}..."
             )
-        await asyncio.sleep(3)
+        # the pause paces lookups that go out to Riot, a cached one doesn't need it
+        server = self.region_server(region)
+        if not (server and self.summoner_key(server, name) in self.summoner_cache):
+            await asyncio.sleep(3)
 
         try:
             region = self.regions[region.lower()]["ser"]
@@ -123,211 +674,489 @@ class Blitzcrank(MixInMeta):
             )
 
         else:
-            # build the url as an f-string, can double-check 'name' in the console
-            basePath, headers = await self.get_riot_url(region)
-            if not basePath == "block":
-                url = f"{basePath}summoner/v4/summoners/by-name/{name}".format()
-                log.debug(f"url == {url}")
-                async with self._session.get(url, headers=headers) as req:
-                    try:
-                        data = await req.json()
-                    except aiohttp.ContentTypeError:
-                        data = {}
+            # riot_request logs the url, can double-check 'name' in the console
+            status, data, key_name = await self.lookup_summoner(region, name)
+            if status == 200:
+                log.debug("200")
+                currTitle = "Registration Success"
+                currType = "apiSuccess"
+                pid, acctId, smnId = (
+                    data["puuid"],
+                    data["accountId"],
+                    data["id"],
+                )
+
+                # Need to check if this summoner Id is already registered to someone in this guild..
+                self.queue_member_update(
+                    member.guild.id,
+                    member.id,
+                    summoner_name=name,
+                    puuid=pid,
+                    account_id=acctId,
+                    summoner_id=smnId,
+                    region=region.lower(),
+                    api_key=key_name,
+                )
+                await self.refresh_roster_member(member.guild.id, member.id)
+
+                currMsg = (
+                    f"Summoner now registered.\n"
+                    f"**Summoner Name**: {name}\n"
+                    f"**PUUID**: {pid}\n"
+                    f"**AccountId**: {acctId}\n"
+                    f"**SummonerId**: {smnId}"
+                )
 
-                    if req.status == 200:
-                        log.debug("200")
-                        currTitle = "Registration Success"
-                        currType = "apiSuccess"
-                        pid, acctId, smnId = (
-                            data["puuid"],
-                            data["accountId"],
-                            data["id"],
-                        )
-
-                        # Need to check if this summoner Id is already registered to someone in this guild..
-                        user = self.config.member(member)
-                        await user.summoner_name.set(name)
-                        await user.puuid.set(pid)
-                        await user.account_id.set(acctId)
-                        await user.summoner_id.set(smnId)
-                        await user.region.set(region.lower())
-
-                        currMsg = (
-                            f"Summoner now registered.\n"
-                            f"**Summoner Name**: {name}\n"
-                            f"**PUUID**: {pid}\n"
-                            f"**AccountId**: {acctId}\n"
-                            f"**SummonerId**: {smnId}"
-                        )
-
-                    else:
-                        currTitle = "Registration Failure"
-                        currType = "apiFail"
-                        if req.status == 404:
-                            currMsg = (
-                                f"Summoner '{name}' does not exist in the region {region.upper()}."
-                            )
-                        elif req.status == 401 or req.status == 403:
-                            currTitle = "Invalid Token"
-                            currType = "apiFail"
-                            currMsg = "Your Riot API token is invalid or expired."
-                            await self.token_expired_or_missing()
-                        else:
-                            currTitle = "Unexpected Error"
-                            currType = "apiFail"
-                            currMsg = f"Riot API request failed with status code {req.status}"
             else:
-                currTitle = "Invalid Token"
+                currTitle = "Registration Failure"
                 currType = "apiFail"
-                currMsg = "Your Riot API token is invalid or expired."
+                if status == 404:
+                    currMsg = f"Summoner '{name}' does not exist in the region {region.upper()}."
+                elif status == 401 or status == 403:
+                    currTitle = "Invalid Token"
+                    currType = "apiFail"
+                    currMsg = "Your Riot API token is invalid or expired."
+                    await self.token_expired_or_missing()
+                elif status is None:
+                    currTitle = "Riot API Unavailable"
+                    currType = "apiFail"
+                    currMsg = (
+                        f"The Riot API for {region.upper()} isn't responding, try again later."
+                    )
+                else:
+                    currTitle = "Unexpected Error"
+                    currType = "apiFail"
+                    currMsg = f"Riot API request failed with status code {status}"
         finally:
             embed = await self.build_embed(title=currTitle, msg=currMsg, _type=currType)
             await message.edit(content=ctx.author.mention, embed=embed)
 
+    async def register_summoners(
+        self, guild_id: int, rows: List[Tuple[discord.Member, str, Optional[str]]]
+    ) -> Dict[str, list]:
+        """
+        Registers a batch of (member, summoner name, region) rows in one go, for imports.
+        A row without a region uses the member's current one, then the guild's default.
+        Lookups run concurrently per region through riot_request, so they queue behind
+            the same limiters as polling. Everything found is written in one batch and
+            the roster is refreshed once.
+
+        Returns lists of (member, name[, reason]) under registered, not_found,
+            conflicts and failed.
+        """
+        report = {"registered": [], "not_found": [], "conflicts": [], "failed": []}
+        default_region = await self.config.guild_from_id(guild_id).default_region()
+        registered = await self.guild_members(guild_id)
+        # summoner name / id -> the member it's registered to
+        names = {data.get("summoner_name"): m for m, data in registered.items()}
+        summoner_ids = {data.get("summoner_id"): m for m, data in registered.items()}
+
+        work = {}
+        seen = set()
+        for member, name, region in rows:
+            region = self.region_server(
+                region or registered.get(member.id, {}).get("region") or default_region
+            )
+            if member.id in seen:
+                report["conflicts"].append((member, name, "member is in the import twice"))
+            elif names.get(name, member.id) != member.id:
+                report["conflicts"].append((member, name, "name is already registered"))
+            elif not region:
+                report["failed"].append((member, name, "unknown region"))
+            else:
+                seen.add(member.id)
+                work.setdefault(region, []).append((member, name, region))
+
+        found = {}
+
+        async def lookup(row):
+            found[row[0].id] = await self.lookup_summoner(row[2], row[1])
+
+        await self.run_per_region(work, lookup)
+
+        for member, name, region in (row for rows in work.values() for row in rows):
+            status, data, key_name = found.get(member.id, (None, {}, None))
+            if status == 200:
+                if summoner_ids.get(data["id"], member.id) != member.id:
+                    report["conflicts"].append((member, name, "summoner is already registered"))
+                    continue
+                summoner_ids[data["id"]] = member.id
+                self.queue_member_update(
+                    guild_id,
+                    member.id,
+                    summoner_name=name,
+                    puuid=data["puuid"],
+                    account_id=data["accountId"],
+                    summoner_id=data["id"],
+                    region=region,
+                    api_key=key_name,
+                )
+                report["registered"].append((member, name))
+            elif status == 404:
+                report["not_found"].append((member, name))
+            else:
+                report["failed"].append((member, name, f"status {status}"))
+        if any(status in (401, 403) for status, _, _ in found.values()):
+            await self.token_expired_or_missing()
+        if report["registered"]:
+            await self.refresh_roster_guild(guild_id)
+        return report
+
     async def check_games(self):
-        # Find alert channel
-        # Handle no channel set up.
-        log.debug("Looping guilds.")
-        guilds = await self.config.all_guilds()
-        for guildId in guilds:
-            guild = await self.bot.fetch_guild(guildId)
-            poll_matches = await self.config.guild(guild).poll_games()
-            if poll_matches:
-                try:
-                    channelId = await self.config.guild(guild).alert_channel()
-                    channel = self.bot.get_channel(channelId)
-                    log.debug(f"Found channel {channel}")
-                except BaseException as e:
-                    # Need to handle if no channel is setup.
-                    log.exception("No channel setup to announce matches in." + str(e))
-                # Loop through registered guild members
-                registered_users = await self.config.all_members(guild=guild)
-                log.debug("Looping members.")
-                for key, user_data in registered_users.items():
-                    member = await self.bot.get_or_fetch_member(guild, key)
-                    user = await self.bot.get_or_fetch_user(member.id)
-                    poll_user = await self.config.user(user).poll_user_games()
-                    if poll_user:
-                        basePath, headers = await self.get_riot_url(user_data["region"])
-                        if not basePath == "block":
-                            url = f"{basePath}spectator/v4/active-games/by-summoner/{user_data['summoner_id']}"
-                            async with self._session.get(url, headers=headers) as req:
-                                try:
-                                    game_data = await req.json()
-                                except aiohttp.ContentTypeError:
-                                    game_data = {}
-                                if req.status == 200:
-                                    await self.user_in_game(member, user_data, game_data, channel)
-                                elif req.status == 404:
-                                    await self.user_is_not_in_game(member, user_data, channel)
-                                elif req.status == 401 or req.status == 403:
-                                    await self.token_expired_or_missing()
-                                else:
-                                    log.warning = (
-                                        "Riot API request failed with status code {statusCode}"
-                                    ).format(statusCode=req.status)
-                        else:
-                            await self.token_expired_or_missing()
-
-    async def user_in_game(self, member: discord.Member, user_data, game_data, channel):
-        log.debug("User is in an active game")
-        if not user_data["active_game"]:
-            log.debug("User was not in a game previously.")
-            await self.start_game(member, user_data, game_data, channel)
-        # We are already tracking a game on them.
-        else:
-            tracked_game_data = user_data["active_game"]
-            if game_data["gameId"] == tracked_game_data["gameId"]:
-                log.debug("Skipped record, as we are already tracking this game.")
+        log.debug("Looping roster.")
+        with self.timed("roster"):
+            # A summoner can be registered in several guilds, only ask Riot about them once.
+            summoners = {}
+            for guild_id, members in self.roster.items():
+                for entry in members.values():
+                    # Handle no channel set up.
+                    channel = self.bot.get_channel(entry.channel_id)
+                    if not channel:
+                        log.debug(f"No channel setup to announce matches in for guild {guild_id}.")
+                        continue
+                    summoners.setdefault((entry.region, entry.summoner_id), []).append(
+                        (entry, channel)
+                    )
+            # Riot encrypts ids per API key, so the ids in a game fetched with another key
+            #   (or by another process) only match ours by name
+            names = self.shard_names(summoners)
+            summoners_by_name = {name: summoner for summoner, name in names.items()}
+
+            # With sharding on, other processes poll their slice of everyone's summoners
+            #   and we poll ours, including summoners only they have members for.
+            polled, remote = self.shard_split(summoners, names)
+
+            # Only summoners the scheduler says are due get a request of their own this loop.
+            due = self.scheduler.next_loop(polled.keys() | remote)
+
+            # Summoners sitting in a game we already announced only need one of them checked,
+            #   the rest of them follow whatever happens to that game.
+            followers = {}
+            by_game = {}
+            for summoner, trackers in polled.items():
+                game_id = trackers[0][0].active_game.get("gameId")
+                if game_id:
+                    by_game.setdefault((summoner[0], game_id), []).append(summoner)
+            for in_game in by_game.values():
+                for summoner in in_game[1:]:
+                    followers[summoner] = in_game[0]
+
+        checked_at = time.time()
+        # Check everyone else, each region from its own queue.
+        #   Summoners in a game go first so games end as close to on time as possible.
+        # (region, summoner_id) -> spectator game data, or None if they aren't in a game
+        results = {}
+        # what other processes found since our last loop doesn't need to wait for this one
+        with self.timed("shard_exchange"):
+            await self.shard_collect(results, polled.keys() | remote, summoners, names)
+        work = {}
+        to_check = [summoner for summoner in due if summoner not in followers]
+        to_check.sort(key=lambda summoner: not self.was_in_game(summoner, summoners))
+        for summoner in to_check:
+            work.setdefault(summoner[0], []).append(summoner)
+        log.debug(f"Checking {len(to_check)} of {len(polled) + len(remote)} summoners.")
+        self.metrics.checked_last_loop = len(to_check)
+        with self.timed("spectator"):
+            await self.run_per_region(
+                work,
+                lambda summoner: self.check_summoner(
+                    summoner, summoners, summoners_by_name, results
+                ),
+            )
+
+        for summoner, leader in followers.items():
+            if summoner in results or leader not in results:
+                continue
+            game_id = summoners[summoner][0][0].active_game.get("gameId")
+            leader_game = results[leader]
+            if leader_game and leader_game["gameId"] == game_id:
+                results[summoner] = leader_game
             else:
-                log.debug("They are in a different game than what we are tracking.")
-                await self.end_game(member, user_data, channel)
-                await self.start_game(member, user_data, game_data, channel)
+                # A game ends for everyone in it at once.
+                #   If they already queued into another, the next loop will find it.
+                results[summoner] = None
 
-    async def user_is_not_in_game(self, member: discord.Member, user_data, channel):
-        # Need to implement
-        if user_data["active_game"]:
-            await self.end_game(member, user_data, channel)
+        now = time.time()
+        for summoner in due | (set(results) & (polled.keys() | remote)):
+            if summoner in results:
+                in_game = results[summoner] is not None
+            else:
+                # the request failed, keep treating them how we were
+                in_game = self.was_in_game(summoner, summoners)
+            self.scheduler.schedule(summoner, in_game, now)
 
-    async def start_game(self, member: discord.Member, user_data, game_data, channel):
+        with self.timed("shard_exchange"):
+            await self.shard_exchange(
+                results, polled.keys() | remote, summoners, names, checked_at
+            )
+
+        with self.timed("update_games"):
+            await self.update_games(
+                summoners, {s: game for s, game in results.items() if s in summoners}
+            )
+
+    def was_in_game(self, summoner, summoners) -> bool:
+        """Whether we last saw a summoner in a game, before this loop's results."""
+        if summoner in summoners:
+            return bool(summoners[summoner][0][0].active_game)
+        return self.shard_in_game(summoner)
+
+    async def check_summoner(self, summoner, summoners, names, results):
+        """
+        Asks the spectator endpoint if a single summoner is in game and stores it in results.
+        Every other tracked summoner in the same match is filled in from the same response,
+            by id or by their name in names ((region, name) -> summoner).
+        """
+        region, summoner_id = summoner
+        # Someone else's response may have already told us where they are.
+        if summoner in results:
+            return
+        # only the key that looked a summoner up can read their id
+        if summoner in summoners:
+            key_name = summoners[summoner][0][0].key_name
+        else:
+            key_name = self.shard_key_name(summoner)
+        status, game_data = await self.riot_request(
+            region, SPECTATOR_METHOD, f"{SPECTATOR_METHOD}/{summoner_id}", key_name
+        )
+        if status == 200:
+            results[summoner] = game_data
+            for participant in game_data["participants"]:
+                teammate = (region, participant["summonerId"])
+                if teammate not in summoners:
+                    teammate = names.get(
+                        self.summoner_key(region, participant.get("summonerName"))
+                    )
+                if teammate:
+                    results.setdefault(teammate, game_data)
+        elif status == 404:
+            results.setdefault(summoner, None)
+        elif (status == 401 or status == 403) and self.api_keys:
+            log.warning(
+                f"API key '{key_name}' is gone, {summoner_id} in {region} has to register again."
+            )
+        elif status == 401 or status == 403:
+            await self.token_expired_or_missing()
+        elif status is None:
+            # riot_request already logged why, they'll be checked again next time they're due
+            log.debug(f"No response for {summoner_id} in {region}.")
+        else:
+            log.warning(f"Riot API request failed with status code {status}")
+
+    async def update_games(self, summoners, results):
+        """
+        Turns this loop's results into announcements, one per guild per match.
+        Games are ended before new ones are started, as the same member can be in both.
+        """
+        ended = {}
+        started = {}
+        now = time.time()
+        for summoner, game_data in results.items():
+            game_ids = {entry.active_game.get("gameId") for entry, _ in summoners[summoner]}
+            # remember when people play (and when they stopped) for the scheduler,
+            #   games we don't announce are never tracked, so the scheduler dedupes them
+            if game_data:
+                if self.scheduler.record_game(summoner, game_data["gameId"], now):
+                    self.save_activity(summoner, now, started=True)
+            elif any(game_ids):
+                self.save_activity(summoner, now)
+            for entry, channel in summoners[summoner]:
+                tracked = entry.active_game
+                new_game = game_data and game_data["gameId"] != tracked.get("gameId")
+                if tracked and (not game_data or new_game):
+                    ended.setdefault((entry.guild_id, tracked["gameId"]), []).append(
+                        (entry, channel)
+                    )
+                if new_game:
+                    key = (entry.guild_id, game_data["gameId"])
+                    if key not in started:
+                        started[key] = (game_data, [])
+                    started[key][1].append((entry, channel))
+
+        for handlers in (
+            [self.end_game(trackers) for trackers in ended.values()],
+            [self.start_game(game_data, trackers) for game_data, trackers in started.values()],
+        ):
+            # one guild failing to announce shouldn't stop the others
+            for result in await asyncio.gather(*handlers, return_exceptions=True):
+                if isinstance(result, Exception):
+                    log.exception("Failed to announce game:", exc_info=result)
+
+    @staticmethod
+    def announced_game_type(game_data) -> Optional[str]:
+        """Describes the game's queue, or returns None if it isn't a game we announce."""
+        if game_data["gameMode"] != "CLASSIC":
+            return None
+        # If it is a custom, only care if 10 non-bots.
+        playerCount = 0
+        if game_data["gameType"] == "CUSTOM_GAME":
+            for participant in game_data["participants"]:
+                if not participant["bot"]:
+                    playerCount += 1
+        # FOR DEV TESTING IN CUSTOMS <10 players, comment out line 3 of this if.
+        if not (
+            (game_data["gameType"] == "MATCHED_GAME")
+            or (game_data["gameType"] == "CUSTOM_GAME" and playerCount == 10)
+        ):
+            return None
+        if game_data["gameType"] == "CUSTOM_GAME":
+            return "custom"
+        elif game_data["gameQueueConfigId"] == 420:
+            return "ranked solo/duo"
+        elif game_data["gameQueueConfigId"] == 440:
+            return "ranked flex"
+        elif game_data["gameQueueConfigId"] in (400, 430):
+            return "normal"
+        return "unknown type:" + str(game_data["gameQueueConfigId"])
+
+    def game_teams(self, game_data):
+        """
+        Returns both teams as champion key -> name, and summoner id -> champion key
+            for putting ranks next to champions.
+        """
+        team100 = {}
+        team200 = {}
+        champ_keys = {}
+        for participant in game_data["participants"]:
+            champ = self.get_champion(participant["championId"])
+            # Champions newer than our Data Dragon version are left out.
+            if not champ:
+                continue
+            if participant.get("summonerId") and not participant.get("bot"):
+                champ_keys[participant["summonerId"]] = champ.key
+            if participant["teamId"] == 100:
+                team100[champ.key] = champ.name
+            if participant["teamId"] == 200:
+                team200[champ.key] = champ.name
+        return team100, team200, champ_keys
+
+    @staticmethod
+    def fetched_with(tracked, in_game) -> Optional[str]:
+        """
+        The key a game was fetched with: the key of any tracked summoner (summoner id -> entry)
+            whose own id is in it, in_game being find_participants' result. None if nobody's is.
+        """
+        for summoner_id, entry in tracked.items():
+            if in_game.get(summoner_id, {}).get("summonerId") == summoner_id:
+                return entry.key_name
+        return None
+
+    async def start_game(self, game_data, trackers):
+        """Announces a game for every tracked member of one guild that is in it."""
         log.debug("Seeing if duplicate game..")
         # There is a possible de-sync issue that a game can be found right after we end it due to Riot API.
         # This prevents us from posting it again.
-        games = await self.config.guild(channel.guild).posted_games()
-        if (str(game_data["gameId"]) + str(user_data["summoner_id"])) not in games:
-            log.debug("Starting game.")
-            if game_data["gameMode"] == "CLASSIC":
-                # If it is a custom, only care if 10 non-bots.
-                playerCount = 0
-                if game_data["gameType"] == "CUSTOM_GAME":
-                    for participant in game_data["participants"]:
-                        if not participant["bot"]:
-                            playerCount += 1
-                # FOR DEV TESTING IN CUSTOMS <10 players, comment out line 3 of this if.
-                if (game_data["gameType"] == "MATCHED_GAME") or (
-                    game_data["gameType"] == "CUSTOM_GAME" and playerCount == 10
-                ):
-                    if game_data["gameType"] == "CUSTOM_GAME":
-                        game_type = "custom"
-                    elif game_data["gameQueueConfigId"] == 420:
-                        game_type = "ranked solo/duo"
-                    elif game_data["gameQueueConfigId"] == 440:
-                        game_type = "ranked flex"
-                    elif game_data["gameQueueConfigId"] in (400, 430):
-                        game_type = "normal"
-                    else:
-                        game_type = "unknown type:" + str(game_data["gameQueueConfigId"])
-                    champs = self.champlist["data"]
-                    team100 = {}
-                    team200 = {}
-                    for participant in game_data["participants"]:
-                        for i in champs:
-                            loopChamp = champs[i]
-                            if str(loopChamp["key"]) == str(participant["championId"]):
-                                champId = loopChamp["id"]
-                                champName = loopChamp["name"]
-                                champKey = loopChamp["key"]
-                                if participant["summonerId"] == user_data["summoner_id"]:
-                                    liveChampName = champName
-                                    liveChampId = champId
-                                if participant["teamId"] == 100:
-                                    team100[champKey] = champName
-                                if participant["teamId"] == 200:
-                                    team200[champKey] = champName
-                    embed = await self.build_active_game(
-                        user_data["summoner_name"],
-                        game_type,
-                        liveChampName,
-                        liveChampId,
-                        team100,
-                        team200,
-                        game_data["gameStartTime"],
-                    )
-                    message = await channel.send(embed=embed)
-                    await self.config.member(member).active_game.set(
-                        value={
-                            "gameId": game_data["gameId"],
-                            "startTime": game_data["gameStartTime"],
-                            "active": True,
-                            "messageId": message.id,
-                            "guildId": message.guild.id,
-                            "champName": liveChampName,
-                            "champId": liveChampId,
-                            "team100": team100,
-                            "team200": team200,
-                        },
-                    )
-                    async with self.config.guild(channel.guild).posted_games() as games:
-                        games.append(str(game_data["gameId"]) + str(user_data["summoner_id"]))
-                    log.debug("Set active game")
-        else:
+        trackers = [
+            (entry, channel)
+            for entry, channel in trackers
+            if not self.already_posted(
+                entry.guild_id, str(game_data["gameId"]) + str(entry.summoner_id)
+            )
+        ]
+        if not trackers:
             log.debug("Skipped duplicate game.")
+            return
+        log.debug("Starting game.")
+        game_type = self.announced_game_type(game_data)
+        if not game_type:
+            return
+
+        tracked = {entry.summoner_id: entry for entry, _ in trackers}
+        in_game = find_participants(game_data["participants"], tracked.values())
+        # the participants' ids are only readable by the key the game was fetched with
+        rank_key = self.fetched_with(tracked, in_game)
+        team100, team200, champ_keys = self.game_teams(game_data)
+        live_champs = {}
+        for summoner_id, participant in in_game.items():
+            champ = self.get_champion(participant["championId"])
+            if champ:
+                live_champs[summoner_id] = champ
+            if participant["teamId"] == 100:
+                team100[champ.key] = champ.name
+            if participant["teamId"] == 200:
+                team200[champ.key] = champ.name
+        players = [
+            (entry.summoner_name, live_champs[entry.summoner_id])
+            for entry in tracked.values()
+            if entry.summoner_id in live_champs
+        ]
+        if not players:
+            return
+
+        # Ranks are a nice to have: whatever is cached goes out with the announcement,
+        #   the rest is edited in if it's looked up in time. The loop doesn't wait on them.
+        region = trackers[0][0].region
+        summoner_ranks = self.cached_ranks(region, champ_keys)
+        embed = await self.build_active_game(
+            players,
+            game_type,
+            team100,
+            team200,
+            game_data["gameStartTime"],
+            {champ_keys[s]: rank for s, rank in summoner_ranks.items()},
+        )
+        channel = trackers[0][1]
+        game_id = game_data["gameId"]
+
+        async def add_ranks():
+            summoner_ranks.update(await self.get_ranks(region, champ_keys, rank_key))
+            # the game may have already ended, and that edit mustn't be undone
+            if not any(e.active_game.get("gameId") == game_id for e in tracked.values()):
+                return
+            embed = await self.build_active_game(
+                players,
+                game_type,
+                team100,
+                team200,
+                game_data["gameStartTime"],
+                {champ_keys[s]: rank for s, rank in summoner_ranks.items()},
+            )
+            self.queue_edit(channel, ("game", channel.guild.id, game_id), embed)
+
+        async def on_sent(message):
+            for entry in tracked.values():
+                if entry.active_game.get("gameId") == game_id:
+                    entry.active_game["messageId"] = message.id
+                    self.queue_member_update(
+                        entry.guild_id, entry.member_id, active_game=entry.active_game
+                    )
+
+        # The poll loop doesn't wait on Discord, messageId is filled in once it's sent.
+        self.queue_send(channel, ("game", channel.guild.id, game_id), embed, on_sent)
+        for entry in tracked.values():
+            champ = live_champs.get(entry.summoner_id)
+            entry.active_game = {
+                "gameId": game_id,
+                "startTime": game_data["gameStartTime"],
+                "active": True,
+                "messageId": None,
+                "guildId": channel.guild.id,
+                "champName": champ.name if champ else "",
+                "champId": champ.id if champ else "",
+                "team100": team100,
+                "team200": team200,
+            }
+            self.queue_member_update(
+                entry.guild_id, entry.member_id, active_game=entry.active_game
+            )
+            self.mark_posted(entry.guild_id, str(game_data["gameId"]) + str(entry.summoner_id))
+        self.history_start(game_data, trackers)
+        # without a key that can read the ids, only the cached ranks are shown
+        if len(summoner_ranks) < len(champ_keys) and rank_key:
+            self.follow_ranks(add_ranks())
+        log.debug("Set active game")
 
-    async def end_game(self, member: discord.Member, user_data, channel):
+    async def end_game(self, trackers):
+        """Edits a game's announcement once it has ended for every tracked member in it."""
         log.debug("Ending game...")
-        message_id = await self.config.member(member).active_game.get_raw("messageId")
-        champ_id = await self.config.member(member).active_game.get_raw("champId")
-        sent_message = await channel.fetch_message(message_id)
-        embed = await self.build_end_game(user_data["summoner_name"], champ_id)
-        await sent_message.edit(embed=embed)
-        await self.config.member(member).active_game.clear_raw()
+        entry, channel = trackers[0]
+        key = ("game", entry.guild_id, entry.active_game["gameId"])
+        champ_id = entry.active_game["champId"]
+        embed = await self.build_end_game([e.summoner_name for e, _ in trackers], champ_id)
+        self.queue_edit(channel, key, embed, entry.active_game.get("messageId"))
+        self.history_end(entry.region, entry.active_game["gameId"])
+        # the result shows up in match-v5 later, that edit doesn't hold up the loop
+        self.queue_outcome(trackers, channel, key, entry.active_game.get("messageId"))
+        for entry, _ in trackers:
+            entry.active_game = {}
+            self.queue_member_update(entry.guild_id, entry.member_id, active_game={})
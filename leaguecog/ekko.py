@@ -0,0 +1,285 @@
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .blitzcrank import MATCH_IDS_METHOD, MATCH_METHOD, normalize_name
+from .mixinmeta import MixInMeta
+from .nasus import PendingResult
+
+
+log = logging.getLogger("red.creamy-cogs.league")
+
+
+class Ekko(MixInMeta):
+    """
+    'It's not how much time you have, it's how you use it.'
+
+    This class is responsible for finding out how a game went once it's over.
+
+    match-v5 only has a game some time after the spectator endpoint stops returning it.
+        Each tracked player's match ids are synced incrementally (only ids since the last
+        sync are asked for) into the game history, and the game's id showing up there is
+        how we know it's ready. Payloads are cached by match id, so a five-stack costs
+        one fetch, and concurrent fetches of the same match share one request.
+        A puuid is only readable by the API key that looked its summoner up, so each
+        player's requests go out on their own key.
+
+    Ended games wait in a queue in the history database rather than in memory, so
+        nothing is lost to a reload. A background worker looks up whatever is due
+        every RESULTS_POLL_SECONDS, backing off exponentially between attempts and
+        only spending match-v5 budget while at least RESULT_MIN_BUDGET of it is left,
+        then edits the announcement through the outbox. Polling never waits on it.
+    """
+
+    # seconds after a game ends before its first lookup, doubled after every miss
+    RESULT_FIRST_DELAY = 60
+    RESULT_BACKOFF_CAP = 15 * 60
+    MAX_RESULT_ATTEMPTS = 8
+    RESULTS_POLL_SECONDS = 10
+    RESULTS_PER_PASS = 20
+    RESULT_MIN_BUDGET = 0.2
+    # a game that started before the last sync may have finished since, so look back this far
+    MATCH_SYNC_OVERLAP = 2 * 60 * 60
+    MATCH_IDS_PAGE = 20
+
+    def match_route(self, platform: str) -> Optional[str]:
+        """The regional cluster (americas, europe, ...) serving match-v5 for a platform."""
+        for region in self.regions.values():
+            if region["ser"] == platform:
+                return region["route"]
+        return None
+
+    @staticmethod
+    def match_id(platform: str, game_id: int) -> str:
+        return f"{platform.upper()}_{game_id}"
+
+    async def sync_match_ids(
+        self, platform: str, puuid: str, key_name: str
+    ) -> Optional[List[str]]:
+        """Asks for a player's match ids since the last sync, returns the new ones or None."""
+        route = self.match_route(platform)
+        if not (self.history and route and puuid):
+            return None
+        now = time.time()
+        last = await self._history_call(self.history.last_match_sync, puuid)
+        query = f"count={self.MATCH_IDS_PAGE}"
+        if last:
+            query += f"&startTime={int(last - self.MATCH_SYNC_OVERLAP)}"
+        status, data = await self.riot_request(
+            route, MATCH_IDS_METHOD, f"{MATCH_IDS_METHOD}/{puuid}/ids?{query}", key_name
+        )
+        if status != 200:
+            return None
+        return await self._history_call(self.history.add_match_ids, puuid, data, now)
+
+    async def get_match(self, platform: str, match_id: str, key_name: str) -> Optional[dict]:
+        """A match-v5 payload from the cache, or from Riot if nobody fetched it yet."""
+        cached = await self._history_call(self.history.get_match, match_id)
+        if cached:
+            return cached
+        task = self._match_fetches.get(match_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch_match(platform, match_id, key_name))
+            self._match_fetches[match_id] = task
+            task.add_done_callback(lambda _: self._match_fetches.pop(match_id, None))
+        # one caller giving up shouldn't cancel the fetch for everyone else
+        return await asyncio.shield(task)
+
+    async def _fetch_match(self, platform: str, match_id: str, key_name: str) -> Optional[dict]:
+        route = self.match_route(platform)
+        status, data = await self.riot_request(
+            route, MATCH_METHOD, f"{MATCH_METHOD}/{match_id}", key_name
+        )
+        if status != 200:
+            return None
+        self._history_write(self.history.put_match, match_id, data)
+        return data
+
+    async def game_result(
+        self, platform: str, game_id: int, puuid: str, key_name: str
+    ) -> Optional[dict]:
+        """
+        The match-v5 payload of a game puuid played, None if it isn't available yet.
+        key_name is the key the puuid was looked up with.
+        """
+        match_id = self.match_id(platform, game_id)
+        cached = await self._history_call(self.history.get_match, match_id)
+        if cached:
+            return cached
+        # the player's id list is a much cheaper way to ask "is it ready" than the match itself
+        if not await self._history_call(self.history.has_match_id, puuid, match_id):
+            await self.sync_match_ids(platform, puuid, key_name)
+            if not await self._history_call(self.history.has_match_id, puuid, match_id):
+                return None
+        return await self.get_match(platform, match_id, key_name)
+
+    @staticmethod
+    def match_results(match: dict, puuids: dict):
+        """
+        Returns ([(summoner_name, champion name, win, kills, deaths, assists)], duration in seconds)
+            for the players in puuids (puuid -> summoner_name). The match may have been
+            fetched with another key than a player's puuid is from, those are matched by name.
+        """
+        info = match["info"]
+        names = {normalize_name(name): puuid for puuid, name in puuids.items()}
+        names.pop("", None)
+        results = []
+        for p in info["participants"]:
+            puuid = p.get("puuid")
+            if puuid not in puuids:
+                puuid = names.get(normalize_name(p.get("summonerName")))
+            if puuid:
+                results.append(
+                    (
+                        puuids[puuid],
+                        p.get("championName", ""),
+                        p["win"],
+                        p["kills"],
+                        p["deaths"],
+                        p["assists"],
+                    )
+                )
+        # gameDuration was in milliseconds before gameEndTimestamp was added
+        duration = info.get("gameDuration", 0)
+        if "gameEndTimestamp" not in info:
+            duration //= 1000
+        return results, duration
+
+    def queue_outcome(self, trackers, channel, key, message_id):
+        """Queues an ended game to have its result edited into the announcement later."""
+        entry = trackers[0][0]
+        players = {
+            e.puuid: [e.summoner_name, e.summoner_id, e.key_name] for e, _ in trackers if e.puuid
+        }
+        if not (players and self.history and self.match_route(entry.region)):
+            return
+        now = time.time()
+        self._history_write(
+            self.history.queue_result,
+            PendingResult(
+                entry.region,
+                entry.active_game["gameId"],
+                entry.guild_id,
+                channel.id,
+                message_id,
+                entry.active_game["champId"],
+                json.dumps(players),
+                0,
+                now + self.RESULT_FIRST_DELAY,
+                now,
+            ),
+        )
+
+    @staticmethod
+    def pending_players(pending: "PendingResult") -> Dict[str, Tuple[str, str, str]]:
+        """puuid -> (summoner name, summoner id, API key name) of a queued game's players."""
+        players = {}
+        for puuid, player in json.loads(pending.players).items():
+            # queued before the key was kept, when api_key was the only one
+            if isinstance(player, str):
+                player = (player, "", "api_key")
+            players[puuid] = tuple(player)
+        return players
+
+    def results_budget(self, route: str, key_name: str) -> bool:
+        """Whether a key has enough match-v5 budget left for a retry, polling comes first."""
+        key = self.api_keys.choose(route, MATCH_IDS_METHOD, key_name)
+        return bool(key) and key.limiter.budget(route, MATCH_IDS_METHOD) >= self.RESULT_MIN_BUDGET
+
+    async def _results_worker(self):
+        while True:
+            await asyncio.sleep(self.RESULTS_POLL_SECONDS)
+            try:
+                await self.resolve_results()
+            except sqlite3.Error as error:
+                log.warning(f"Couldn't work through pending results: {error}")
+            except Exception as error:
+                # this is the queue's only worker, it has to outlive whatever went wrong
+                log.exception("Failed to work through pending results:", exc_info=error)
+
+    async def resolve_results(self):
+        """Looks up every queued game that is due, a game announced in several guilds once."""
+        due, self.pending_results = await self._history_call(
+            self.history.due_results, time.time(), self.RESULTS_PER_PASS
+        )
+        by_game = {}
+        for pending in due:
+            by_game.setdefault((pending.platform, pending.game_id), []).append(pending)
+        if due:
+            await self.check_token()
+        for (platform, game_id), queued in by_game.items():
+            match = None
+            try:
+                # any player's puuid will do, as long as the key it's from is still around
+                usable = [
+                    (puuid, key_name)
+                    for puuid, (_, _, key_name) in self.pending_players(queued[0]).items()
+                    if key_name in self.api_keys
+                ]
+                if usable:
+                    puuid, key_name = usable[0]
+                    if not self.results_budget(self.match_route(platform), key_name):
+                        # not counted as an attempt, it's still due next pass
+                        log.debug(f"Low on match-v5 budget, leaving {game_id} for later.")
+                        continue
+                    match = await self.game_result(platform, game_id, puuid, key_name)
+            except Exception as error:
+                # counted as a miss, so a row that keeps failing is dropped eventually
+                log.exception(f"Failed to look up the result of {game_id}:", exc_info=error)
+            for pending in queued:
+                if not match:
+                    self._retry_result(pending)
+                    continue
+                try:
+                    await self._post_result(pending, match)
+                except Exception as error:
+                    log.exception(f"Failed to post the result of {game_id}:", exc_info=error)
+                    self._retry_result(pending)
+                else:
+                    self._history_write(self.history.drop_result, pending)
+
+    def _retry_result(self, pending: "PendingResult"):
+        """Backs a queued game off exponentially, or drops it once it's out of attempts."""
+        if pending.attempts + 1 >= self.MAX_RESULT_ATTEMPTS:
+            match_id = self.match_id(pending.platform, pending.game_id)
+            log.debug(f"No match-v5 result for {match_id}, giving up.")
+            self._history_write(self.history.drop_result, pending)
+            return
+        delay = min(self.RESULT_BACKOFF_CAP, self.RESULT_FIRST_DELAY * 2**pending.attempts)
+        self._history_write(
+            self.history.reschedule_result,
+            pending,
+            time.time() + delay * random.uniform(0.9, 1.1),
+        )
+
+    async def _post_result(self, pending: "PendingResult", match: dict):
+        players = self.pending_players(pending)
+        puuids = {puuid: name for puuid, (name, _, _) in players.items()}
+        results, duration = self.match_results(match, puuids)
+        channel = self.bot.get_channel(pending.channel_id)
+        if not results or not channel:
+            return
+        # the ids the game was recorded under, games queued before they were kept use the payload's
+        summoner_ids = {p["puuid"]: p.get("summonerId", "") for p in match["info"]["participants"]}
+        by_name = {
+            name: summoner_id or summoner_ids.get(puuid, "")
+            for puuid, (name, summoner_id, _) in players.items()
+        }
+        self._history_write(
+            self.history.record_outcomes,
+            pending.platform,
+            pending.game_id,
+            [
+                (by_name[name], win, kills, deaths, assists, duration)
+                for name, _, win, kills, deaths, assists in results
+            ],
+        )
+        embed = await self.build_end_game(
+            list(puuids.values()), pending.champ_id, results, duration
+        )
+        key = ("game", pending.guild_id, pending.game_id)
+        self.queue_edit(channel, key, embed, pending.message_id)
@@ -1,3 +1,5 @@
+import asyncio
+from collections import OrderedDict
 from datetime import datetime
 import discord
 import logging
@@ -8,13 +10,82 @@ from .mixinmeta import MixInMeta
 log = logging.getLogger("red.creamy-cogs.league")
 
 
+class OutboundMessage:
+    """A send or an edit waiting in a channel's outbox."""
+
+    __slots__ = ("kind", "channel", "embed", "message_id", "on_sent")
+
+    def __init__(self, kind, channel, embed, message_id=None, on_sent=None):
+        self.kind = kind
+        self.channel = channel
+        self.embed = embed
+        self.message_id = message_id
+        self.on_sent = on_sent
+
+
 class Ezreal(MixInMeta):
     """
     'Lot of good mages out there. None of them are this hot!'
 
     This class is responsible for handling chat interactions with Discord.
+
+    Game announcements go through a per-channel outbox instead of being sent inline,
+        so a channel that Discord is rate limiting only holds up its own messages.
+        Outbox items are keyed by announcement: a newer embed for a message that
+        hasn't gone out yet replaces the old one, so superseded edits are never sent.
     """
 
+    # how many sent announcements we remember the message id of, for edits queued mid-send
+    MAX_SENT_MESSAGES = 500
+
+    def queue_send(self, channel, key, embed, on_sent=None):
+        """Queues a new message. on_sent is awaited with the message once it has been sent."""
+        self._enqueue(channel, key, OutboundMessage("send", channel, embed, on_sent=on_sent))
+
+    def queue_edit(self, channel, key, embed, message_id=None):
+        """Queues an edit, or folds it into whatever is still waiting to go out for that key."""
+        pending = self._outbox.get(channel.id, {}).get(key)
+        if pending:
+            pending.embed = embed
+            return
+        self._enqueue(channel, key, OutboundMessage("edit", channel, embed, message_id))
+
+    def outbox_depth(self) -> int:
+        return sum(len(pending) for pending in self._outbox.values())
+
+    def _enqueue(self, channel, key, item):
+        self._outbox.setdefault(channel.id, OrderedDict())[key] = item
+        task = self._outbox_tasks.get(channel.id)
+        if task is None or task.done():
+            self._outbox_tasks[channel.id] = asyncio.create_task(self._drain_outbox(channel.id))
+
+    async def _drain_outbox(self, channel_id):
+        pending = self._outbox[channel_id]
+        while pending:
+            key, item = pending.popitem(last=False)
+            try:
+                if item.kind == "send":
+                    with self.timed("discord_send"):
+                        message = await item.channel.send(embed=item.embed)
+                    self._sent_messages[key] = message.id
+                    while len(self._sent_messages) > self.MAX_SENT_MESSAGES:
+                        self._sent_messages.popitem(last=False)
+                    if item.on_sent:
+                        await item.on_sent(message)
+                else:
+                    # the send may have still been in flight when this edit was queued
+                    message_id = item.message_id or self._sent_messages.get(key)
+                    if not message_id:
+                        log.debug(f"No message to edit for {key}.")
+                        continue
+                    # no need to fetch the whole message just to edit it
+                    with self.timed("discord_edit"):
+                        await item.channel.get_partial_message(message_id).edit(embed=item.embed)
+            except discord.HTTPException as error:
+                log.warning(f"Failed to {item.kind} announcement in {channel_id}: {error}")
+            except Exception as error:
+                log.exception(f"Failed to {item.kind} announcement:", exc_info=error)
+
     async def build_embed(self, title=None, msg=None, _type=None):
         embed = discord.Embed()
 
@@ -49,25 +120,49 @@ class Ezreal(MixInMeta):
 
         return embed
 
-    async def build_active_game(
-        self, summoner_name, game_type, champ_name, champ_id, team1, team2, timestamp
-    ):
+    @staticmethod
+    def join_names(names):
+        """'A', 'A and B', 'A, B and C'"""
+        names = list(names)
+        if len(names) < 2:
+            return "".join(names)
+        return ", ".join(names[:-1]) + " and " + names[-1]
+
+    @staticmethod
+    def with_rank(name, rank=None):
+        return f"{name} ({rank})" if rank else str(name)
+
+    async def build_active_game(self, players, game_type, team1, team2, timestamp, ranks=None):
+        """
+        players is a list of (summoner_name, Champion) for every tracked
+            summoner in the game, one embed covers all of them.
+        ranks maps champion key -> ranked tier for whoever we know it of,
+            those champions get a line each with the tier next to them.
+        """
         log.debug("Building embed")
         version = self.champ_api_version
+        names = [name for name, _ in players]
         embed = discord.Embed()
-        embed.title = f"{summoner_name} has started a {game_type} game!"
+        if len(players) == 1:
+            embed.title = f"{names[0]} has started a {game_type} game!"
+        else:
+            embed.title = f"{self.join_names(names)} have started a {game_type} game!"
+            embed.description = "\n".join(f"**{name}**: {champ.name}" for name, champ in players)
         embed.color = 0x00FF00
         embed.set_thumbnail(
-            url=f"http://ddragon.leagueoflegends.com/cdn/{version}/img/champion/{champ_id}.png"
+            url=f"http://ddragon.leagueoflegends.com/cdn/{version}/img/champion/{players[0][1].id}.png"
         )
         teamComp1 = ""
         teamComp2 = ""
+        # unranked players are '', their champion goes on a line of its own all the same
+        ranks = ranks or {}
+        separator = "\n" if any(ranks.values()) else " "
 
         # Turn teams into strings
         for champ in team1:
-            teamComp1 = teamComp1 + str(team1[champ]) + " "
+            teamComp1 = teamComp1 + self.with_rank(team1[champ], ranks.get(champ)) + separator
         for champ in team2:
-            teamComp2 = teamComp2 + str(team2[champ]) + " "
+            teamComp2 = teamComp2 + self.with_rank(team2[champ], ranks.get(champ)) + separator
 
         # If a team is empty (bots don't count), don't fail out.
         if team1:
@@ -85,11 +180,27 @@ class Ezreal(MixInMeta):
         log.debug("Returning embed")
         return embed
 
-    async def build_end_game(self, summoner_name, champ_id):
+    async def build_end_game(self, summoner_names, champ_id, results=None, duration=None):
+        """
+        results, once match-v5 has the game, is a list of
+            (summoner_name, champion name, win, kills, deaths, assists) for the tracked players.
+        """
         version = self.champ_api_version
         embed = discord.Embed()
-        embed.title = f"{summoner_name}'s game has ended."
+        embed.title = f"{self.join_names(summoner_names)}'s game has ended."
         embed.color = 0xFF0000
+        if results:
+            wins = {win for _, _, win, _, _, _ in results}
+            outcome = "Victory" if wins == {True} else "Defeat" if wins == {False} else "Split"
+            minutes, seconds = divmod(int(duration or 0), 60)
+            embed.description = f"**{outcome}** in {minutes}:{seconds:02d}"
+            if wins == {True}:
+                embed.color = 0x00FF00
+            for name, champion, win, kills, deaths, assists in results:
+                embed.add_field(
+                    name=f"{name} ({champion})" if champion else name,
+                    value=f"{'Win' if win else 'Loss'} - {kills}/{deaths}/{assists}",
+                )
         embed.set_thumbnail(
             url=f"http://ddragon.leagueoflegends.com/cdn/{version}/img/champion/{champ_id}.png"
         )
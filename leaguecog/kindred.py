@@ -0,0 +1,392 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .mixinmeta import MixInMeta
+
+
+log = logging.getLogger("red.creamy-cogs.league")
+
+# bumped whenever tracked or results change shape, they are only a cache of the last few loops
+SHARD_SCHEMA_VERSION = 2
+SHARD_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tracked (
+    node_id TEXT NOT NULL,
+    region TEXT NOT NULL,
+    summoner_name TEXT NOT NULL,
+    PRIMARY KEY (node_id, region, summoner_name)
+);
+CREATE TABLE IF NOT EXISTS results (
+    region TEXT NOT NULL,
+    summoner_name TEXT NOT NULL,
+    node_id TEXT NOT NULL,
+    checked_at REAL NOT NULL,
+    published_at REAL NOT NULL,
+    game TEXT,
+    PRIMARY KEY (region, summoner_name)
+);
+CREATE INDEX IF NOT EXISTS results_published_at ON results (published_at);
+"""
+
+
+class HashRing:
+    """
+    Consistent hashing of summoners onto nodes.
+    Every node gets `replicas` points on the ring, so when a node joins or leaves
+        only the summoners next to its points move, everyone else keeps their owner.
+    md5 rather than hash(), which is salted differently in every process.
+    """
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 64):
+        self.nodes = sorted(set(nodes))
+        points = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def owner(self, summoner: Tuple[str, str]) -> Optional[str]:
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, self._hash(f"{summoner[0]}:{summoner[1]}"))
+        return self._owners[index % len(self._owners)]
+
+
+class ShardCoordinator:
+    """
+    The SQLite file cooperating processes share. Every method blocks, Kindred runs
+        them on a single worker thread so the connection never leaves it.
+
+    Summoners are (region, normalized summoner name) here: Riot encrypts summoner ids
+        per API key, and every process has its own keys.
+
+    nodes: who is alive, a node whose heartbeat is older than LEASE_SECONDS is gone.
+    tracked: which summoners each node has members for.
+    results: the last spectator result for every summoner, from whoever polled it.
+        checked_at is when that node's loop started, so it is never later than the request.
+    """
+
+    LEASE_SECONDS = 30
+
+    def __init__(self, path: str, node_id: str):
+        self.path = path
+        self.node_id = node_id
+        self._db: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        self._db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db as db:
+            db.execute("BEGIN IMMEDIATE")
+            if db.execute("PRAGMA user_version").fetchone()[0] < SHARD_SCHEMA_VERSION:
+                # version 1 kept summoner ids, which other processes' keys can't read
+                db.execute("DROP TABLE IF EXISTS tracked")
+                db.execute("DROP TABLE IF EXISTS results")
+                db.execute(f"PRAGMA user_version = {SHARD_SCHEMA_VERSION}")
+        self._db.executescript(SHARD_SCHEMA)
+
+    def heartbeat(
+        self, pairs: Optional[List[Tuple[str, str]]]
+    ) -> Tuple[List[str], Set[Tuple[str, str]]]:
+        """
+        Renews our lease, replacing what we track if pairs isn't None.
+        Returns the live nodes and every summoner any of them tracks.
+        """
+        now = time.time()
+        expired = now - self.LEASE_SECONDS
+        db = self._db
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "INSERT INTO nodes (node_id, heartbeat) VALUES (?, ?)"
+                " ON CONFLICT (node_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (self.node_id, now),
+            )
+            if pairs is not None:
+                db.execute("DELETE FROM tracked WHERE node_id = ?", (self.node_id,))
+                db.executemany(
+                    "INSERT INTO tracked (node_id, region, summoner_name) VALUES (?, ?, ?)",
+                    [(self.node_id, region, name) for region, name in pairs],
+                )
+            # whoever notices a dead node first cleans up after it
+            dead = [
+                row[0]
+                for row in db.execute("SELECT node_id FROM nodes WHERE heartbeat < ?", (expired,))
+            ]
+            for node_id in dead:
+                db.execute("DELETE FROM tracked WHERE node_id = ?", (node_id,))
+                db.execute("DELETE FROM nodes WHERE node_id = ?", (node_id,))
+        alive = [row[0] for row in db.execute("SELECT node_id FROM nodes")]
+        tracked = set(db.execute("SELECT DISTINCT region, summoner_name FROM tracked"))
+        return alive, tracked
+
+    def publish(self, results: Dict[Tuple[str, str], Optional[dict]], checked_at: float):
+        now = time.time()
+        rows = [
+            (region, name, self.node_id, checked_at, now, json.dumps(game) if game else None)
+            for (region, name), game in results.items()
+        ]
+        with self._db as db:
+            db.executemany(
+                "INSERT INTO results"
+                " (region, summoner_name, node_id, checked_at, published_at, game)"
+                " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (region, summoner_name) DO UPDATE SET"
+                " node_id = excluded.node_id, checked_at = excluded.checked_at,"
+                " published_at = excluded.published_at, game = excluded.game",
+                rows,
+            )
+
+    def fetch(self, since: float) -> List[Tuple[str, str, float, Optional[dict]]]:
+        """Every result other nodes published after `since`."""
+        rows = self._db.execute(
+            "SELECT region, summoner_name, checked_at, game FROM results"
+            " WHERE published_at > ? AND node_id != ?",
+            (since, self.node_id),
+        )
+        return [
+            (region, name, checked_at, json.loads(game) if game else None)
+            for region, name, checked_at, game in rows
+        ]
+
+    def leave(self):
+        """Gives up our slice straight away instead of waiting for the lease to run out."""
+        with self._db as db:
+            db.execute("DELETE FROM tracked WHERE node_id = ?", (self.node_id,))
+            db.execute("DELETE FROM nodes WHERE node_id = ?", (self.node_id,))
+        self._db.close()
+        self._db = None
+
+
+class Kindred(MixInMeta):
+    """
+    'Never one without the other.'
+
+    This class is responsible for splitting polling between cooperating bot processes.
+
+    Every process heartbeats into a shared SQLite file ([p]leagueset shard) with the
+        summoners its guilds track. The union of those is spread over the live
+        processes with a consistent hash ring, and each process only polls its own
+        slice. Results go into the shared file, and every process picks up the ones
+        for summoners it has members for, so the process that can see a guild's
+        announcement channel is the one that posts there.
+
+    Riot limits each API key separately, so polling capacity grows with the number
+        of processes as long as each one has its own keys. Riot also encrypts summoner
+        ids per key, so processes only ever tell each other about summoners by region
+        and summoner name. A summoner only other processes track is looked up by name
+        with one of our own keys before we poll them, and a game another process
+        found is matched to our members by name (see find_participants).
+    """
+
+    HEARTBEAT_SECONDS = 10
+    # remote summoners looked up per heartbeat, the rest wait for the next one
+    SHARD_LOOKUPS_PER_BEAT = 100
+
+    @staticmethod
+    def shard_node_id() -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    async def _shard_call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._shard_executor, func, *args)
+
+    async def start_sharding(self, path: str):
+        await self.stop_sharding()
+        self._shard_executor = ThreadPoolExecutor(1, thread_name_prefix="league-shard")
+        shard = ShardCoordinator(path, self.shard_node_id())
+        try:
+            await self._shard_call(shard.open)
+        except sqlite3.Error:
+            self._shard_executor.shutdown(wait=False)
+            raise
+        self.shard = shard
+        self._shard_published = None
+        self._shard_seen = {}
+        self._shard_fetched_at = 0.0
+        await self._shard_beat()
+        self._shard_task = asyncio.create_task(self._shard_heartbeat())
+        log.debug(f"Sharding through {path} as {shard.node_id}")
+
+    async def stop_sharding(self):
+        if self._shard_task:
+            self._shard_task.cancel()
+            self._shard_task = None
+        if self.shard:
+            try:
+                await self._shard_call(self.shard.leave)
+            except sqlite3.Error as error:
+                log.warning(f"Couldn't leave the shard cleanly: {error}")
+            self._shard_executor.shutdown(wait=False)
+            self.shard = None
+            self._shard_ring = None
+            self._shard_pairs = set()
+            self._shard_in_game = set()
+            self._shard_remote = {}
+
+    async def _shard_beat(self):
+        pairs = {
+            self.summoner_key(entry.region, entry.summoner_name)
+            for members in self.roster.values()
+            for entry in members.values()
+        }
+        # only rewrite our tracked rows when the roster actually changed
+        changed = sorted(pairs) if pairs != self._shard_published else None
+        alive, tracked = await self._shard_call(self.shard.heartbeat, changed)
+        self._shard_published = pairs
+        self._shard_ring = HashRing(alive)
+        self._shard_pairs = tracked
+        await self._shard_resolve(pairs)
+
+    async def _shard_resolve(self, ours: Set[Tuple[str, str]]):
+        """
+        Looks up the ids of the summoners only other processes track that hash to us,
+            with our own keys, and forgets the ones that are no longer ours to poll.
+        """
+        wanted = {name for name in self._shard_pairs if name not in ours and self.shard_owns(name)}
+        self._shard_remote = {
+            summoner: (name, key_name)
+            for summoner, (name, key_name) in self._shard_remote.items()
+            if name in wanted
+        }
+        known = {name for name, _ in self._shard_remote.values()}
+        work = {}
+        for region, name in sorted(wanted - known)[: self.SHARD_LOOKUPS_PER_BEAT]:
+            work.setdefault(region, []).append((region, name))
+
+        async def lookup(name):
+            status, data, key_name = await self.lookup_summoner(*name)
+            if status == 200:
+                self._shard_remote[(name[0], data["id"])] = (name, key_name)
+
+        await self.run_per_region(work, lookup)
+
+    async def _shard_heartbeat(self):
+        while True:
+            await asyncio.sleep(self.HEARTBEAT_SECONDS)
+            try:
+                await self._shard_beat()
+            except sqlite3.Error as error:
+                log.warning(f"Shard heartbeat failed: {error}")
+
+    def shard_owns(self, summoner: Tuple[str, str]) -> bool:
+        if not self.shard or not self._shard_ring:
+            return True
+        return self._shard_ring.owner(summoner) == self.shard.node_id
+
+    def shard_names(self, summoners: dict) -> Dict[Tuple[str, str], Tuple[str, str]]:
+        """
+        (region, summoner id) -> (region, normalized summoner name) for our members'
+            summoners, and for the remote ones we've looked up.
+        """
+        names = {
+            summoner: self.summoner_key(summoner[0], trackers[0][0].summoner_name)
+            for summoner, trackers in summoners.items()
+        }
+        if self.shard:
+            names.update((s, name) for s, (name, _) in self._shard_remote.items())
+        return names
+
+    def shard_key_name(self, summoner: Tuple[str, str]) -> Optional[str]:
+        """The API key we looked a remote summoner up with."""
+        return self._shard_remote.get(summoner, (None, None))[1]
+
+    def shard_split(self, summoners: dict, names: dict) -> Tuple[dict, Set[Tuple[str, str]]]:
+        """
+        Returns which summoners this process polls: the ones its own members track that
+            hash to it, and the ones hashing to it that only other processes track.
+        """
+        if not self.shard:
+            return summoners, set()
+        owned = {s: trackers for s, trackers in summoners.items() if self.shard_owns(names[s])}
+        ours = {names[s] for s in summoners}
+        remote = {
+            summoner
+            for summoner, (name, _) in self._shard_remote.items()
+            if name not in ours and self.shard_owns(name)
+        }
+        return owned, remote
+
+    def shard_in_game(self, summoner: Tuple[str, str]) -> bool:
+        """Whether a summoner only other processes track was in game when we last polled them."""
+        return summoner in self._shard_in_game
+
+    async def shard_exchange(
+        self,
+        results: dict,
+        polled: Set[Tuple[str, str]],
+        summoners: dict,
+        names: dict,
+        checked_at: float,
+    ):
+        """
+        Publishes what we polled this loop, then collects what other processes polled.
+        names is shard_names' (region, summoner id) -> (region, summoner name).
+        """
+        if not self.shard:
+            return
+        mine = {s: game for s, game in results.items() if s in polled}
+        now = time.time()
+        for summoner, game in mine.items():
+            if summoner not in summoners:
+                # update_games never sees these, so the scheduler learns about their games here
+                if game:
+                    self.scheduler.record_game(summoner, game["gameId"], now)
+                    self._shard_in_game.add(summoner)
+                else:
+                    self._shard_in_game.discard(summoner)
+        for summoner in results:
+            if summoner in summoners:
+                self._shard_seen[summoner] = now
+        if mine:
+            published = {names[s]: game for s, game in mine.items()}
+            try:
+                await self._shard_call(self.shard.publish, published, checked_at)
+            except sqlite3.Error as error:
+                log.warning(f"Couldn't publish results to the shard: {error}")
+        await self.shard_collect(results, polled, summoners, names)
+
+    async def shard_collect(
+        self, results: dict, polled: Set[Tuple[str, str]], summoners: dict, names: dict
+    ):
+        """
+        Fills results in for our members' summoners that other processes polled since we last looked.
+        A result older than what we last saw ourselves is dropped, so a slow publish
+            can't end a game one of our own responses (a teammate's, say) just found.
+        """
+        if not self.shard:
+            return
+        now = time.time()
+        # a little overlap, results are only taken once per checked_at anyway
+        since = self._shard_fetched_at - self.HEARTBEAT_SECONDS
+        try:
+            rows = await self._shard_call(self.shard.fetch, since)
+        except sqlite3.Error as error:
+            log.warning(f"Couldn't read results from the shard: {error}")
+            return
+        self._shard_fetched_at = now
+        # the same summoner can be registered with several of our keys, so under several ids
+        by_name = {}
+        for summoner in summoners:
+            by_name.setdefault(names[summoner], []).append(summoner)
+        for region, name, polled_at, game in rows:
+            for summoner in by_name.get((region, name), ()):
+                if summoner in polled or polled_at <= self._shard_seen.get(summoner, 0.0):
+                    continue
+                self._shard_seen[summoner] = polled_at
+                results.setdefault(summoner, game)
@@ -1,18 +1,29 @@
 from abc import ABC
 import asyncio
+from collections import OrderedDict
+import csv
+import io
 import logging
+import sqlite3
+import time
 from typing import Optional
 
 import aiohttp
 import discord
 from redbot.core import checks, commands, Config
 from redbot.core.bot import Red
+from redbot.core.utils.chat_formatting import box, pagify
 from redbot.core.utils.menus import start_adding_reactions
 from redbot.core.utils.predicates import MessagePredicate, ReactionPredicate
 
-from .blitzcrank import Blitzcrank
+from .blitzcrank import Blitzcrank, TTLCache
+from .ekko import Ekko
 from .ezreal import Ezreal
-from .zilean import Zilean
+from .kindred import Kindred
+from .nasus import Nasus
+from .rengar import PollingCounts, Rengar
+from .teemo import Metrics, Teemo
+from .zilean import ApiKeyPool, PollScheduler, Zilean
 
 
 log = logging.getLogger("red.creamy-cogs.league")
@@ -29,7 +40,12 @@ class CompositeMetaClass(type(commands.Cog), type(ABC)):
 
 class LeagueCog(
     Blitzcrank,
+    Ekko,
     Ezreal,
+    Kindred,
+    Nasus,
+    Rengar,
+    Teemo,
     Zilean,
     commands.Cog,
     metaclass=CompositeMetaClass,
@@ -41,12 +57,28 @@ class LeagueCog(
 
     default_global_settings = {
         "notified_owner_missing_league_key": False,
+        "max_concurrent_requests": 10,
+        # how long (in seconds) a posted game is remembered to avoid double posting
+        "posted_games_ttl": 86400,
+        "schema_version": 0,
+        # only read to move it into the game history, see Zilean.load_activity
+        "summoner_activity": {},
+        # port of the local Prometheus endpoint, None to keep it off
+        "metrics_port": None,
+        # record every Riot request and response to disk, for replaying offline
+        "capture_riot_traffic": False,
+        # SQLite file shared by every process splitting the polling, None to poll alone
+        "shard_db_path": None,
     }
 
     default_guild_settings = {
         "default_region": "NA",
         "alert_channel": "",
+        "poll_guild_games": False,
+        # legacy list of posted games, moved into recent_games by migrate_posted_games
         "posted_games": [],
+        # "gameId + summonerId" -> unix time it was posted
+        "recent_games": {},
     }
 
     default_role_settings = {"mention": False}
@@ -57,6 +89,8 @@ class LeagueCog(
         "summoner_id": "",
         "account_id": "",
         "region": "",
+        # the API key the ids were looked up with, Riot encrypts them per application
+        "api_key": "",
         "active_game": {},
     }
 
@@ -73,27 +107,87 @@ class LeagueCog(
 
         self.champ_api_version = None
 
-        self._session = aiohttp.ClientSession()
-        self.champlist = None
-        self.api_key = None
+        # Keep connections to *.api.riotgames.com alive between loops instead of
+        #   re-doing DNS and TLS for every request.
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100, limit_per_host=20, ttl_dns_cache=300, keepalive_timeout=60
+            )
+        )
+        # region -> CircuitBreaker, see Blitzcrank.riot_request
+        self.breakers = {}
+        # guild id -> member id -> RosterEntry, everyone check_games polls
+        self.roster = {}
+        self.polling_counts = PollingCounts()
+        # guild id -> OrderedDict of recently posted games, see Rengar
+        self.posted_games = {}
+        self.posted_games_ttl = self.default_global_settings["posted_games_ttl"]
+        # championId -> Champion, rebuilt whenever update_version loads champion.json
+        self.champions = {}
+        # version, ETag and Last-Modified of the versions.json we last loaded
+        self._ddragon_meta = {}
+        # every Riot API key we can spread requests over, each with its own rate limits
+        self.api_keys = ApiKeyPool()
+        self.total_polling_users = 1
+        self.scheduler = PollScheduler()
+        # caps how many spectator requests check_games has in flight per region
+        self.max_concurrent_requests = self.default_global_settings["max_concurrent_requests"]
         self.regions = {
             # restructuring this as a nested dict avoids constructing extra
             #   lists and dictionaries any time we need region processing
-            "na": {"ser": "na1", "emoji": "🇺🇸"},
-            "euw": {"ser": "euw1", "emoji": "🇪🇺"},
-            "eune": {"ser": "eun1", "emoji": "🇳🇴"},
-            "lan": {"ser": "la1", "emoji": "🇲🇽"},
-            "br": {"ser": "br1", "emoji": "🇧🇷"},
-            "las": {"ser": "la2", "emoji": "🇦🇷"},
-            "jp": {"ser": "jp1", "emoji": "🇯🇵"},
-            "kr": {"ser": "kr", "emoji": "🇰🇷"},
-            "oce": {"ser": "oc1", "emoji": "🇦🇺"},
-            "tr": {"ser": "tr1", "emoji": "🇹🇷"},
-            "ru": {"ser": "ru", "emoji": "🇷🇺"},
-            "pbe": {"ser": "pbe1", "emoji": "🇧"},
+            # "route" is the regional cluster match-v5 is served from
+            "na": {"ser": "na1", "route": "americas", "emoji": "🇺🇸"},
+            "euw": {"ser": "euw1", "route": "europe", "emoji": "🇪🇺"},
+            "eune": {"ser": "eun1", "route": "europe", "emoji": "🇳🇴"},
+            "lan": {"ser": "la1", "route": "americas", "emoji": "🇲🇽"},
+            "br": {"ser": "br1", "route": "americas", "emoji": "🇧🇷"},
+            "las": {"ser": "la2", "route": "americas", "emoji": "🇦🇷"},
+            "jp": {"ser": "jp1", "route": "asia", "emoji": "🇯🇵"},
+            "kr": {"ser": "kr", "route": "asia", "emoji": "🇰🇷"},
+            "oce": {"ser": "oc1", "route": "sea", "emoji": "🇦🇺"},
+            "tr": {"ser": "tr1", "route": "europe", "emoji": "🇹🇷"},
+            "ru": {"ser": "ru", "route": "europe", "emoji": "🇷🇺"},
+            "pbe": {"ser": "pbe1", "route": "americas", "emoji": "🇧"},
         }
 
+        # channel id -> pending sends and edits, see Ezreal
+        self._outbox = {}
+        self._outbox_tasks = {}
+        self._sent_messages = OrderedDict()
+        # Config writes waiting for the next flush, see Rengar
+        self._pending_members = {}
+        self._pending_guilds = {}
+        self._pending_global = {}
+        # timings and counters for [p]leagueset stats, see Teemo
+        self.metrics = Metrics()
+        self._metrics_runner = None
+        # only set while [p]leagueset capture is on, see Blitzcrank.riot_request
+        self.recorder = None
+        # only set while [p]leagueset shard is on, see Kindred
+        self.shard = None
+        self._shard_executor = None
+        self._shard_task = None
+        self._shard_ring = None
+        self._shard_pairs = set()
+        self._shard_in_game = set()
+        # remote (region, summoner id) -> ((region, summoner name), API key name), see Kindred
+        self._shard_remote = {}
+        # games we announced and who played them, see Nasus
+        self.history = None
+        self._history_executor = None
+        # match id -> in flight match-v5 fetch, and how many games wait for results, see Ekko
+        self._match_fetches = {}
+        # (region, summoner id) -> ranked tier, shared by every guild, see Blitzcrank.get_ranks
+        self.rank_cache = TTLCache(self.RANK_CACHE_SIZE, self.RANK_TTL)
+        self.summoner_cache = TTLCache(self.SUMMONER_CACHE_SIZE, self.SUMMONER_TTL)
+        self._rank_fetches = {}
+        self._rank_followups = set()
+        self.pending_results = 0
+
         self.task: Optional[asyncio.Task] = None
+        self._ddragon_task: Optional[asyncio.Task] = None
+        self._write_task: Optional[asyncio.Task] = None
+        self._results_task: Optional[asyncio.Task] = None
         self._ready_event: asyncio.Event = asyncio.Event()
         self._init_task: asyncio.Task = self.bot.loop.create_task(self.initialize())
 
@@ -102,14 +196,50 @@ class LeagueCog(
         await self.bot.wait_until_ready()
 
         try:
-            log.debug("Updating Riot API Version...")
-            # We need to run this more often, but not sure when.
-            await self.update_version()
+            self.max_concurrent_requests = await self.config.max_concurrent_requests()
+
+            # Start from the cached Data Dragon version if we have one,
+            #   the refresh task checks for a new patch in the background.
+            if not self.load_ddragon_cache():
+                log.debug("Updating Riot API Version...")
+                await self.update_version()
+            self._ddragon_task = self.bot.loop.create_task(self._ddragon_refresh())
+
+            self._write_task = self.bot.loop.create_task(self._write_behind())
+            await self.migrate_posted_games()
+            await self.load_posted_games()
+            await self.build_roster()
+            try:
+                await self.open_history()
+            except (OSError, sqlite3.Error) as error:
+                log.warning(f"Couldn't open the game history: {error}")
+            else:
+                # picks up where the last load left off, the queue lives in the history
+                self._results_task = self.bot.loop.create_task(self._results_worker())
+            await self.load_activity()
+
+            metrics_port = await self.config.metrics_port()
+            if metrics_port:
+                try:
+                    await self.start_metrics_server(metrics_port)
+                except OSError as error:
+                    log.warning(f"Couldn't serve metrics on port {metrics_port}: {error}")
+
+            self.set_capture(await self.config.capture_riot_traffic())
+
+            shard_db_path = await self.config.shard_db_path()
+            if shard_db_path:
+                try:
+                    await self.start_sharding(shard_db_path)
+                except sqlite3.Error as error:
+                    log.warning(f"Couldn't join the shard at {shard_db_path}: {error}")
 
             log.debug("Attempting to start loop..")
             # determine time between looping through users
             await self.calculate_cooldown()
-            self.task = self.bot.loop.create_task(self._game_alerts())
+            # a key update while we were starting up may have started it already
+            if self.task is None or self.task.done():
+                self.task = self.bot.loop.create_task(self._game_alerts())
 
         except Exception as error:
             log.exception("Failed to initialize League cog:", exc_info=error)
@@ -121,9 +251,11 @@ class LeagueCog(
         """This will listen for updates to api tokens and update cog instance of league token if it changed"""
         log.debug("Tokens updated.")
         if service_name == "league":
-            self.api = api_tokens["api_key"]
+            self.api_keys.load(api_tokens)
             await self.config.notified_owner_missing_league_key.set(False)
-            self.task = self.bot.loop.create_task(self._game_alerts())
+            # The pool is swapped in place, a loop that is already running just carries on.
+            if self.task is None or self.task.done():
+                self.task = self.bot.loop.create_task(self._game_alerts())
             log.debug("Local key updated.")
 
     async def cog_before_invoke(self, ctx: commands.Context):
@@ -135,15 +267,40 @@ class LeagueCog(
         while True:
             # this is the main check games loop
             log.debug("Checking games")
+            start = time.perf_counter()
             await self.check_games()
+            refresh_timer = await self.config.refresh_timer()
+            self.record_loop(time.perf_counter() - start, refresh_timer)
+            # Riot told us about different rate limits than we were budgeting for,
+            #   or the scheduler is checking noticeably more or fewer summoners per loop
+            if self.api_keys.limits_changed or self.cooldown_drifted():
+                await self.calculate_cooldown()
             log.debug("Sleeping...")
             await asyncio.sleep(await self.config.refresh_timer())
 
     def cog_unload(self):
         """Close all sessions all pending async tasks when the cog is unloaded."""
         asyncio.get_event_loop().create_task(self._session.close())
+        # Config outlives the cog, so whatever is still queued gets saved.
+        asyncio.get_event_loop().create_task(self.final_flush())
+        asyncio.get_event_loop().create_task(self.stop_metrics_server())
+        self.set_capture(False)
+        asyncio.get_event_loop().create_task(self.stop_sharding())
+        self.close_history()
         if self.task:
             self.task.cancel()
+        if self._ddragon_task:
+            self._ddragon_task.cancel()
+        for task in self._outbox_tasks.values():
+            task.cancel()
+        if self._results_task:
+            self._results_task.cancel()
+        for task in (
+            *self._match_fetches.values(),
+            *self._rank_fetches.values(),
+            *self._rank_followups,
+        ):
+            task.cancel()
 
     @commands.group()
     async def league(self, ctx: commands.Context):
@@ -280,6 +437,8 @@ class LeagueCog(
 
         # set the alert channel via channel id
         await self.config.guild(ctx.guild).alert_channel.set(alert_channel_id)
+        await self.refresh_roster_guild(ctx.guild.id)
+        await self.calculate_cooldown()
 
         # TODO remove reactions, or remove last message if had to get text input
 
@@ -295,14 +454,17 @@ class LeagueCog(
     @league.command(name="clear-data")
     async def clear_data(self, ctx: commands.Context):
         """Removes all data from all guilds for the user"""
-        guilds = await self.config.all_guilds()
-
-        for guild_id in guilds:
-            guild = await self.bot.fetch_guild(guild_id)
-            guild_members = await self.config.all_members(guild=guild)
+        # Dropped first, so a flush running while we clear can't write them back.
+        for guild_id, member_id in list(self._pending_members):
+            if member_id == ctx.author.id:
+                self.discard_pending_writes(guild_id, member_id)
+        all_members = await self.config.all_members()
 
+        for guild_id, guild_members in all_members.items():
             if ctx.author.id in guild_members.keys():
                 await self.config.member_from_ids(guild_id, ctx.author.id).clear()
+        self.history_forget(ctx.author.id)
+        await self.refresh_roster_user(ctx.author.id)
 
         await ctx.send(f"Data cleared for `{ctx.author}`")
         # re-calculate time between check games loops, now that we've de-registered a user
@@ -352,8 +514,9 @@ class LeagueCog(
 
         # get a list of all of the registered summoner_names
         # and check to see if the name is already registered for the guild
-        guild_members = await self.config.all_members(guild=ctx.guild)
-        summoner_names = [guild_members[memberId]["summoner_name"] for memberId in guild_members]
+        # registrations from the last few seconds may only be queued so far
+        guild_members = await self.guild_members(ctx.guild.id)
+        summoner_names = [data.get("summoner_name") for data in guild_members.values()]
 
         if name in summoner_names:
             duplicate_summoner_embed = await Ezreal.build_embed(
@@ -426,10 +589,62 @@ class LeagueCog(
 
         # set the new bool state and message the user
         await self.config.user(userId).poll_user_games.set(state_bool)
+        await self.refresh_roster_user(ctx.author.id)
         await ctx.send(f"`LeagueCog` set polling `{msg_bool}` for {ctx.author.mention}")
         # recalculate Zilean timer cooldown
         await self.calculate_cooldown()
 
+    @league.command(name="played")
+    @commands.guild_only()
+    async def games_played(self, ctx: commands.Context, days: float = 7):
+        """
+        Shows who in this server has played the most announced games lately.
+
+        Example:
+            [p]league played
+            [p]league played 30
+        """
+        counts = await self.games_per_member(ctx.guild.id, days)
+        if not counts:
+            await ctx.send(f"No games announced here in the last {days:g} days.")
+            return
+        lines = []
+        for member_id, played in counts:
+            member = ctx.guild.get_member(member_id)
+            name = member.display_name if member else f"<@{member_id}>"
+            lines.append(f"**{name}**: {played} game{'s' if played != 1 else ''}")
+        embed = await Ezreal.build_embed(
+            self, title=f"GAMES PLAYED - LAST {days:g} DAYS", msg="\n".join(lines)
+        )
+        await ctx.send(embed=embed)
+
+    @league.command(name="champions")
+    @commands.guild_only()
+    async def top_played_champions(
+        self, ctx: commands.Context, member: Optional[discord.Member] = None, days: float = 7
+    ):
+        """
+        Shows the most played champions in this server, or of one member.
+
+        Example:
+            [p]league champions
+            [p]league champions @Bird#0000 30
+        """
+        counts = await self.top_champions(ctx.guild.id, days, member.id if member else None)
+        who = member.display_name if member else "this server"
+        if not counts:
+            await ctx.send(f"No games announced for {who} in the last {days:g} days.")
+            return
+        lines = []
+        for champion_id, played in counts:
+            champ = self.get_champion(champion_id)
+            name = champ.name if champ else f"Champion {champion_id}"
+            lines.append(f"**{name}**: {played} game{'s' if played != 1 else ''}")
+        embed = await Ezreal.build_embed(
+            self, title=f"TOP CHAMPIONS - {who.upper()}", msg="\n".join(lines)
+        )
+        await ctx.send(embed=embed)
+
     @commands.group()
     async def leagueset(self, ctx: commands.Context):
         """Base command to manage League settings"""
@@ -465,6 +680,102 @@ class LeagueCog(
 
         # See if summoner name exists on that region.
         await self.get_summoner_info(ctx, name, member, region, False)
+        # re-calculate time between check games loops
+        await self.calculate_cooldown()
+
+    @leagueset.command(name="import")
+    @commands.guild_only()
+    @checks.admin_or_permissions(manage_guild=True)
+    async def import_summoners(self, ctx: commands.Context, *, rows: str = ""):
+        """
+        Registers summoners for many members at once.
+        Takes one `member,summoner name,region` row per line, pasted after the command
+        or in an attached .csv file. Members can be mentions, ids or names.
+        Region is optional, the same as for other-summoner.
+
+        Example:
+            [p]leagueset import
+            @Bird#0000,your_summoner_name,NA
+            123456789012345678,"firstname lastname"
+        """
+        if ctx.message.attachments:
+            attachment = ctx.message.attachments[0]
+            if attachment.size > self.MAX_IMPORT_BYTES:
+                await ctx.send("That file is too big to import.")
+                return
+            rows = (await attachment.read()).decode("utf-8-sig", errors="replace")
+        # pasted rows are often in a code block
+        rows = rows.strip().strip("`")
+        if rows.startswith("csv\n"):
+            rows = rows[4:]
+
+        parsed = []
+        invalid = []
+        converter = commands.MemberConverter()
+        for number, row in enumerate(csv.reader(io.StringIO(rows)), start=1):
+            row = [cell.strip() for cell in row]
+            if not any(row) or (number == 1 and row[0].lower() == "member"):
+                continue
+            if len(row) < 2 or not row[1]:
+                invalid.append(f"Line {number}: expected member,summoner name,region")
+                continue
+            try:
+                member = await converter.convert(ctx, row[0])
+            except commands.BadArgument:
+                invalid.append(f"Line {number}: no member `{row[0]}` here")
+                continue
+            parsed.append((member, row[1], row[2] if len(row) > 2 else None))
+        if not parsed and not invalid:
+            await ctx.send_help()
+            return
+        if len(parsed) > self.MAX_IMPORT_ROWS:
+            await ctx.send(f"Only up to {self.MAX_IMPORT_ROWS} rows can be imported at once.")
+            return
+
+        async with ctx.typing():
+            report = await self.register_summoners(ctx.guild.id, parsed)
+        # re-calculate time between check games loops, once for the whole batch
+        await self.calculate_cooldown()
+
+        sections = [
+            (
+                f"Registered ({len(report['registered'])})",
+                [f"{member}: {name}" for member, name in report["registered"]],
+            ),
+            (
+                f"Not found ({len(report['not_found'])})",
+                [f"{member}: {name}" for member, name in report["not_found"]],
+            ),
+            (
+                f"Conflicts ({len(report['conflicts'])})",
+                [f"{member}: {name} - {reason}" for member, name, reason in report["conflicts"]],
+            ),
+            (
+                f"Failed ({len(report['failed']) + len(invalid)})",
+                invalid
+                + [f"{member}: {name} - {reason}" for member, name, reason in report["failed"]],
+            ),
+        ]
+        embed = await Ezreal.build_embed(
+            self,
+            title="SUMMONER IMPORT",
+            _type="apiSuccess" if report["registered"] else None,
+        )
+        for title, lines in sections:
+            if lines:
+                embed.add_field(name=title, value=self.clip_lines(lines), inline=False)
+        await ctx.send(content=ctx.author.mention, embed=embed)
+
+    @staticmethod
+    def clip_lines(lines, limit=1024) -> str:
+        """Joins as many lines as fit in an embed field, saying how many were left out."""
+        value = ""
+        for shown, line in enumerate(lines):
+            more = f"\n...and {len(lines) - shown} more"
+            if len(value) + len(line) + len(more) + 1 > limit:
+                return value + more
+            value += ("\n" if value else "") + line
+        return value
 
     @leagueset.command(name="channel")
     @commands.guild_only()
@@ -476,7 +787,8 @@ class LeagueCog(
         Example:
             [p]leagueset channel
         """
-        await self.config.alert_channel.set(ctx.channel.id)
+        await self.config.guild(ctx.guild).alert_channel.set(ctx.channel.id)
+        await self.refresh_roster_guild(ctx.guild.id)
         await ctx.send("Channel set.")
 
     @leagueset.command(name="enable-matches")
@@ -491,8 +803,129 @@ class LeagueCog(
         """
         # Need some logic to make sure a channel is set before allowing this command to run.
         await self.config.guild(ctx.guild).poll_guild_games.set(True)
+        await self.refresh_roster_guild(ctx.guild.id)
+        await self.calculate_cooldown()
         await ctx.send("Match tracking enabled.")
 
+    @leagueset.command(name="concurrency")
+    @checks.is_owner()
+    async def set_concurrency(self, ctx: commands.Context, limit: int):
+        """
+        Sets how many summoners can be checked against the Riot API at the same time, per region.
+        The rate limiter still decides how fast requests go out, this only caps how many are in flight.
+
+        Example:
+            [p]leagueset concurrency 10
+        """
+        if limit < 1:
+            await ctx.send("Concurrency must be at least 1.")
+            return
+        await self.config.max_concurrent_requests.set(limit)
+        # the running loop picks this up on its next pass
+        self.max_concurrent_requests = limit
+        await ctx.send(f"Up to {limit} summoners per region will be checked at once.")
+
+    @leagueset.command(name="dedupe-window")
+    @checks.is_owner()
+    async def set_dedupe_window(self, ctx: commands.Context, hours: float):
+        """
+        Sets how long posted games are remembered so they aren't announced twice.
+        Games older than this are forgotten to keep the stored list small.
+
+        Example:
+            [p]leagueset dedupe-window 24
+        """
+        if hours <= 0:
+            await ctx.send("The window must be longer than 0 hours.")
+            return
+        self.posted_games_ttl = int(hours * 3600)
+        await self.config.posted_games_ttl.set(self.posted_games_ttl)
+        await ctx.send(f"Posted games will be remembered for {hours:g} hours.")
+
+    @leagueset.command(name="stats")
+    @checks.is_owner()
+    async def show_stats(self, ctx: commands.Context):
+        """
+        Shows how long the poll loop and each of its phases take, Riot API latency
+            and status counts per region and endpoint, rate limit headroom and queue depths.
+
+        Example:
+            [p]leagueset stats
+        """
+        for page in pagify(self.stats_report(), page_length=1900):
+            await ctx.send(box(page))
+
+    @leagueset.command(name="metrics")
+    @checks.is_owner()
+    async def set_metrics_port(self, ctx: commands.Context, port: int = 0):
+        """
+        Serves the stats in Prometheus text format on http://127.0.0.1:<port>/metrics.
+        Only listens locally, leave the port out (or use 0) to turn it off.
+
+        Example:
+            [p]leagueset metrics 9187
+        """
+        if not port:
+            await self.stop_metrics_server()
+            await self.config.metrics_port.set(None)
+            await ctx.send("Metrics endpoint turned off.")
+            return
+        try:
+            await self.start_metrics_server(port)
+        except OSError as error:
+            await ctx.send(f"Couldn't listen on port {port}: {error}")
+            return
+        await self.config.metrics_port.set(port)
+        await ctx.send(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+
+    @leagueset.command(name="capture")
+    @checks.is_owner()
+    async def toggle_capture(self, ctx: commands.Context, enabled: bool):
+        """
+        Records every Riot API request and response (without the API key) to the cog's data folder.
+        Captures are gzipped, rotated and can be fed back through the poll loop with
+            benchmarks/replay.py to reproduce a bad night offline.
+
+        Example:
+            [p]leagueset capture on
+        """
+        self.set_capture(enabled)
+        await self.config.capture_riot_traffic.set(enabled)
+        if enabled:
+            await ctx.send(f"Recording Riot traffic to `{self._capture_path()}`.")
+        else:
+            await ctx.send("Stopped recording Riot traffic.")
+
+    @leagueset.command(name="shard")
+    @checks.is_owner()
+    async def set_shard(self, ctx: commands.Context, path: str = None):
+        """
+        Splits polling with every other bot process pointed at the same SQLite file.
+        Each process polls its share of everyone's summoners and posts for its own guilds,
+            so give every process its own Riot API keys. Processes tell each other about
+            summoners by name, so the keys don't need to belong to the same application.
+            Leave the path out to poll alone.
+
+        Example:
+            [p]leagueset shard /srv/red/league-shard.sqlite3
+        """
+        if not path:
+            await self.stop_sharding()
+            await self.config.shard_db_path.set(None)
+            await self.calculate_cooldown()
+            await ctx.send("Polling every summoner from this process again.")
+            return
+        try:
+            await self.start_sharding(path)
+        except sqlite3.Error as error:
+            await ctx.send(f"Couldn't open `{path}`: {error}")
+            return
+        await self.config.shard_db_path.set(path)
+        await self.calculate_cooldown()
+        await ctx.send(
+            f"Sharding as `{self.shard.node_id}` with {len(self._shard_ring.nodes)} process(es)."
+        )
+
     @leagueset.command(name="reset")
     @checks.is_owner()
     async def reset_guild(self, ctx: commands.Context):
@@ -503,9 +936,36 @@ class LeagueCog(
         Example:
             [p]leagueset reset
         """
+        self.discard_pending_writes()
         await self.config.clear_all()
+        if self.history:
+            await self._history_call(self.history.clear)
+        self.scheduler = PollScheduler()
+        await self.load_posted_games()
+        await self.build_roster()
+        await self.calculate_cooldown()
         await ctx.send("Data cleared.")
 
+    @leagueset.command(name="reconcile")
+    @checks.is_owner()
+    async def reconcile_roster(self, ctx: commands.Context):
+        """
+        Rebuilds the list of polled summoners and the polling counts from scratch.
+        These are normally kept up to date as people register, so this is only needed if they drift.
+
+        Example:
+            [p]leagueset reconcile
+        """
+        await self.flush_writes()
+        await self.build_roster()
+        await self.calculate_cooldown()
+        counts = self.polling_counts
+        regions = ", ".join(f"{r.upper()}: {n}" for r, n in counts.by_region.items()) or "none"
+        await ctx.send(
+            f"Polling {counts.unique} summoners for {counts.total} members"
+            f" across {len(counts.by_guild)} guilds ({regions})."
+        )
+
     @leagueset.command(name="update")
     @checks.is_owner()
     async def update_version_data(self, ctx: commands.Context):
@@ -515,8 +975,8 @@ class LeagueCog(
         Example:
             [p]leagueset update
         """
-        await self.update_version()
-        await ctx.send("Version patched.")
+        await self.update_version(force=True)
+        await ctx.send(f"Version patched to {self.champ_api_version}.")
 
     @leagueset.command(name="league-token")
     @checks.is_owner()
@@ -1,10 +1,21 @@
 from abc import ABC, abstractmethod
-from typing import List, Tuple, Optional
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set, Tuple, Optional, TYPE_CHECKING
 
 import discord
 from redbot.core import Config, commands
 from redbot.core.bot import Red
 
+if TYPE_CHECKING:
+    from .blitzcrank import Champion, CircuitBreaker, TrafficRecorder, TTLCache
+    from .ezreal import OutboundMessage
+    from .kindred import HashRing, ShardCoordinator
+    from .nasus import GameHistory
+    from .rengar import PollingCounts, RosterEntry
+    from .teemo import Metrics
+    from .zilean import ApiKeyPool, PollScheduler
+
 
 class MixInMeta(ABC):
     """
@@ -16,3 +27,37 @@ class MixInMeta(ABC):
         self.config: Config
         self.bot: Red
         self.cache: dict
+        self.api_keys: "ApiKeyPool"
+        self.scheduler: "PollScheduler"
+        self.total_polling_users: int
+        self.max_concurrent_requests: int
+        self.breakers: Dict[str, "CircuitBreaker"]
+        self.recorder: Optional["TrafficRecorder"]
+        self._outbox: Dict[int, Dict[tuple, "OutboundMessage"]]
+        self._outbox_tasks: Dict[int, asyncio.Task]
+        self._sent_messages: Dict[tuple, int]
+        self.champions: Dict[int, "Champion"]
+        self.roster: Dict[int, Dict[int, "RosterEntry"]]
+        self.polling_counts: "PollingCounts"
+        self.posted_games: Dict[int, Dict[str, float]]
+        self.posted_games_ttl: int
+        self._pending_members: Dict[Tuple[int, int], dict]
+        self._pending_guilds: Dict[int, dict]
+        self._pending_global: dict
+        self._write_task: Optional[asyncio.Task]
+        self.metrics: "Metrics"
+        self.shard: Optional["ShardCoordinator"]
+        self._shard_executor: Optional[ThreadPoolExecutor]
+        self._shard_task: Optional[asyncio.Task]
+        self._shard_ring: Optional["HashRing"]
+        self._shard_pairs: Set[Tuple[str, str]]
+        self._shard_in_game: Set[Tuple[str, str]]
+        self._shard_remote: Dict[Tuple[str, str], Tuple[Tuple[str, str], Optional[str]]]
+        self.history: Optional["GameHistory"]
+        self._history_executor: Optional[ThreadPoolExecutor]
+        self._match_fetches: Dict[str, asyncio.Future]
+        self.pending_results: int
+        self.rank_cache: "TTLCache"
+        self.summoner_cache: "TTLCache"
+        self._rank_fetches: Dict[Tuple[str, str], asyncio.Task]
+        self._rank_followups: Set[asyncio.Task]
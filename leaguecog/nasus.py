@@ -0,0 +1,444 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from redbot.core.data_manager import cog_data_path
+
+from .blitzcrank import find_participants
+from .mixinmeta import MixInMeta
+
+
+log = logging.getLogger("red.creamy-cogs.league")
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    platform TEXT NOT NULL,
+    game_id INTEGER NOT NULL,
+    queue_id INTEGER,
+    game_mode TEXT,
+    started_at REAL NOT NULL,
+    ended_at REAL,
+    PRIMARY KEY (platform, game_id)
+);
+CREATE TABLE IF NOT EXISTS participants (
+    platform TEXT NOT NULL,
+    game_id INTEGER NOT NULL,
+    guild_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    summoner_id TEXT NOT NULL,
+    champion_id INTEGER NOT NULL,
+    team_id INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    PRIMARY KEY (platform, game_id, guild_id, member_id)
+);
+CREATE INDEX IF NOT EXISTS participants_member
+    ON participants (guild_id, member_id, started_at);
+CREATE INDEX IF NOT EXISTS participants_guild ON participants (guild_id, started_at);
+CREATE INDEX IF NOT EXISTS participants_champion ON participants (guild_id, champion_id);
+CREATE TABLE IF NOT EXISTS outcomes (
+    platform TEXT NOT NULL,
+    game_id INTEGER NOT NULL,
+    summoner_id TEXT NOT NULL,
+    win INTEGER NOT NULL,
+    kills INTEGER,
+    deaths INTEGER,
+    assists INTEGER,
+    duration INTEGER,
+    PRIMARY KEY (platform, game_id, summoner_id)
+);
+CREATE TABLE IF NOT EXISTS match_sync (
+    puuid TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS match_ids (
+    puuid TEXT NOT NULL,
+    match_id TEXT NOT NULL,
+    PRIMARY KEY (puuid, match_id)
+);
+CREATE TABLE IF NOT EXISTS pending_results (
+    platform TEXT NOT NULL,
+    game_id INTEGER NOT NULL,
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER,
+    champ_id TEXT,
+    players TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_attempt REAL NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (platform, game_id, guild_id)
+);
+CREATE INDEX IF NOT EXISTS pending_results_due ON pending_results (next_attempt);
+CREATE TABLE IF NOT EXISTS matches (
+    match_id TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS activity (
+    summoner TEXT PRIMARY KEY,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS activity_hours (
+    summoner TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    games INTEGER NOT NULL,
+    PRIMARY KEY (summoner, hour)
+);
+"""
+
+
+class PendingResult(NamedTuple):
+    """An ended game waiting for match-v5 to have its result, see Ekko."""
+
+    platform: str
+    game_id: int
+    guild_id: int
+    channel_id: int
+    message_id: Optional[int]
+    champ_id: str
+    players: str  # JSON of puuid -> [summoner name, summoner id, API key name]
+    attempts: int
+    next_attempt: float
+    created_at: float
+
+
+class GameHistory:
+    """
+    Every game we announced, who we tracked in it and how it went, in one SQLite file.
+    Participants only holds tracked members, one row per guild that announced the game,
+        with started_at copied in so per guild and per member queries stay on one index.
+    Every method blocks, Nasus runs them on a single worker thread so writes keep their order.
+
+    activity is what the poll scheduler knows about when each summoner plays, keyed
+        "region:summoner_id". Game starts are counted with increments rather than by
+        rewriting a summoner's whole histogram, so it doesn't matter what's in memory.
+
+    The same file caches match-v5: which match ids each puuid has played (match_ids,
+        with match_sync remembering how far back we've looked) and the match payloads
+        themselves, zlib compressed and keyed by match id, so everyone in a match shares one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        self._db = sqlite3.connect(self.path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(HISTORY_SCHEMA)
+
+    def close(self):
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def record_start(self, platform: str, game_data: dict, players: List[tuple]):
+        """players are (guild_id, member_id, summoner_id, champion_id, team_id)."""
+        started_at = game_data["gameStartTime"] / 1000 or time.time()
+        game_id = game_data["gameId"]
+        with self._db as db:
+            db.execute(
+                "INSERT OR IGNORE INTO games (platform, game_id, queue_id, game_mode, started_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (
+                    platform,
+                    game_id,
+                    game_data.get("gameQueueConfigId"),
+                    game_data.get("gameMode"),
+                    started_at,
+                ),
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO participants (platform, game_id, guild_id, member_id,"
+                " summoner_id, champion_id, team_id, started_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(platform, game_id, *player, started_at) for player in players],
+            )
+
+    def record_end(self, platform: str, game_id: int, ended_at: float):
+        with self._db as db:
+            db.execute(
+                "UPDATE games SET ended_at = ? WHERE platform = ? AND game_id = ?"
+                " AND ended_at IS NULL",
+                (ended_at, platform, game_id),
+            )
+
+    def record_outcomes(self, platform: str, game_id: int, outcomes: Iterable[tuple]):
+        """outcomes are (summoner_id, win, kills, deaths, assists, duration)."""
+        with self._db as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO outcomes (platform, game_id, summoner_id, win, kills,"
+                " deaths, assists, duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(platform, game_id, *outcome) for outcome in outcomes],
+            )
+
+    def last_match_sync(self, puuid: str) -> Optional[float]:
+        row = self._db.execute(
+            "SELECT synced_at FROM match_sync WHERE puuid = ?", (puuid,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def add_match_ids(self, puuid: str, match_ids: List[str], synced_at: float) -> List[str]:
+        """Stores the ids we hadn't seen for this puuid yet and returns them."""
+        with self._db as db:
+            known = {
+                row[0]
+                for row in db.execute("SELECT match_id FROM match_ids WHERE puuid = ?", (puuid,))
+            }
+            new = [match_id for match_id in match_ids if match_id not in known]
+            db.executemany(
+                "INSERT OR IGNORE INTO match_ids (puuid, match_id) VALUES (?, ?)",
+                [(puuid, match_id) for match_id in new],
+            )
+            db.execute(
+                "INSERT INTO match_sync (puuid, synced_at) VALUES (?, ?)"
+                " ON CONFLICT (puuid) DO UPDATE SET synced_at = excluded.synced_at",
+                (puuid, synced_at),
+            )
+        return new
+
+    def has_match_id(self, puuid: str, match_id: str) -> bool:
+        return bool(
+            self._db.execute(
+                "SELECT 1 FROM match_ids WHERE puuid = ? AND match_id = ?", (puuid, match_id)
+            ).fetchone()
+        )
+
+    def get_match(self, match_id: str) -> Optional[dict]:
+        row = self._db.execute(
+            "SELECT data FROM matches WHERE match_id = ?", (match_id,)
+        ).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def put_match(self, match_id: str, data: dict):
+        blob = zlib.compress(json.dumps(data, separators=(",", ":")).encode())
+        with self._db as db:
+            db.execute(
+                "INSERT OR REPLACE INTO matches (match_id, fetched_at, data) VALUES (?, ?, ?)",
+                (match_id, time.time(), blob),
+            )
+
+    def record_activity(self, summoner: str, seen_at: float, started: bool):
+        """Moves a summoner's last time in game forward, counting a game start in its hour."""
+        with self._db as db:
+            db.execute(
+                "INSERT INTO activity (summoner, last_seen) VALUES (?, ?) ON CONFLICT (summoner)"
+                " DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)",
+                (summoner, seen_at),
+            )
+            if started:
+                db.execute(
+                    "INSERT INTO activity_hours (summoner, hour, games) VALUES (?, ?, 1)"
+                    " ON CONFLICT (summoner, hour) DO UPDATE SET games = games + 1",
+                    (summoner, datetime.utcfromtimestamp(seen_at).hour),
+                )
+
+    def import_activity(self, activity: Dict[str, dict]):
+        """Takes over activity from before it lived here, as PollScheduler.activity holds it."""
+        with self._db as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO activity (summoner, last_seen) VALUES (?, ?)",
+                [(summoner, data["last_seen"]) for summoner, data in activity.items()],
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO activity_hours (summoner, hour, games) VALUES (?, ?, ?)",
+                [
+                    (summoner, hour, games)
+                    for summoner, data in activity.items()
+                    for hour, games in enumerate(data["hours"])
+                    if games
+                ],
+            )
+
+    def load_activity(self, keep: Set[str]) -> Dict[str, dict]:
+        """Activity of the summoners in keep, everyone else's is deleted."""
+        activity = {
+            summoner: {"last_seen": last_seen, "hours": [0] * 24}
+            for summoner, last_seen in self._db.execute("SELECT summoner, last_seen FROM activity")
+        }
+        for summoner, hour, games in self._db.execute(
+            "SELECT summoner, hour, games FROM activity_hours"
+        ):
+            if summoner in activity:
+                activity[summoner]["hours"][hour] = games
+        gone = [(summoner,) for summoner in activity if summoner not in keep]
+        with self._db as db:
+            db.executemany("DELETE FROM activity WHERE summoner = ?", gone)
+            db.executemany("DELETE FROM activity_hours WHERE summoner = ?", gone)
+        return {summoner: data for summoner, data in activity.items() if summoner in keep}
+
+    def queue_result(self, pending: PendingResult):
+        with self._db as db:
+            db.execute(
+                "INSERT OR REPLACE INTO pending_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                pending,
+            )
+
+    def due_results(self, now: float, limit: int) -> Tuple[List[PendingResult], int]:
+        """Up to `limit` results due by now, most overdue first, and how many are queued in all."""
+        rows = self._db.execute(
+            "SELECT * FROM pending_results WHERE next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+            (now, limit),
+        ).fetchall()
+        total = self._db.execute("SELECT COUNT(*) FROM pending_results").fetchone()[0]
+        return [PendingResult(*row) for row in rows], total
+
+    def reschedule_result(self, pending: PendingResult, next_attempt: float):
+        with self._db as db:
+            db.execute(
+                "UPDATE pending_results SET attempts = attempts + 1, next_attempt = ?"
+                " WHERE platform = ? AND game_id = ? AND guild_id = ?",
+                (next_attempt, pending.platform, pending.game_id, pending.guild_id),
+            )
+
+    def drop_result(self, pending: PendingResult):
+        with self._db as db:
+            db.execute(
+                "DELETE FROM pending_results WHERE platform = ? AND game_id = ? AND guild_id = ?",
+                (pending.platform, pending.game_id, pending.guild_id),
+            )
+
+    def forget_member(self, member_id: int, guild_id: Optional[int] = None):
+        with self._db as db:
+            if guild_id is None:
+                db.execute("DELETE FROM participants WHERE member_id = ?", (member_id,))
+            else:
+                db.execute(
+                    "DELETE FROM participants WHERE guild_id = ? AND member_id = ?",
+                    (guild_id, member_id),
+                )
+
+    def clear(self):
+        with self._db as db:
+            for table in (
+                "participants",
+                "outcomes",
+                "games",
+                "pending_results",
+                "match_sync",
+                "match_ids",
+                "matches",
+                "activity",
+                "activity_hours",
+            ):
+                db.execute(f"DELETE FROM {table}")
+
+    def games_per_member(self, guild_id: int, since: float, limit: int) -> List[Tuple[int, int]]:
+        """(member_id, games) since a unix time, most games first."""
+        return self._db.execute(
+            "SELECT member_id, COUNT(*) AS played FROM participants"
+            " WHERE guild_id = ? AND started_at >= ?"
+            " GROUP BY member_id ORDER BY played DESC LIMIT ?",
+            (guild_id, since, limit),
+        ).fetchall()
+
+    def top_champions(
+        self, guild_id: int, since: float, limit: int, member_id: Optional[int] = None
+    ) -> List[Tuple[int, int]]:
+        """(champion_id, games) since a unix time, for the whole guild or one member."""
+        query = "SELECT champion_id, COUNT(*) AS played FROM participants WHERE guild_id = ?"
+        params = [guild_id]
+        if member_id is not None:
+            query += " AND member_id = ?"
+            params.append(member_id)
+        query += " AND started_at >= ? GROUP BY champion_id ORDER BY played DESC LIMIT ?"
+        return self._db.execute(query, (*params, since, limit)).fetchall()
+
+
+class Nasus(MixInMeta):
+    """
+    'The cycle of life and death continues. We will live, they will die.'
+
+    This class is responsible for keeping a history of every game we announce.
+
+    Games, the tracked members in them and their outcomes go into a SQLite file
+        in the cog's data folder. Writes are handed to a single worker thread and
+        never awaited, so the poll loop doesn't wait on the disk, and reads run on
+        the same thread so they always see every write queued before them.
+    """
+
+    def _history_path(self):
+        return cog_data_path(self) / "history.sqlite3"
+
+    async def open_history(self):
+        self._history_executor = ThreadPoolExecutor(1, thread_name_prefix="league-history")
+        history = GameHistory(str(self._history_path()))
+        await self._history_call(history.open)
+        self.history = history
+
+    def close_history(self):
+        if self.history:
+            self._history_executor.submit(self.history.close)
+            self._history_executor.shutdown(wait=False)
+            self.history = None
+
+    async def _history_call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._history_executor, func, *args
+        )
+
+    def _history_write(self, func, *args):
+        """Queues a write without waiting for it, failures are only logged."""
+        if not self.history:
+            return
+        future = self._history_executor.submit(func, *args)
+        future.add_done_callback(self._history_write_done)
+
+    @staticmethod
+    def _history_write_done(future):
+        error = future.exception()
+        if error:
+            log.warning(f"Couldn't write game history: {error}")
+
+    def history_start(self, game_data: dict, trackers):
+        """Records a game we just announced for the tracked members of one guild."""
+        if not self.history:
+            return
+        participants = find_participants(game_data["participants"], [e for e, _ in trackers])
+        players = []
+        for entry, _ in trackers:
+            participant = participants.get(entry.summoner_id)
+            if participant:
+                players.append(
+                    (
+                        entry.guild_id,
+                        entry.member_id,
+                        entry.summoner_id,
+                        participant["championId"],
+                        participant["teamId"],
+                    )
+                )
+        if players:
+            self._history_write(
+                self.history.record_start, trackers[0][0].region, game_data, players
+            )
+
+    def history_end(self, platform: str, game_id: int):
+        if self.history:
+            self._history_write(self.history.record_end, platform, game_id, time.time())
+
+    def history_forget(self, member_id: int, guild_id: Optional[int] = None):
+        if self.history:
+            self._history_write(self.history.forget_member, member_id, guild_id)
+
+    async def games_per_member(self, guild_id: int, days: float, limit: int = 10):
+        if not self.history:
+            return []
+        since = time.time() - days * 86400
+        return await self._history_call(self.history.games_per_member, guild_id, since, limit)
+
+    async def top_champions(
+        self, guild_id: int, days: float, member_id: Optional[int] = None, limit: int = 5
+    ):
+        if not self.history:
+            return []
+        since = time.time() - days * 86400
+        return await self._history_call(
+            self.history.top_champions, guild_id, since, limit, member_id
+        )
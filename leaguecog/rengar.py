@@ -0,0 +1,352 @@
+import asyncio
+import copy
+import logging
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Optional
+
+import discord
+
+from .mixinmeta import MixInMeta
+
+
+log = logging.getLogger("red.creamy-cogs.league")
+
+
+class RosterEntry:
+    """A single summoner we poll for, registered to a member of a guild."""
+
+    __slots__ = (
+        "guild_id",
+        "member_id",
+        "region",
+        "summoner_id",
+        "summoner_name",
+        "puuid",
+        "key_name",
+        "channel_id",
+        "active_game",
+    )
+
+    def __init__(
+        self,
+        guild_id,
+        member_id,
+        region,
+        summoner_id,
+        summoner_name,
+        puuid,
+        key_name,
+        channel_id,
+        active_game,
+    ):
+        self.guild_id = guild_id
+        self.member_id = member_id
+        self.region = region
+        self.summoner_id = summoner_id
+        self.summoner_name = summoner_name
+        self.puuid = puuid
+        self.key_name = key_name
+        self.channel_id = channel_id
+        self.active_game = active_game
+
+    def __repr__(self):
+        return f"<RosterEntry guild={self.guild_id} member={self.member_id} summoner={self.summoner_name}>"
+
+
+class PollingCounts:
+    """
+    Running totals of polling users, kept in step with the roster so Zilean
+        never has to walk every guild and member to count them.
+    """
+
+    def __init__(self):
+        # every polling (guild, member)
+        self.total = 0
+        self.by_guild = Counter()
+        # unique (region, summoner_id) pairs, which is what actually costs requests
+        self.by_summoner = Counter()
+        self.by_region = Counter()
+
+    @property
+    def unique(self) -> int:
+        return len(self.by_summoner)
+
+    def add(self, entry: RosterEntry):
+        self.total += 1
+        self.by_guild[entry.guild_id] += 1
+        summoner = (entry.region, entry.summoner_id)
+        self.by_summoner[summoner] += 1
+        if self.by_summoner[summoner] == 1:
+            self.by_region[entry.region] += 1
+
+    def remove(self, entry: RosterEntry):
+        self.total -= 1
+        self._decrement(self.by_guild, entry.guild_id)
+        if self._decrement(self.by_summoner, (entry.region, entry.summoner_id)):
+            self._decrement(self.by_region, entry.region)
+
+    @staticmethod
+    def _decrement(counter: Counter, key) -> bool:
+        """Returns True if that was the last one, so we don't leave zeroes lying around."""
+        counter[key] -= 1
+        if counter[key] <= 0:
+            del counter[key]
+            return True
+        return False
+
+
+class Rengar(MixInMeta):
+    """
+    'The hunt is on!'
+
+    This class is responsible for keeping track of who we are hunting games for.
+
+    The roster is an in-memory copy of every (guild, member) that should be polled:
+        the guild has match polling enabled, the user has polling turned on and
+        the member has a summoner registered. check_games polls straight from it,
+        so a loop costs no Config reads or Discord calls.
+
+    It is built once at initialize and kept up to date by the commands that
+        change who should be polled. polling_counts follows every change, and
+        a full rebuild ([p]leagueset reconcile) resets both from Config.
+
+    posted_games remembers which games were already announced in each guild,
+        so a game that pops back up right after it ended isn't posted twice.
+        Entries expire after posted_games_ttl seconds and each guild keeps
+        at most MAX_POSTED_GAMES of them.
+
+    Registration and game state changes are written behind: queue_member_update
+        and friends merge them per member/guild, and the write-behind task saves
+        each entity in one write every WRITE_BEHIND_SECONDS. refresh_roster_member
+        reads through anything still pending, and cog_unload flushes what's left.
+    """
+
+    MAX_POSTED_GAMES = 1000
+    WRITE_BEHIND_SECONDS = 2
+
+    @staticmethod
+    def _roster_entry(
+        guild_id, member_id, guild_data, member_data, poll_user
+    ) -> Optional[RosterEntry]:
+        """Returns a RosterEntry if this member should be polled, otherwise None."""
+        if not (
+            guild_data.get("poll_guild_games") and poll_user and member_data.get("summoner_id")
+        ):
+            return None
+        return RosterEntry(
+            guild_id,
+            member_id,
+            member_data["region"],
+            member_data["summoner_id"],
+            member_data["summoner_name"],
+            member_data.get("puuid", ""),
+            # registered before there could be more than one key
+            member_data.get("api_key") or "api_key",
+            guild_data.get("alert_channel"),
+            member_data.get("active_game") or {},
+        )
+
+    async def build_roster(self):
+        """Builds the whole roster from Config. Only meant to run at startup or after a reset."""
+        log.debug("Building roster...")
+        guilds = await self.config.all_guilds()
+        users = await self.config.all_users()
+        roster = {}
+        counts = PollingCounts()
+        for guild_id, guild_members in (await self.config.all_members()).items():
+            guild_data = guilds.get(guild_id, {})
+            for member_id, member_data in guild_members.items():
+                poll_user = users.get(member_id, {}).get("poll_user_games", True)
+                entry = self._roster_entry(guild_id, member_id, guild_data, member_data, poll_user)
+                if entry:
+                    roster.setdefault(guild_id, {})[member_id] = entry
+                    counts.add(entry)
+        self.roster = roster
+        self.polling_counts = counts
+        log.debug(f"Roster built with {sum(len(m) for m in roster.values())} summoners.")
+
+    async def refresh_roster_member(self, guild_id: int, member_id: int):
+        """Re-reads a single member from Config and adds, updates or drops their roster entry."""
+        guild_data = await self.config.guild_from_id(guild_id).all()
+        guild_data.update(self._pending_guilds.get(guild_id, {}))
+        member_data = await self.config.member_from_ids(guild_id, member_id).all()
+        member_data.update(self._pending_members.get((guild_id, member_id), {}))
+        poll_user = await self.config.user_from_id(member_id).poll_user_games()
+        entry = self._roster_entry(guild_id, member_id, guild_data, member_data, poll_user)
+        members = self.roster.setdefault(guild_id, {})
+        old = members.pop(member_id, None)
+        if old:
+            self.polling_counts.remove(old)
+        if entry:
+            members[member_id] = entry
+            self.polling_counts.add(entry)
+        if not members:
+            del self.roster[guild_id]
+
+    async def refresh_roster_user(self, user_id: int):
+        """Refreshes a user's entries in every guild they are registered in."""
+        all_members = await self.config.all_members()
+        # Entries whose Config was just cleared won't show up in all_members anymore.
+        guild_ids = {g for g, members in all_members.items() if user_id in members}
+        guild_ids |= {g for g, members in self.roster.items() if user_id in members}
+        guild_ids |= {g for g, m in self._pending_members if m == user_id}
+        for guild_id in guild_ids:
+            await self.refresh_roster_member(guild_id, user_id)
+
+    async def refresh_roster_guild(self, guild_id: int):
+        """Refreshes every entry in a guild, ie. after polling is enabled or the channel changes."""
+        guild_members = await self.config.all_members(guild=discord.Object(id=guild_id))
+        member_ids = set(guild_members) | set(self.roster.get(guild_id, {}))
+        member_ids |= {m for g, m in self._pending_members if g == guild_id}
+        for member_id in member_ids:
+            await self.refresh_roster_member(guild_id, member_id)
+
+    async def load_posted_games(self):
+        """Loads every guild's recently posted games into memory, oldest first."""
+        self.posted_games_ttl = await self.config.posted_games_ttl()
+        self.posted_games = {}
+        for guild_id, guild_data in (await self.config.all_guilds()).items():
+            recent = sorted(guild_data["recent_games"].items(), key=lambda kv: kv[1])
+            if recent:
+                self.posted_games[guild_id] = OrderedDict(recent)
+
+    def already_posted(self, guild_id: int, game_key: str) -> bool:
+        posted_at = self.posted_games.get(guild_id, {}).get(game_key)
+        return posted_at is not None and posted_at > time.time() - self.posted_games_ttl
+
+    def mark_posted(self, guild_id: int, game_key: str):
+        """Remembers a game as posted, pruning anything that expired or overflowed."""
+        now = time.time()
+        games = self.posted_games.setdefault(guild_id, OrderedDict())
+        games[game_key] = now
+        games.move_to_end(game_key)
+
+        # Games are kept in the order they were posted, so expired ones are all at the front.
+        while games and (
+            len(games) > self.MAX_POSTED_GAMES
+            or next(iter(games.values())) <= now - self.posted_games_ttl
+        ):
+            games.popitem(last=False)
+
+        # Saved whole, so any number of games posted between flushes is still one write.
+        self.queue_guild_update(guild_id, recent_games=games)
+
+    async def migrate_posted_games(self):
+        """
+        One-time move from the ever-growing posted_games list to recent_games.
+        Old entries get the current time, so they age out after one window,
+            and only the newest MAX_POSTED_GAMES of them are kept.
+        """
+        if await self.config.schema_version() >= 1:
+            return
+        now = time.time()
+        for guild_id, guild_data in (await self.config.all_guilds()).items():
+            legacy = guild_data.get("posted_games")
+            if not legacy:
+                continue
+            log.debug(f"Migrating {len(legacy)} posted games for guild {guild_id}")
+            guild = self.config.guild_from_id(guild_id)
+            recent = {key: now for key in legacy[-self.MAX_POSTED_GAMES :]}
+            recent.update(guild_data["recent_games"])
+            await guild.recent_games.set(recent)
+            await guild.posted_games.clear()
+        await self.config.schema_version.set(1)
+
+    async def guild_members(self, guild_id: int) -> Dict[int, dict]:
+        """Every member's Config data in a guild, with the writes still queued for them applied."""
+        members = await self.config.all_members(guild=discord.Object(id=guild_id))
+        for (g, member_id), values in self._pending_members.items():
+            if g == guild_id:
+                members.setdefault(member_id, {}).update(values)
+        return members
+
+    def queue_member_update(self, guild_id: int, member_id: int, **values):
+        """Queues top level member values to be saved with the next flush."""
+        self._pending_members.setdefault((guild_id, member_id), {}).update(values)
+
+    def queue_guild_update(self, guild_id: int, **values):
+        """Queues top level guild values to be saved with the next flush."""
+        self._pending_guilds.setdefault(guild_id, {}).update(values)
+
+    def queue_global_update(self, **values):
+        """Queues top level global values to be saved with the next flush."""
+        self._pending_global.update(values)
+
+    def discard_pending_writes(self, guild_id: int = None, member_id: int = None):
+        """
+        Drops queued writes that are about to be cleared from Config anyway,
+            so a flush doesn't bring them back. No arguments drops everything.
+        """
+        if guild_id is None and member_id is None:
+            self._pending_members.clear()
+            self._pending_guilds.clear()
+            self._pending_global.clear()
+        else:
+            self._pending_members.pop((guild_id, member_id), None)
+
+    async def flush_writes(self):
+        """Saves every queued update, one write per member, guild and the global scope."""
+        with self.timed("config_flush"):
+            await self._flush_writes()
+
+    async def _flush_writes(self):
+        members, self._pending_members = self._pending_members, {}
+        guilds, self._pending_guilds = self._pending_guilds, {}
+        global_values, self._pending_global = self._pending_global, {}
+
+        writes = [
+            (self.config.member_from_ids(*ids), values, self._pending_members, ids)
+            for ids, values in members.items()
+        ]
+        writes += [
+            (self.config.guild_from_id(guild_id), values, self._pending_guilds, guild_id)
+            for guild_id, values in guilds.items()
+        ]
+        global_values = list(global_values.items())
+        done = 0
+        try:
+            for group, values, pending, key in writes:
+                # Copied, since some values are live dicts we keep mutating in memory.
+                values = copy.deepcopy(values)
+                try:
+                    async with group.all() as data:
+                        data.update(values)
+                except Exception as error:
+                    log.exception(
+                        f"Failed to save queued Config writes for {key}:", exc_info=error
+                    )
+                    # Put them back underneath anything newer that was queued meanwhile.
+                    pending[key] = {**values, **pending.get(key, {})}
+                done += 1
+
+            # Config has no global .all(), but there are only a few global values.
+            for name, value in global_values:
+                try:
+                    await getattr(self.config, name).set(copy.deepcopy(value))
+                except Exception as error:
+                    log.exception(f"Failed to save queued Config write {name}:", exc_info=error)
+                    self._pending_global.setdefault(name, value)
+                done += 1
+        except asyncio.CancelledError:
+            # Cancelled mid-flush, so whatever wasn't saved yet goes back in the queue.
+            for _, values, pending, key in writes[done:]:
+                pending[key] = {**values, **pending.get(key, {})}
+            for name, value in global_values[max(0, done - len(writes)) :]:
+                self._pending_global.setdefault(name, value)
+            raise
+
+    async def final_flush(self):
+        """Stops the write-behind task and saves everything still queued, for cog_unload."""
+        if self._write_task:
+            self._write_task.cancel()
+            # lets a flush it was in the middle of put its unsaved writes back first
+            await asyncio.gather(self._write_task, return_exceptions=True)
+        await self.flush_writes()
+
+    async def _write_behind(self):
+        """Flushes queued Config writes every WRITE_BEHIND_SECONDS."""
+        while True:
+            await asyncio.sleep(self.WRITE_BEHIND_SECONDS)
+            if self._pending_members or self._pending_guilds or self._pending_global:
+                await self.flush_writes()
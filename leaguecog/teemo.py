@@ -0,0 +1,273 @@
+import logging
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from aiohttp import web
+
+from .mixinmeta import MixInMeta
+
+
+log = logging.getLogger("red.creamy-cogs.league")
+
+# upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """Counts observations into LATENCY_BUCKETS, plus a running sum and count."""
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        # the extra bucket holds everything over the largest bound
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                break
+        else:
+            i = len(LATENCY_BUCKETS)
+        self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket the q-th observation fell in, inf if it was past the last."""
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float("inf")
+        return 0.0
+
+    def cumulative(self):
+        """(le, count) pairs the way Prometheus expects them."""
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            yield (str(LATENCY_BUCKETS[i]) if i < len(LATENCY_BUCKETS) else "+Inf"), seen
+
+
+class Metrics:
+    """Everything Teemo has seen since the cog was loaded."""
+
+    def __init__(self):
+        self.started = time.time()
+        # phase name -> how long it took, see Teemo.timed
+        self.phases: Dict[str, Histogram] = defaultdict(Histogram)
+        # (region, method) -> latency of every Riot API attempt
+        self.requests: Dict[Tuple[str, str], Histogram] = defaultdict(Histogram)
+        # (region, method, status) -> responses, status is 'error' if none came back
+        self.responses = Counter()
+        self.loops = Histogram()
+        self.last_loop = 0.0
+        self.refresh_timer = 0
+        # loops that took longer than the refresh timer they were meant to fit in
+        self.overruns = 0
+        self.checked_last_loop = 0
+
+
+class Teemo(MixInMeta):
+    """
+    'Captain Teemo on duty!'
+
+    This class is responsible for keeping an eye on how the cog is doing.
+
+    The poll loop and the Blitzcrank, Ezreal and Rengar helpers report into
+        self.metrics: how long each phase takes, how long every Riot request
+        took per region and endpoint, how often Riot answered 429 and how long
+        whole loops take compared to the refresh timer.
+    [p]leagueset stats summarizes it together with the rate limit headroom and
+        queue depths, and [p]leagueset metrics can serve the same numbers in
+        Prometheus text format on 127.0.0.1.
+    """
+
+    @contextmanager
+    def timed(self, phase: str):
+        """Records how long the body of the with block took under phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.metrics.phases[phase].observe(time.perf_counter() - start)
+
+    def record_request(self, region: str, method: str, status: Optional[int], seconds: float):
+        self.metrics.requests[(region, method)].observe(seconds)
+        self.metrics.responses[(region, method, str(status or "error"))] += 1
+
+    def record_loop(self, seconds: float, refresh_timer: int):
+        metrics = self.metrics
+        metrics.loops.observe(seconds)
+        metrics.last_loop = seconds
+        metrics.refresh_timer = refresh_timer
+        if seconds > refresh_timer:
+            metrics.overruns += 1
+            log.debug(f"Loop took {seconds:.2f}s, longer than the {refresh_timer}s refresh timer.")
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {
+            "outbox": self.outbox_depth(),
+            "pending_writes": len(self._pending_members)
+            + len(self._pending_guilds)
+            + len(self._pending_global),
+            "polled_summoners": self.polling_counts.unique,
+            "checked_last_loop": self.metrics.checked_last_loop,
+            "pending_results": self.pending_results,
+        }
+
+    def stats_report(self) -> str:
+        """A plain text summary for [p]leagueset stats."""
+        metrics = self.metrics
+        loops = metrics.loops
+        lines = [
+            f"Up for {int(time.time() - metrics.started)}s, {loops.count} loops",
+            f"Loop: last {metrics.last_loop:.2f}s, avg {loops.average:.2f}s,"
+            f" p95 <= {loops.quantile(0.95):g}s, refresh timer {metrics.refresh_timer}s,"
+            f" {metrics.overruns} overran",
+            "Queues: " + ", ".join(f"{k} {v}" for k, v in self.queue_depths().items()),
+            f"Rank cache: {len(self.rank_cache)} entries, {self.rank_cache.hits} hits,"
+            f" {self.rank_cache.misses} misses",
+            f"Summoner cache: {len(self.summoner_cache)} entries,"
+            f" {self.summoner_cache.hits} hits, {self.summoner_cache.misses} misses",
+            "",
+            "Phases (avg / p95 / count):",
+        ]
+        for phase, hist in sorted(metrics.phases.items()):
+            lines.append(
+                f"  {phase}: {hist.average * 1000:.1f}ms / <= {hist.quantile(0.95):g}s"
+                f" / {hist.count}"
+            )
+
+        lines += ["", "Riot requests (avg / p95 / count / statuses):"]
+        for (region, method), hist in sorted(metrics.requests.items()):
+            statuses = ", ".join(
+                f"{status}: {n}"
+                for (r, m, status), n in sorted(metrics.responses.items())
+                if (r, m) == (region, method)
+            )
+            lines.append(
+                f"  {region} {method}: {hist.average * 1000:.0f}ms / <= {hist.quantile(0.95):g}s"
+                f" / {hist.count} / {statuses}"
+            )
+
+        lines += ["", "Rate limit headroom (remaining / limit of the tightest window):"]
+        for (region, scope), (remaining, limit) in sorted(self.api_keys.headroom().items()):
+            lines.append(f"  {region} {scope}: {remaining}/{limit}")
+        return "\n".join(lines)
+
+    def prometheus_text(self) -> str:
+        """The same numbers in Prometheus' text exposition format."""
+        metrics = self.metrics
+        out = []
+
+        def labelled(name, labels, extra=()):
+            pairs = ",".join(f'{k}="{v}"' for k, v in tuple(labels) + tuple(extra))
+            return f"{name}{{{pairs}}}" if pairs else name
+
+        def histogram(name, help_text, series):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} histogram")
+            for labels, hist in series:
+                for le, count in hist.cumulative():
+                    out.append(f"{labelled(name + '_bucket', labels, [('le', le)])} {count}")
+                out.append(f"{labelled(name + '_sum', labels)} {hist.total}")
+                out.append(f"{labelled(name + '_count', labels)} {hist.count}")
+
+        def simple(name, kind, help_text, series):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                out.append(f"{labelled(name, labels)} {value}")
+
+        histogram(
+            "leaguecog_loop_seconds",
+            "Duration of a full check_games loop.",
+            [((), metrics.loops)],
+        )
+        histogram(
+            "leaguecog_phase_seconds",
+            "Duration of each phase of the poll loop and its helpers.",
+            [((("phase", phase),), hist) for phase, hist in sorted(metrics.phases.items())],
+        )
+        histogram(
+            "leaguecog_riot_request_seconds",
+            "Latency of each Riot API attempt.",
+            [
+                ((("region", region), ("method", method)), hist)
+                for (region, method), hist in sorted(metrics.requests.items())
+            ],
+        )
+        simple(
+            "leaguecog_riot_responses_total",
+            "counter",
+            "Riot API responses by status, 'error' if none came back.",
+            [
+                ((("region", r), ("method", m), ("status", s)), n)
+                for (r, m, s), n in sorted(metrics.responses.items())
+            ],
+        )
+        simple(
+            "leaguecog_loop_overruns_total",
+            "counter",
+            "Loops that took longer than the refresh timer.",
+            [((), metrics.overruns)],
+        )
+        simple(
+            "leaguecog_refresh_timer_seconds",
+            "gauge",
+            "Seconds between loops.",
+            [((), metrics.refresh_timer)],
+        )
+        headroom = sorted(self.api_keys.headroom().items())
+        simple(
+            "leaguecog_rate_limit_remaining",
+            "gauge",
+            "Requests left in the tightest rate limit window.",
+            [((("region", r), ("scope", s)), left) for (r, s), (left, _) in headroom],
+        )
+        simple(
+            "leaguecog_rate_limit_limit",
+            "gauge",
+            "Size of the tightest rate limit window.",
+            [((("region", r), ("scope", s)), limit) for (r, s), (_, limit) in headroom],
+        )
+        simple(
+            "leaguecog_queue_depth",
+            "gauge",
+            "Items waiting in the cog's queues.",
+            [((("queue", queue),), depth) for queue, depth in self.queue_depths().items()],
+        )
+        return "\n".join(out) + "\n"
+
+    async def _serve_metrics(self, request):
+        return web.Response(text=self.prometheus_text(), content_type="text/plain")
+
+    async def start_metrics_server(self, port: int):
+        """Serves prometheus_text on http://127.0.0.1:<port>/metrics."""
+        await self.stop_metrics_server()
+        app = web.Application()
+        app.router.add_get("/metrics", self._serve_metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+        except OSError:
+            await runner.cleanup()
+            raise
+        self._metrics_runner = runner
+        log.debug(f"Serving metrics on 127.0.0.1:{port}")
+
+    async def stop_metrics_server(self):
+        if self._metrics_runner:
+            await self._metrics_runner.cleanup()
+            self._metrics_runner = None
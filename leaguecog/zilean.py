@@ -1,72 +1,556 @@
 import asyncio
+import heapq
 import logging
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
+from .blitzcrank import SPECTATOR_METHOD
 from .mixinmeta import MixInMeta
 
 
 log = logging.getLogger("red.creamy-cogs.league")
 
+# Development key limits, used until Riot tells us what the key really allows.
+DEFAULT_APP_RATE_LIMIT = "20:1,100:120"
+
+
+def parse_rate_limits(header: Optional[str]) -> List[Tuple[int, int]]:
+    """
+    Turns a Riot rate limit header like '20:1,100:120' into [(20, 1), (100, 120)].
+    The same format is used for the limits and their -Count headers.
+    """
+    pairs = []
+    if not header:
+        return pairs
+    for chunk in header.split(","):
+        try:
+            first, seconds = chunk.split(":")
+            pairs.append((int(first), int(seconds)))
+        except ValueError:
+            log.debug(f"Skipping malformed rate limit chunk '{chunk}'")
+    return pairs
+
+
+class RateLimitWindow:
+    """
+    A single Riot rate limit bucket, e.g. 100 requests every 120 seconds.
+
+    Riot starts a window on the first request made inside it and hands all
+        of the tokens back at once when it rolls over.
+    """
+
+    __slots__ = ("limit", "seconds", "used", "resets_at")
+
+    def __init__(self, limit: int, seconds: int):
+        self.limit = limit
+        self.seconds = seconds
+        self.used = 0
+        self.resets_at = 0.0
+
+    def _roll(self, now: float):
+        if self.resets_at and now >= self.resets_at:
+            self.used = 0
+            self.resets_at = 0.0
+
+    @property
+    def remaining(self) -> int:
+        self._roll(time.monotonic())
+        return max(self.limit - self.used, 0)
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available in this window."""
+        self._roll(now)
+        if self.used < self.limit:
+            return 0.0
+        return self.resets_at - now
+
+    def consume(self, now: float):
+        self._roll(now)
+        if not self.resets_at:
+            self.resets_at = now + self.seconds
+        self.used += 1
+
+    def sync(self, count: int, now: float):
+        """Riot's count wins if it has seen more requests than we have (ie. another process)."""
+        self._roll(now)
+        if count > self.used:
+            if not self.resets_at:
+                self.resets_at = now + self.seconds
+            self.used = count
+
+
+class RateLimiter:
+    """
+    Token buckets for both the app and method rate limits of the Riot API.
+
+    Riot enforces limits per platform routing value (na1, euw1, ...),
+        so every region gets its own set of buckets. The limits and counts
+        are taken from the X-App-Rate-Limit / X-Method-Rate-Limit headers
+        (and their -Count counterparts) of every response, and a Retry-After
+        on a 429 blocks the offending bucket until Riot lets us back in.
+    """
+
+    def __init__(self, app_limits: str = DEFAULT_APP_RATE_LIMIT):
+        self.app_limits: List[Tuple[int, int]] = parse_rate_limits(app_limits)
+        self.method_limits: Dict[str, List[Tuple[int, int]]] = {}
+        self._app_windows: Dict[str, List[RateLimitWindow]] = {}
+        self._method_windows: Dict[Tuple[str, str], List[RateLimitWindow]] = {}
+        # keyed by region for application limits, (region, method) for everything else
+        self._blocked_until: Dict[object, float] = {}
+        # flipped whenever Riot reports limits that differ from what we were using,
+        #   so Zilean knows to recalculate the refresh timer
+        self.limits_changed = False
+
+    @staticmethod
+    def _build(limits: List[Tuple[int, int]], old: List[RateLimitWindow]):
+        """Build buckets for the given limits, carrying over counts for unchanged windows."""
+        previous = {w.seconds: w for w in old}
+        windows = []
+        for limit, seconds in limits:
+            window = RateLimitWindow(limit, seconds)
+            if seconds in previous:
+                window.used = previous[seconds].used
+                window.resets_at = previous[seconds].resets_at
+            windows.append(window)
+        return windows
+
+    def _windows(self, region: str, method: str) -> List[RateLimitWindow]:
+        app = self._app_windows.get(region)
+        if app is None or [(w.limit, w.seconds) for w in app] != self.app_limits:
+            app = self._app_windows[region] = self._build(self.app_limits, app or [])
+        key = (region, method)
+        limits = self.method_limits.get(method, [])
+        windows = self._method_windows.get(key)
+        if windows is None or [(w.limit, w.seconds) for w in windows] != limits:
+            windows = self._method_windows[key] = self._build(limits, windows or [])
+        return app + windows
+
+    def _retry_after(self, region: str, method: str, now: float) -> float:
+        blocked = max(
+            self._blocked_until.get(region, 0.0),
+            self._blocked_until.get((region, method), 0.0),
+        )
+        return max(blocked - now, 0.0)
+
+    async def acquire(self, region: str, method: str):
+        """Wait until both the app and method buckets for this region have a token, then take it."""
+        while True:
+            now = time.monotonic()
+            windows = self._windows(region, method)
+            delay = max([w.delay(now) for w in windows] + [self._retry_after(region, method, now)])
+            if delay <= 0:
+                # No awaits between checking and consuming, so this is safe across tasks.
+                for window in windows:
+                    window.consume(now)
+                return
+            log.debug(f"Rate limited on {region} {method}, waiting {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def update(self, region: str, method: str, headers, status: int):
+        """Sync our buckets with the rate limit headers of a Riot response."""
+        now = time.monotonic()
+
+        app_limits = parse_rate_limits(headers.get("X-App-Rate-Limit"))
+        if app_limits and app_limits != self.app_limits:
+            log.debug(f"App rate limits changed to {app_limits}")
+            self.app_limits = app_limits
+            self.limits_changed = True
+        method_limits = parse_rate_limits(headers.get("X-Method-Rate-Limit"))
+        if method_limits and method_limits != self.method_limits.get(method):
+            log.debug(f"Method rate limits for {method} changed to {method_limits}")
+            self.method_limits[method] = method_limits
+            self.limits_changed = True
+
+        windows = self._windows(region, method)
+        app = {w.seconds: w for w in windows[: len(self.app_limits)]}
+        for count, seconds in parse_rate_limits(headers.get("X-App-Rate-Limit-Count")):
+            if seconds in app:
+                app[seconds].sync(count, now)
+        methods = {w.seconds: w for w in windows[len(self.app_limits) :]}
+        for count, seconds in parse_rate_limits(headers.get("X-Method-Rate-Limit-Count")):
+            if seconds in methods:
+                methods[seconds].sync(count, now)
+
+        if status == 429:
+            try:
+                retry_after = float(headers.get("Retry-After", 1))
+            except ValueError:
+                retry_after = 1.0
+            # Only an application 429 should hold up every other endpoint in the region.
+            if headers.get("X-Rate-Limit-Type") == "application":
+                key = region
+            else:
+                key = (region, method)
+            self._blocked_until[key] = max(self._blocked_until.get(key, 0.0), now + retry_after)
+            log.warning(f"429 from Riot on {region} {method}, backing off for {retry_after}s")
+
+    def loop_limits(self, method: str) -> List[Tuple[int, int]]:
+        """Every (limit, seconds) window a request to this method counts against."""
+        return self.app_limits + self.method_limits.get(method, [])
+
+    def budget(self, region: str, method: str) -> float:
+        """Share of the tightest window still left for this region and method, 0 while blocked."""
+        if self._retry_after(region, method, time.monotonic()) > 0:
+            return 0.0
+        windows = self._windows(region, method)
+        return min((w.remaining / w.limit for w in windows if w.limit), default=1.0)
+
+    def headroom(self) -> Dict[Tuple[str, str], Tuple[int, int]]:
+        """
+        (region, scope) -> (remaining, limit) of the window closest to running out,
+            scope is 'app' for the application limits or the method name.
+        """
+        tightest = {}
+        scoped = [((region, "app"), w) for region, w in self._app_windows.items()]
+        scoped += [((region, method), w) for (region, method), w in self._method_windows.items()]
+        for key, windows in scoped:
+            if windows:
+                window = min(windows, key=lambda w: w.remaining / w.limit)
+                tightest[key] = (window.remaining, window.limit)
+        return tightest
+
+
+class ApiKey:
+    """One Riot API key and the rate limit buckets Riot keeps for it."""
+
+    __slots__ = ("name", "token", "limiter")
+
+    def __init__(self, name: str, token: str):
+        self.name = name
+        self.token = token
+        self.limiter = RateLimiter()
+
+
+class ApiKeyPool:
+    """
+    Every key set for the `league` service whose name starts with api_key
+        (api_key, api_key2, api_key_backup, ...).
+
+    Riot rate limits each key separately, so every key gets its own RateLimiter
+        and each request goes to whichever key has the most budget left for it.
+        A key Riot rejects with a 401/403 is dropped from the pool until the
+        tokens are set again, the others carry on.
+
+    Summoner ids and puuids are encrypted per application, so they only work with
+        the key that looked them up. Requests about a registered summoner are pinned
+        to that key's name, only lookups by name are free to use any of them.
+        A key's token can be renewed under the same name, but removing the key
+        (or giving its name to another application) means they have to register again.
+    """
+
+    PREFIX = "api_key"
+
+    def __init__(self):
+        self.keys: Dict[str, ApiKey] = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.keys
+
+    def load(self, tokens: Dict[str, str]):
+        """(Re)builds the pool from the shared api tokens, keeping the buckets of unchanged keys."""
+        keys = {}
+        for name, token in sorted(tokens.items()):
+            if not name.startswith(self.PREFIX) or not token:
+                continue
+            old = self.keys.get(name)
+            keys[name] = old if old and old.token == token else ApiKey(name, token)
+        self.keys = keys
+        log.debug(f"Loaded {len(keys)} Riot API key(s).")
+
+    def drop(self, name: str):
+        self.keys.pop(name, None)
+
+    def choose(self, region: str, method: str, name: Optional[str] = None) -> Optional[ApiKey]:
+        """
+        The key with the most budget left for this request, or the key called name
+            if the request is pinned to one. None if there isn't one.
+        """
+        if name is not None:
+            return self.keys.get(name)
+        if not self.keys:
+            return None
+        return max(self.keys.values(), key=lambda key: key.limiter.budget(region, method))
+
+    @property
+    def limits_changed(self) -> bool:
+        return any(key.limiter.limits_changed for key in self.keys.values())
+
+    @limits_changed.setter
+    def limits_changed(self, value: bool):
+        for key in self.keys.values():
+            key.limiter.limits_changed = value
+
+    def loop_limits(self, method: str) -> List[Tuple[int, int]]:
+        """The pool's combined windows: the limits of every key with the same length added up."""
+        if not self.keys:
+            return RateLimiter().loop_limits(method)
+        combined = defaultdict(int)
+        for key in self.keys.values():
+            for limit, seconds in key.limiter.loop_limits(method):
+                combined[seconds] += limit
+        return [(limit, seconds) for seconds, limit in sorted(combined.items())]
+
+    def headroom(self) -> Dict[Tuple[str, str], Tuple[int, int]]:
+        """RateLimiter.headroom for every key, scopes are prefixed by key name if there are several."""
+        headroom = {}
+        for key in self.keys.values():
+            for (region, scope), value in key.limiter.headroom().items():
+                if len(self.keys) > 1:
+                    scope = f"{key.name} {scope}"
+                headroom[(region, scope)] = value
+        return headroom
+
+
+class PollScheduler:
+    """
+    Decides which summoners each check_games loop should ask Riot about.
+
+    Every summoner is checked once every `factor` loops, kept in a priority queue
+        keyed on the loop they are next due in:
+            * summoners in a game, or who finished one recently, are checked every loop
+            * summoners who usually play at this hour are checked at least every other loop
+            * everyone else backs off by one loop per hour they have been idle,
+                up to MAX_BACKOFF loops
+
+    load keeps the expected requests per loop for each region (the sum of 1 / factor),
+        which is what Zilean budgets the refresh timer on.
+
+    activity only holds summoners we poll and have seen in a game, the game
+        history keeps it across reloads (see Zilean.save_activity).
+    """
+
+    RECENTLY_PLAYED = 30 * 60
+    MAX_BACKOFF = 12
+
+    def __init__(self):
+        self.loop = 0
+        self._heap: List[Tuple[int, Tuple[str, str]]] = []
+        self._due: Dict[Tuple[str, str], int] = {}
+        self._factor: Dict[Tuple[str, str], int] = {}
+        self.load: Dict[str, float] = defaultdict(float)
+        # "region:summoner_id" -> {"last_seen": unix time last seen in game, "hours": games per UTC hour}
+        self.activity: Dict[str, dict] = {}
+        # the last game counted for each summoner, so a game is only counted once
+        self._last_game: Dict[Tuple[str, str], int] = {}
+        self._first_polled: Dict[Tuple[str, str], float] = {}
+
+    @staticmethod
+    def activity_key(summoner: Tuple[str, str]) -> str:
+        return f"{summoner[0]}:{summoner[1]}"
+
+    def next_loop(self, summoners: Iterable[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+        """Starts a new loop, returning which of these summoners are due to be checked."""
+        self.loop += 1
+        due = set()
+        while self._heap and self._heap[0][0] <= self.loop:
+            loop, summoner = heapq.heappop(self._heap)
+            # skip stale heap entries for summoners that were rescheduled since
+            if self._due.get(summoner) == loop:
+                due.add(summoner)
+        current = set(summoners)
+        for summoner in set(self._factor) - current:
+            self.forget(summoner)
+        # anyone we haven't scheduled yet (ie. just registered) is due right away
+        due |= {summoner for summoner in current if summoner not in self._due}
+        return due & current
+
+    def factor(self, summoner: Tuple[str, str], in_game: bool, now: float) -> int:
+        if in_game:
+            return 1
+        activity = self.activity.get(self.activity_key(summoner))
+        # someone we've never seen in a game counts as idle since we started polling them
+        last_seen = activity["last_seen"] if activity else self._first_polled[summoner]
+        idle = now - last_seen
+        if idle < self.RECENTLY_PLAYED:
+            return 1
+        backoff = int(min(1 + idle // 3600, self.MAX_BACKOFF))
+        hours = activity["hours"] if activity else []
+        hour = datetime.utcfromtimestamp(now).hour
+        # "usually plays now" is at least twice their average share of games in this hour
+        if sum(hours) and hours[hour] * 24 >= 2 * sum(hours):
+            return min(2, backoff)
+        return backoff
+
+    def schedule(self, summoner: Tuple[str, str], in_game: bool, now: float):
+        """Works out when a summoner we just heard about should next be checked."""
+        self._first_polled.setdefault(summoner, now)
+        if in_game:
+            activity = self.activity.setdefault(
+                self.activity_key(summoner), {"last_seen": now, "hours": [0] * 24}
+            )
+            activity["last_seen"] = now
+        factor = self.factor(summoner, in_game, now)
+        if summoner in self._factor:
+            self.load[summoner[0]] -= 1 / self._factor[summoner]
+        self.load[summoner[0]] += 1 / factor
+        self._factor[summoner] = factor
+        self._due[summoner] = self.loop + factor
+        heapq.heappush(self._heap, (self.loop + factor, summoner))
+
+    def record_game(self, summoner: Tuple[str, str], game_id: int, now: float) -> bool:
+        """
+        Counts a game start towards the hours this summoner usually plays in.
+        Returns False if this game was already counted.
+        """
+        if self._last_game.get(summoner) == game_id:
+            return False
+        self._last_game[summoner] = game_id
+        activity = self.activity.setdefault(
+            self.activity_key(summoner), {"last_seen": now, "hours": [0] * 24}
+        )
+        activity["last_seen"] = now
+        activity["hours"][datetime.utcfromtimestamp(now).hour] += 1
+        return True
+
+    def forget(self, summoner: Tuple[str, str]):
+        factor = self._factor.pop(summoner, None)
+        if factor:
+            self.load[summoner[0]] -= 1 / factor
+            if self.load[summoner[0]] <= 1e-9:
+                del self.load[summoner[0]]
+        self._due.pop(summoner, None)
+        self._last_game.pop(summoner, None)
+        self._first_polled.pop(summoner, None)
+        # the game history still has it, this only keeps memory to who we poll
+        self.activity.pop(self.activity_key(summoner), None)
+
 
 class Zilean(MixInMeta):
     """
     'All in good time.'
 
     This class dynamically calculates refresh time for the bot
-        based on registered summoners, so as to not hit throttle limit:
+        based on registered summoners, so as to not hit throttle limit.
+
+    The throttle limits aren't hard-coded anymore: they come from the rate limit
+        headers on every Riot response (see RateLimiter), and default to a
+        development key's limits until the first response comes back:
             *  20 requests every 1 seconds(s)
             *  100 requests every 2 minutes(s)
 
     Since the API token is used for the singular bot instance, it will
         take into acount total registered users across all guilds.
+        Riot budgets every region (na1, euw1, ...) separately though, so the
+        region with the most polling summoners is what sets the pace, and
+        check_games drains each region's queue in parallel.
 
-    NOTE overhead_ratio and reqs_per_loop can be changed to provide
-        more or less overhead and adjust requests per check_games loop
-            per summoner as needed.
+    NOTE overhead_ratio can be changed to provide more or less overhead
+        for requests made outside of the check_games loop.
     """
 
+    async def run_per_region(self, work, handler):
+        """
+        Drains a queue per region in parallel, with up to max_concurrent_requests workers each.
+        Riot rate limits every region separately, so a region that is being throttled
+            only holds up its own queue.
+
+        work maps a region to the items to handle, handler is awaited once per item.
+        """
+
+        async def worker(region, queue):
+            while not queue.empty():
+                item = queue.get_nowait()
+                try:
+                    await handler(item)
+                except Exception as error:
+                    log.exception(f"Failed to handle {item} in {region}:", exc_info=error)
+
+        workers = []
+        for region, items in work.items():
+            queue = asyncio.Queue()
+            for item in items:
+                queue.put_nowait(item)
+            for _ in range(min(self.max_concurrent_requests, len(items))):
+                workers.append(worker(region, queue))
+        await asyncio.gather(*workers)
+
+    def save_activity(self, summoner: Tuple[str, str], now: float, started: bool = False):
+        """Stores when a summoner was in game, so the scheduler still knows it after a reload."""
+        if self.history:
+            key = self.scheduler.activity_key(summoner)
+            self._history_write(self.history.record_activity, key, now, started)
+
+    async def load_activity(self):
+        """
+        Loads what the game history knows about when the roster's summoners play,
+            dropping anyone who isn't on it anymore.
+        """
+        if not self.history:
+            return
+        # activity used to be a single Config value, rewritten on every change
+        legacy = await self.config.summoner_activity()
+        if legacy:
+            await self._history_call(self.history.import_activity, legacy)
+            await self.config.summoner_activity.clear()
+        keep = {
+            self.scheduler.activity_key((entry.region, entry.summoner_id))
+            for members in self.roster.values()
+            for entry in members.values()
+        }
+        self.scheduler.activity = await self._history_call(self.history.load_activity, keep)
+
     async def calculate_cooldown(self):
         """
-        Counts up all of the users registered with [p]league set-summoner,
+        Takes the number of users registered with [p]league set-summoner that are polling,
             and calculates how often to hit the API while avoiding hitting the cap.
         If no one has registered, counts registered users as 1.
-            This way, effectively the default refresh_timer is 4.8 seconds.
         """
         log.debug("Calculating cooldown...")
-        total_polling_users = 0
-        guilds = await self.config.all_guilds()
-        # check to see if polling is enabled for the guild
-        #   if True, only count members who currently have polling enabled
-        for guildId in guilds:
-            guild = await self.bot.fetch_guild(guildId)
-            poll_guild_games = await self.config.guild(guild).poll_guild_games()
-            if poll_guild_games:
-                guild_members = await self.config.all_members(guild=guild)
-                for userId in guild_members:
-                    user = await self.bot.get_or_fetch_user(userId)
-                    poll_user_games = await self.config.user(user).poll_user_games()
-                    if poll_user_games:
-                        total_polling_users += 1
+        self.total_polling_users = self._budgeted_users()
+        await self.refresh_cooldown()
+
+    def _budgeted_users(self) -> int:
+        """How many spectator requests the busiest region is expected to make per loop."""
+        # polling_counts is kept up to date by the roster, so this is O(1).
+        #   A summoner tracked in several guilds is only requested once per loop,
+        #   and every region has its own budget, so the busiest region sets the pace.
+        total_polling_users = max(self.polling_counts.by_region.values(), default=0)
+        # Sharded, we poll a slice of every process's summoners rather than all of ours.
+        if self.shard and self.scheduler.load:
+            total_polling_users = max(self.scheduler.load.values())
+        # Idle summoners aren't checked every loop, budget on what the scheduler expects to send.
+        if self.scheduler.load:
+            total_polling_users = min(
+                total_polling_users, max(1, round(max(self.scheduler.load.values())))
+            )
         # if no one has registered, set total_polling_users to 1
         #   this way, refresh_timer doesn't get set to 0 seconds
-        if not total_polling_users:
-            total_polling_users = 1
+        return max(total_polling_users, 1)
+
+    def cooldown_drifted(self) -> bool:
+        """True once the scheduler's load has moved far enough (10%) to be worth a new refresh timer."""
+        budgeted = self._budgeted_users()
+        return abs(budgeted - self.total_polling_users) >= max(1, self.total_polling_users * 0.1)
+
+    async def refresh_cooldown(self):
+        """
+        Recalculates the refresh timer from the last polling user count and
+            the rate limits Riot has most recently reported for our keys.
+        """
+        self.api_keys.limits_changed = False
 
         # leave bandwidth for some non-looping functions like set-summoner
-        #   and account for multiple requests in each loop
-        overhead_ratio = 0.75
-        reqs_per_loop = 3
+        overhead_ratio = 0.9
 
-        # calculate the refresh timer, and round it off to 2 decimal places
+        # each unique polling summoner costs one spectator request per check_games loop.
+        #   the slowest window decides how long we have to wait between loops.
 
-        #  ( 120 seconds * # of users * requests per loop )
-        # -------------------------------------------------- = seconds between each loop
-        #      (  100 requests * overhead ratio )
+        #  ( window seconds * # of users )
+        # ---------------------------------- = seconds between each loop
+        #  ( window requests * overhead ratio )
 
-        cooldown = round(
-            ((120 * total_polling_users * reqs_per_loop) / (100 * overhead_ratio)),
-            2,  # round to 2 decimal places
+        cooldown = max(
+            (seconds * self.total_polling_users) / (limit * overhead_ratio)
+            for limit, seconds in self.api_keys.loop_limits(SPECTATOR_METHOD)
         )
+        # round it off to 2 decimal places
+        cooldown = round(cooldown, 2)
         await self.config.refresh_timer.set(cooldown)
         log.debug(
-            f"total registered users = {total_polling_users}, refresh timer cooldown = {cooldown}s"
+            f"total registered users = {self.total_polling_users}, refresh timer cooldown = {cooldown}s"
         )